@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from core_data_modules.logging import Logger
+from dateutil.parser import isoparse
+
+from preprocess_recovered_hormuud_messages import (MESSAGE_FILE_FORMATS, get_incoming_hormuud_messages_from_rapid_pro,
+                                                   get_incoming_hormuud_messages_from_recovery_csv, get_run_arguments,
+                                                   plan_recovery_windows, recover_messages)
+
+log = Logger(__name__)
+
+# Operators whose recovery CSVs can be preprocessed. Golis recovery CSVs use a different format and are sent from a
+# different range of urns, so can't be matched using the Hormuud loader and Rapid Pro filter.
+SUPPORTED_OPERATORS = {"hormuud"}
+
+
+def load_recovery_jobs(manifest_path):
+    """
+    Loads the recovery jobs to run from a JSON manifest.
+
+    The manifest is a list of objects, one per recovery CSV, with the keys:
+     - "operator": Operator that issued the recovery CSV. Only "hormuud" is supported.
+     - "csv_path": Path to the recovery CSV.
+     - "start_date": Timestamp to filter both datasets by (inclusive), as an ISO8601 str.
+     - "end_date": Timestamp to filter both datasets by (exclusive), as an ISO8601 str.
+     - "log_dir_path": Directory to log the matched messages to.
+     - "skipped_csv_path": Path to CSV to write the skipped messages to.
+     - "output_csv_path": File to write the filtered, recovered data to.
+    The skipped and output files are written in the format given by the extension of their paths, as described in
+    `preprocess_recovered_hormuud_messages.MessageWriter`.
+
+    :param manifest_path: Path to the JSON manifest to load.
+    :type manifest_path: str
+    :return: Recovery jobs, with "start_date" and "end_date" parsed to datetimes.
+    :rtype: list of dict
+    """
+    with open(manifest_path) as f:
+        jobs = json.load(f)
+
+    for job in jobs:
+        job["start_date"] = isoparse(job["start_date"])
+        job["end_date"] = isoparse(job["end_date"])
+
+    return jobs
+
+
+def run_recovery_job(job, rapid_pro_messages, rapid_pro_domain, resume=False, log_format="csv"):
+    """
+    Preprocesses one recovery CSV in a batch.
+
+    :param job: Recovery job to run, as loaded by `load_recovery_jobs`.
+    :type job: dict
+    :param rapid_pro_messages: Incoming messages downloaded from Rapid Pro that were created in the job's date range.
+    :type rapid_pro_messages: list of temba_client.v2.Message
+    :param rapid_pro_domain: URL of the Rapid Pro server the messages were downloaded from, to check that checkpoints
+                             are only resumed from by runs against the same server.
+    :type rapid_pro_domain: str
+    :param resume: Whether to resume matching from the checkpoints saved in the job's log directory by a previous run.
+    :type resume: bool
+    :param log_format: Format to write the logs of matched messages in. One of `MESSAGE_FILE_FORMATS`.
+    :type log_format: str
+    :return: Whether the job's messages were all matched as expected and the outputs were exported.
+    :rtype: bool
+    """
+    recovery_windows = plan_recovery_windows(job["start_date"], job["end_date"])
+    log.info(f"Preprocessing {job['csv_path']} ({job['start_date'].isoformat()} to {job['end_date'].isoformat()}) "
+             f"against {len(rapid_pro_messages)} Rapid Pro messages, in {len(recovery_windows)} max_time_delta "
+             f"windows")
+    recovered_message_store = get_incoming_hormuud_messages_from_recovery_csv(
+        job["csv_path"], received_after_inclusive=job["start_date"], received_before_exclusive=job["end_date"]
+    )
+
+    checkpoint_dir_path = f"{job['log_dir_path']}/checkpoints"
+    os.makedirs(checkpoint_dir_path, exist_ok=True)
+
+    try:
+        return recover_messages(
+            rapid_pro_messages, recovered_message_store, recovery_windows,
+            job["log_dir_path"], job["skipped_csv_path"], job["output_csv_path"],
+            checkpoint_dir_path=checkpoint_dir_path, resume=resume, log_format=log_format,
+            run_arguments=get_run_arguments(job["start_date"], job["end_date"], rapid_pro_domain, job["csv_path"])
+        )
+    except ValueError as e:
+        log.error(str(e))
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs preprocess_recovered_hormuud_messages.py over a batch of recovery CSVs. The Rapid Pro "
+                    "messages are downloaded once, for the union of all the CSVs' date ranges, then each CSV is "
+                    "matched against the Rapid Pro messages created in its own date range")
+
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of recovery CSVs to preprocess in parallel. Defaults to 1, which preprocesses "
+                             "each CSV in turn in this process")
+    parser.add_argument("--rapid-pro-cache-dir", metavar="rapid-pro-cache-dir",
+                        help="Directory to cache the messages downloaded from Rapid Pro in. When re-running over "
+                             "overlapping date ranges, only the messages that are not already in this cache are "
+                             "downloaded")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume matching each recovery CSV from the checkpoints saved in its log directory by a "
+                             "previous run of this manifest that was interrupted")
+    parser.add_argument("--log-format", choices=MESSAGE_FILE_FORMATS, default="csv",
+                        help="Format to write the logs of matched messages in. Defaults to csv")
+    parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
+                        help="Path to a Google Cloud service account credentials file to use to access the "
+                             "credentials bucket")
+    parser.add_argument("rapid_pro_domain", metavar="rapid-pro-domain",
+                        help="URL of the Rapid Pro server to download data from")
+    parser.add_argument("rapid_pro_token_file_url", metavar="rapid-pro-token-file-url",
+                        help="GS URL of a text file containing the authorisation token for the Rapid Pro server")
+    parser.add_argument("manifest_path", metavar="manifest-path",
+                        help="Path to a JSON manifest listing the recovery CSVs to preprocess. See "
+                             "`load_recovery_jobs` for the format")
+
+    args = parser.parse_args()
+
+    workers = args.workers
+    rapid_pro_cache_dir = args.rapid_pro_cache_dir
+    resume = args.resume
+    log_format = args.log_format
+    google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
+    rapid_pro_domain = args.rapid_pro_domain
+    rapid_pro_token_file_url = args.rapid_pro_token_file_url
+    manifest_path = args.manifest_path
+
+    jobs = load_recovery_jobs(manifest_path)
+    log.info(f"Loaded {len(jobs)} recovery jobs from {manifest_path}")
+
+    # Check every job can be run before downloading anything, so that a mistake in the manifest fails fast.
+    for job in jobs:
+        if job["operator"] not in SUPPORTED_OPERATORS:
+            log.error(f"Unsupported operator '{job['operator']}' for recovery CSV {job['csv_path']}. "
+                      f"Supported operators are {sorted(SUPPORTED_OPERATORS)}")
+            exit(1)
+        if job["start_date"] >= job["end_date"]:
+            log.error(f"start_date {job['start_date'].isoformat()} must be before end_date "
+                      f"{job['end_date'].isoformat()} for recovery CSV {job['csv_path']}")
+            exit(1)
+
+    # Download the Rapid Pro messages for all the jobs at once, then give each job the messages from its date range.
+    rapid_pro_messages = get_incoming_hormuud_messages_from_rapid_pro(
+        google_cloud_credentials_file_path, rapid_pro_domain, rapid_pro_token_file_url,
+        created_after_inclusive=min(job["start_date"] for job in jobs),
+        created_before_exclusive=max(job["end_date"] for job in jobs),
+        cache_dir=rapid_pro_cache_dir
+    )
+    rapid_pro_messages_by_job = [
+        [msg for msg in rapid_pro_messages if job["start_date"] <= msg.created_on < job["end_date"]]
+        for job in jobs
+    ]
+
+    if workers == 1:
+        results = list(map(run_recovery_job, jobs, rapid_pro_messages_by_job, [rapid_pro_domain] * len(jobs),
+                           [resume] * len(jobs), [log_format] * len(jobs)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_recovery_job, jobs, rapid_pro_messages_by_job,
+                                        [rapid_pro_domain] * len(jobs), [resume] * len(jobs),
+                                        [log_format] * len(jobs)))
+
+    failed_jobs = [job for job, succeeded in zip(jobs, results) if not succeeded]
+    if len(failed_jobs) > 0:
+        log.error(f"{len(failed_jobs)}/{len(jobs)} recovery jobs failed: {[job['csv_path'] for job in failed_jobs]}")
+        exit(1)
+    log.info(f"Preprocessed all {len(jobs)} recovery CSVs")
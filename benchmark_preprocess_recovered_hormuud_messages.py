@@ -0,0 +1,308 @@
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from core_data_modules.logging import Logger
+from temba_client.v2 import Message as RapidProMessage
+
+from preprocess_recovered_hormuud_messages import (HORMUUD_TZINFO, TARGET_SHORTCODE, RecoveredMessageIndex,
+                                                   apply_match_strategy, create_match_strategies, excel_mangle_text,
+                                                   get_incoming_hormuud_messages_from_recovery_csv,
+                                                   group_recovered_messages_by_urn, recover_messages)
+
+log = Logger(__name__)
+
+# Texts to sample synthetic messages from, covering the kinds of message that each match strategy handles:
+# short answers, numbers that Excel re-formats, formulae, quoted text, non-ascii text and long free-text answers
+# that are prone to being clipped.
+SAMPLE_TEXTS = [
+    "Haa", "Maya", "yes", "no", "1", "2", "3", "25", "061234567", "252612345678901", "=2+2", "\"waan ku raacsanahay\"",
+    "Waxaan rabaa in dowladda ay horumariso waxbarashada carruurta",
+    "Nabad iyo caano, tani waa fikradayda ku saabsan doorashooyinka soo socda ee gobolka",
+    "Amniga ayaa ugu muhiimsan, waayo haddii aan amni jirin ma jiri karto horumar dhaqaale ama mid bulsho",
+    "Caafimaad – isbitaalada waa in la dhiso",
+    "Biyo nadiif ah iyo waddooyin ayaan u baahanahay"
+]
+
+# Only sample texts at least this long are clipped, to somewhere in their second half, so that a clipped text can't be
+# the same as another generated text and be matched with the wrong Rapid Pro message.
+MIN_CLIPPED_TEXT_LENGTH = 20
+
+# Date that the synthetic messages start being sent on, by default, and the number of days they are sent over.
+DATASET_START_DATE = datetime(2022, 9, 1, tzinfo=timezone.utc)
+DATASET_DAYS = 30
+
+# Maximum delay between a message and its duplicate.
+MAX_DUPLICATE_DELAY_SECONDS = 60
+
+
+def generate_dataset(message_count, urn_count, max_time_delta, loss_rate, mangle_rate, clip_rate, resend_rate,
+                     duplicate_rate, other_shortcode_rate, csv_path, seed=0, start_date=DATASET_START_DATE):
+    """
+    Generates a synthetic pair of Rapid Pro and Hormuud recovery datasets.
+
+    Each synthetic message is received by Hormuud and written to the recovery CSV. Unless it is lost, it is also
+    received by Rapid Pro up to `max_time_delta` before Hormuud's timestamp, so every Rapid Pro message has a
+    counterpart in the recovery CSV and all of them can be matched, apart from the duplicates that Rapid Pro receives
+    twice, which are skipped.
+
+    :param message_count: Number of messages to generate.
+    :type message_count: int
+    :param urn_count: Number of urns to send the messages from.
+    :type urn_count: int
+    :param max_time_delta: Maximum delay between a message being received by Rapid Pro and by Hormuud.
+    :type max_time_delta: timedelta
+    :param loss_rate: Proportion of messages that are in the recovery CSV but not in Rapid Pro.
+    :type loss_rate: float
+    :param mangle_rate: Proportion of messages whose text is mangled by Excel in the recovery CSV.
+    :type mangle_rate: float
+    :param clip_rate: Proportion of messages whose text is clipped in the recovery CSV.
+    :type clip_rate: float
+    :param resend_rate: Proportion of messages that are sent twice in quick succession, so that both datasets
+                        contain the same text from the same urn twice.
+    :type resend_rate: float
+    :param duplicate_rate: Proportion of messages that are received by Rapid Pro twice but are only in the recovery
+                           CSV once. `Duplicates` can only skip a message while its urn has recovered messages that
+                           haven't been matched, so these are only generated for urns that also have a message with
+                           a different text that was lost by Rapid Pro, and the actual proportion is lower.
+    :type duplicate_rate: float
+    :param other_shortcode_rate: Proportion of extra rows to add to the recovery CSV for messages sent to other
+                                 short codes.
+    :type other_shortcode_rate: float
+    :param csv_path: Path to write the recovery CSV to.
+    :type csv_path: str
+    :param seed: Seed for the random number generator, so that datasets are reproducible.
+    :type seed: int
+    :param start_date: Date to start sending the messages on.
+    :type start_date: datetime
+    :return: Tuple of (incoming Rapid Pro messages, sorted by sent_on,
+                       recovery window covering all the messages, in the format returned by `plan_recovery_windows`).
+    :rtype: (list of RapidProMessage, (datetime, datetime, timedelta))
+    """
+    rng = random.Random(seed)
+    window_start = start_date
+    max_delay_seconds = int(max_time_delta.total_seconds())
+    # Extend the window past the last day that messages are sent on, to include the latest time that they could be
+    # received by Hormuud.
+    window_seconds = DATASET_DAYS * 24 * 60 * 60 + MAX_DUPLICATE_DELAY_SECONDS + max_delay_seconds
+
+    rapid_pro_messages = []
+    lost_texts_by_urn = dict()  # of urn -> set of str
+    duplicates = []  # of (urn, text, sent_on)
+    with open(csv_path, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=["Sender", "Receiver", "Message", "ReceivedOn"])
+        writer.writeheader()
+
+        def write_message(urn, sample_text, text, sent_on):
+            """
+            Writes a message to the recovery CSV and, unless it is lost, adds it to the Rapid Pro messages.
+
+            :return: Whether the message was received by Rapid Pro and will be matched before the `Duplicates`
+                     strategy is applied, i.e. without being clipped.
+            :rtype: bool
+            """
+            received_on = sent_on + timedelta(seconds=rng.randint(0, max_delay_seconds))
+
+            recovered_text = text
+            clipped = False
+            r = rng.random()
+            if r < mangle_rate:
+                recovered_text = "#NAME?" if text.startswith("=") else excel_mangle_text(text)
+            elif r < mangle_rate + clip_rate and len(sample_text) >= MIN_CLIPPED_TEXT_LENGTH:
+                recovered_text = text[:rng.randint(len(sample_text) // 2, len(sample_text) - 1)]
+                clipped = True
+
+            writer.writerow({
+                "Sender": urn[len("tel:+"):],
+                "Receiver": TARGET_SHORTCODE,
+                "Message": recovered_text,
+                "ReceivedOn": received_on.astimezone(HORMUUD_TZINFO).strftime("%d/%m/%Y %H:%M:%S.%f")
+            })
+            if rng.random() < other_shortcode_rate:
+                writer.writerow({
+                    "Sender": urn[len("tel:+"):],
+                    "Receiver": "1234",
+                    "Message": text,
+                    "ReceivedOn": received_on.astimezone(HORMUUD_TZINFO).strftime("%d/%m/%Y %H:%M:%S.%f")
+                })
+
+            if rng.random() < loss_rate:
+                lost_texts_by_urn.setdefault(urn, set()).add(text)
+                return False
+            rapid_pro_messages.append(RapidProMessage.create(
+                id=len(rapid_pro_messages), urn=urn, text=text, sent_on=sent_on, created_on=sent_on, direction="in"
+            ))
+            return not clipped
+
+        for i in range(message_count):
+            urn = f"tel:+25261{rng.randrange(urn_count):07d}"
+            sample_text = rng.choice(SAMPLE_TEXTS)
+            text = sample_text
+            if rng.random() < 0.5:
+                text = f"{sample_text} {rng.randrange(1000)}"
+            sent_on = window_start + timedelta(seconds=rng.randrange(DATASET_DAYS * 24 * 60 * 60),
+                                               microseconds=rng.randrange(1000000))
+            matchable = write_message(urn, sample_text, text, sent_on)
+            r = rng.random()
+            duplicate_sent_on = sent_on + timedelta(seconds=rng.randint(1, MAX_DUPLICATE_DELAY_SECONDS))
+            if r < resend_rate:
+                write_message(urn, sample_text, text, duplicate_sent_on)
+            elif r < resend_rate + duplicate_rate and matchable:
+                duplicates.append((urn, text, duplicate_sent_on))
+
+    for urn, text, sent_on in duplicates:
+        # Only add the duplicate if it can't be matched with one of the lost messages instead of being skipped.
+        lost_texts = lost_texts_by_urn.get(urn, set())
+        if len(lost_texts) == 0 or text in lost_texts:
+            continue
+        rapid_pro_messages.append(RapidProMessage.create(
+            id=len(rapid_pro_messages), urn=urn, text=text, sent_on=sent_on, created_on=sent_on, direction="in"
+        ))
+
+    rapid_pro_messages.sort(key=lambda msg: msg.sent_on)
+    return rapid_pro_messages, (window_start, window_start + timedelta(seconds=window_seconds), max_time_delta)
+
+
+def benchmark_match_strategies(rapid_pro_messages, recovered_message_store, max_time_delta):
+    """
+    Times each match strategy, applied in sequence as in `match_messages`.
+
+    :return: Dictionary of strategy name -> dictionary of "seconds" and "matched", "skipped" and "unmatched" counts.
+    :rtype: dict of str -> dict
+    """
+    results = dict()
+    recovered_message_index = RecoveredMessageIndex(
+        recovered_message_store,
+        group_recovered_messages_by_urn(recovered_message_store, recovered_message_store.get_ids_sorted_by_timestamp())
+    )
+    matched_urns_and_texts = set()
+    for strategy in create_match_strategies(max_time_delta):
+        start = time.perf_counter()
+        matched_messages, skipped_messages, unmatched_messages = apply_match_strategy(
+            strategy, rapid_pro_messages, recovered_message_index, matched_urns_and_texts
+        )
+        seconds = time.perf_counter() - start
+
+        log.info(f"'{strategy.name}' took {seconds:.2f}s to match {len(rapid_pro_messages)} Rapid Pro messages: "
+                 f"{len(matched_messages)} matched, {len(skipped_messages)} skipped")
+        results[strategy.name] = {
+            "seconds": seconds,
+            "rapid_pro_messages": len(rapid_pro_messages),
+            "matched": len(matched_messages),
+            "skipped": len(skipped_messages),
+            "unmatched": len(unmatched_messages)
+        }
+        rapid_pro_messages = unmatched_messages
+
+    return results
+
+
+def benchmark_end_to_end(rapid_pro_messages, csv_path, recovery_window, output_dir, workers):
+    """
+    Times the processing that preprocess_recovered_hormuud_messages.py does after downloading the Rapid Pro messages:
+    loading the recovery CSV, then matching and exporting the logs and outputs with `recover_messages`.
+
+    :return: Tuple of (seconds taken, whether `recover_messages` matched all the messages and exported the outputs).
+    :rtype: (float, bool)
+    """
+    window_start, window_end, _ = recovery_window
+    log_dir_path = os.path.join(output_dir, "logs")
+    os.makedirs(log_dir_path)
+
+    start = time.perf_counter()
+    recovered_message_store = get_incoming_hormuud_messages_from_recovery_csv(
+        csv_path, received_after_inclusive=window_start, received_before_exclusive=window_end
+    )
+    succeeded = recover_messages(
+        rapid_pro_messages, recovered_message_store, [recovery_window], log_dir_path,
+        os.path.join(output_dir, "skipped.csv"), os.path.join(output_dir, "output.csv"), workers
+    )
+    return time.perf_counter() - start, succeeded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the matcher in preprocess_recovered_hormuud_messages.py on synthetic Rapid Pro and "
+                    "Hormuud recovery datasets, so that changes in its throughput can be tracked")
+
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="Comma-separated list of the numbers of messages to benchmark with")
+    parser.add_argument("--messages-per-urn", type=float, default=20,
+                        help="Average number of messages sent by each urn")
+    parser.add_argument("--max-time-delta-minutes", type=float, default=7,
+                        help="Maximum delay between a message in Rapid Pro and in the recovery CSV, in minutes")
+    parser.add_argument("--loss-rate", type=float, default=0.02,
+                        help="Proportion of messages that are missing from Rapid Pro")
+    parser.add_argument("--mangle-rate", type=float, default=0.02,
+                        help="Proportion of messages whose text is mangled by Excel in the recovery CSV")
+    parser.add_argument("--clip-rate", type=float, default=0.01,
+                        help="Proportion of messages whose text is clipped in the recovery CSV")
+    parser.add_argument("--resend-rate", type=float, default=0.01,
+                        help="Proportion of messages that are sent twice in quick succession")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01,
+                        help="Proportion of messages that Rapid Pro receives twice but the recovery CSV only has once")
+    parser.add_argument("--other-shortcode-rate", type=float, default=1.0,
+                        help="Number of rows for other short codes to add to the recovery CSV per message")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to use in the end-to-end benchmark")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for generating the synthetic datasets")
+    parser.add_argument("--output-json-path",
+                        help="Path to write the benchmark results to, as JSON")
+
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    messages_per_urn = args.messages_per_urn
+    max_time_delta = timedelta(minutes=args.max_time_delta_minutes)
+    workers = args.workers
+    output_json_path = args.output_json_path
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as output_dir:
+            log.info(f"Generating a synthetic dataset of {size} messages...")
+            csv_path = os.path.join(output_dir, "recovery.csv")
+            rapid_pro_messages, recovery_window = generate_dataset(
+                size, max(1, int(size / messages_per_urn)), max_time_delta, args.loss_rate, args.mangle_rate,
+                args.clip_rate, args.resend_rate, args.duplicate_rate, args.other_shortcode_rate, csv_path, args.seed
+            )
+            log.info(f"Generated {len(rapid_pro_messages)} Rapid Pro messages")
+
+            log.info(f"Benchmarking each match strategy on {size} messages...")
+            strategy_results = benchmark_match_strategies(
+                rapid_pro_messages, get_incoming_hormuud_messages_from_recovery_csv(csv_path), max_time_delta
+            )
+
+            log.info(f"Benchmarking end-to-end processing of {size} messages...")
+            end_to_end_seconds, succeeded = benchmark_end_to_end(rapid_pro_messages, csv_path, recovery_window,
+                                                                 output_dir, workers)
+            if not succeeded:
+                log.error(f"End-to-end processing of {size} messages didn't match all the Rapid Pro messages, so "
+                          f"its timing isn't comparable with other runs")
+                exit(1)
+            log.info(f"End-to-end processing of {size} messages took {end_to_end_seconds:.2f}s "
+                     f"({size / end_to_end_seconds:.0f} messages/s)")
+
+        results.append({
+            "messages": size,
+            "rapid_pro_messages": len(rapid_pro_messages),
+            "strategies": strategy_results,
+            "end_to_end_seconds": end_to_end_seconds,
+            "end_to_end_messages_per_second": size / end_to_end_seconds
+        })
+
+    for result in results:
+        log.info(f"{result['messages']} messages: {result['end_to_end_seconds']:.2f}s end-to-end; " +
+                 ", ".join(f"{name} {strategy_result['seconds']:.2f}s"
+                           for name, strategy_result in result["strategies"].items()))
+
+    if output_json_path is not None:
+        log.info(f"Writing benchmark results to {output_json_path}...")
+        with open(output_json_path, "w") as f:
+            json.dump(results, f, indent=2)
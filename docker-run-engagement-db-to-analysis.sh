@@ -9,6 +9,9 @@ while [[ $# -gt 0 ]]; do
         --dry-run)
             DRY_RUN="--dry-run"
             shift;;
+        --log-stage-events)
+            LOG_STAGE_EVENTS_ARG="--log-stage-events $2 $3"
+            shift 3;;
         --incremental-cache-volume)
             INCREMENTAL_ARG="--incremental-cache-path /cache"
             INCREMENTAL_CACHE_VOLUME_NAME="$2"
@@ -28,6 +31,7 @@ done
 if [[ $# -ne 5 ]]; then
     echo "Usage: $0 
     [--dry-run] [--export-large-files] [--incremental-cache-volume <incremental-cache-volume>]
+    [--log-stage-events <run-id> <stage-name>]
     <user> <google-cloud-credentials-file-path> <configuration-file> <code-schemes-dir> <data-dir>"
     exit 1
 fi
@@ -39,7 +43,8 @@ CONFIGURATION_FILE=$3
 CODE_SCHEMES_DIR=$4
 DATA_DIR=$5
 
-CMD="pdm run python -u engagement_db_to_analysis.py ${DRY_RUN} ${INCREMENTAL_ARG} ${EXPORT_LARGE_FILES_ARG} ${USER} \
+CMD="pdm run python -u pipeline_stage_runner.py ${LOG_STAGE_EVENTS_ARG} \
+    engagement_db_to_analysis.py ${DRY_RUN} ${INCREMENTAL_ARG} ${EXPORT_LARGE_FILES_ARG} ${USER} \
     /credentials/google-cloud-credentials.json configuration /data/membership-groups /data/analysis-outputs"
 
 if [[ "$INCREMENTAL_ARG" ]]; then
@@ -61,6 +66,9 @@ docker cp "$CODE_SCHEMES_DIR" "$container:/app/code_schemes"
 echo "Copying $CONFIGURATION_FILE -> $container_short_id:/app/configuration.py"
 docker cp "$CONFIGURATION_FILE" "$container:/app/configuration.py"
 
+echo "Copying pipeline_stage_runner.py -> $container_short_id:/app/pipeline_stage_runner.py"
+docker cp pipeline_stage_runner.py "$container:/app/pipeline_stage_runner.py"
+
 # Run the container
 echo "Starting container $container_short_id"
 docker start -a -i "$container"
@@ -69,11 +77,13 @@ docker start -a -i "$container"
 echo "Copying $container_short_id:/data/. -> $DATA_DIR"
 docker cp "$container:/data/." "$DATA_DIR"
 
-# Copy cache data out of the container for backup
+# Copy cache data out of the container for backup, into a directory for this cache only, so that it can't overwrite
+# or be overwritten by the caches of other stages that are run at the same time
 if [[ "$INCREMENTAL_ARG" ]]; then
-    echo "Copying $container_short_id:/cache/. -> $DATA_DIR/Cache"
-    mkdir -p "$DATA_DIR/Cache"
-    docker cp "$container:/cache/." "$DATA_DIR/Cache"
+    CACHE_BACKUP_DIR="$DATA_DIR/Cache/engagement-db-to-analysis-cache"
+    echo "Copying $container_short_id:/cache/. -> $CACHE_BACKUP_DIR"
+    mkdir -p "$CACHE_BACKUP_DIR"
+    docker cp "$container:/cache/." "$CACHE_BACKUP_DIR"
 fi
 
 # Tear down the container when it has run successfully
@@ -4,9 +4,23 @@ set -e
 
 IMAGE_NAME="$(<configurations/docker_image_name.txt)"
 
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        --log-stage-events)
+            LOG_STAGE_EVENTS_ARG="--log-stage-events $2 $3"
+            shift 3;;
+        --)
+            shift
+            break;;
+        *)
+            break;;
+    esac
+done
+
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 5 ]]; then
     echo "Usage: ./docker-run-upload-archive-files.sh
+     [--log-stage-events <run-id> <stage-name>]
      <user> <google-cloud-credentials-file-path> <configuration-module> <code-schemes-dir> <archive-dir>"
     exit 1
 fi
@@ -17,8 +31,8 @@ CONFIGURATION_FILE=$3
 CODE_SCHEMES_DIR=$4
 ARCHIVE_DIR=$5
 
-CMD="pdm run python -u upload_archive_files.py ${USER} /credentials/google-cloud-credentials.json \
-    configuration /archives"
+CMD="pdm run python -u pipeline_stage_runner.py ${LOG_STAGE_EVENTS_ARG} \
+    upload_archive_files.py ${USER} /credentials/google-cloud-credentials.json configuration /archives"
 
 # Create the container. Note that we use a bind mount here rather than a volume or docker cp so we can directly
 # edit the archive files on the host system.
@@ -34,6 +48,9 @@ docker cp "$GOOGLE_CLOUD_CREDENTIALS_PATH" "$container:/credentials/google-cloud
 echo "Copying $CONFIGURATION_FILE -> $container_short_id:/app/configuration.py"
 docker cp "$CONFIGURATION_FILE" "$container:/app/configuration.py"
 
+echo "Copying pipeline_stage_runner.py -> $container_short_id:/app/pipeline_stage_runner.py"
+docker cp pipeline_stage_runner.py "$container:/app/pipeline_stage_runner.py"
+
 echo "Copying $CODE_SCHEMES_DIR -> $container_short_id:/app/code_schemes"
 docker cp "$CODE_SCHEMES_DIR" "$container:/app/code_schemes"
 
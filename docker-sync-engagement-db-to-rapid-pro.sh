@@ -9,6 +9,9 @@ while [[ $# -gt 0 ]]; do
         --dry-run)
             DRY_RUN="--dry-run"
             shift;;
+        --log-stage-events)
+            LOG_STAGE_EVENTS_ARG="--log-stage-events $2 $3"
+            shift 3;;
         --incremental-cache-volume)
             INCREMENTAL_ARG="--incremental-cache-path /cache"
             INCREMENTAL_CACHE_VOLUME_NAME="$2"
@@ -25,6 +28,7 @@ done
 if [[ $# -ne 4 ]]; then
     echo "Usage: $0
     [--dry-run] [--incremental-cache-volume <incremental-cache-volume>]
+    [--log-stage-events <run-id> <stage-name>]
     <user> <google-cloud-credentials-file-path> <configuration-file> <code-schemes-dir>"
     exit
 fi
@@ -35,7 +39,8 @@ GOOGLE_CLOUD_CREDENTIALS_PATH=$2
 CONFIGURATION_FILE=$3
 CODE_SCHEMES_DIR=$4
 
-CMD="pdm run python -u sync_engagement_db_to_rapid_pro.py ${DRY_RUN} ${INCREMENTAL_ARG} ${USER} \
+CMD="pdm run python -u pipeline_stage_runner.py ${LOG_STAGE_EVENTS_ARG} \
+    sync_engagement_db_to_rapid_pro.py ${DRY_RUN} ${INCREMENTAL_ARG} ${USER} \
     /credentials/google-cloud-credentials.json configuration"
 
 if [[ "$INCREMENTAL_ARG" ]]; then
@@ -57,6 +62,9 @@ docker cp "$CODE_SCHEMES_DIR" "$container:/app/code_schemes"
 echo "Copying $CONFIGURATION_FILE -> $container_short_id:/app/configuration.py"
 docker cp "$CONFIGURATION_FILE" "$container:/app/configuration.py"
 
+echo "Copying pipeline_stage_runner.py -> $container_short_id:/app/pipeline_stage_runner.py"
+docker cp pipeline_stage_runner.py "$container:/app/pipeline_stage_runner.py"
+
 # Run the container
 echo "Starting container $container_short_id"
 docker start -a -i "$container"
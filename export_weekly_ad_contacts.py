@@ -1,24 +1,505 @@
 import argparse
 import csv
+import gzip
+import hashlib
+import io
 import json
+import os
 import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from core_data_modules.cleaners import Codes, PhoneCleaner
 from core_data_modules.logging import Logger
 from core_data_modules.traced_data.io import TracedDataJsonIO
+from cryptography.fernet import Fernet, InvalidToken
 from id_infrastructure.firestore_uuid_table import FirestoreUuidTable
 from storage.google_cloud import google_cloud_utils
 
 log = Logger(__name__)
 
+# Serialized TracedData nests each object's history one level deeper per update, so decoding a long history needs a
+# higher recursion limit than the default.
 sys.setrecursionlimit(50000)
 
+
+def iter_traced_data_projections(f, keys):
+    """
+    Streams the latest values of the given keys from each of the TracedData objects in a JSONL file exported by
+    TracedDataJsonIO, without deserializing the TracedData objects or their histories.
+
+    Each line is a serialized TracedData, where "data" holds the values set by the latest update, "append" holds the
+    serialized TracedData that was appended by that update (if any), and "prev" holds the serialized TracedData from
+    before that update. A TracedData looks up a key in its "data", then in its appended TracedData, then in "prev",
+    so the latest value of each key is the first value found by searching the serialized TracedData in that order.
+    If a key isn't found that way, the line is deserialized in full using TracedDataJsonIO instead.
+
+    Only one line is decoded at a time, so this runs in constant memory however large the file is.
+
+    :param f: File to read the TracedData JSONL from.
+    :type f: file-like
+    :param keys: Keys to read the latest values of.
+    :type keys: list of str
+    :return: Generator of dicts of key -> latest value, one for each TracedData in `f`.
+    :rtype: iterator of dict
+    """
+    for line in f:
+        if line.strip() == "":
+            continue
+
+        projection = dict()
+        # Serialized TracedData still to search, with the next one to search last. Histories can be thousands of
+        # updates long, so they are searched with this stack rather than by recursion.
+        serialized_tds = [json.loads(line)]
+        while len(serialized_tds) > 0 and len(projection) < len(keys):
+            serialized_td = serialized_tds.pop()
+            data = serialized_td["data"]
+            for key in keys:
+                if key not in projection and key in data:
+                    projection[key] = data[key]
+
+            if serialized_td.get("prev") is not None:
+                serialized_tds.append(serialized_td["prev"])
+            if serialized_td.get("append") is not None:
+                serialized_tds.append(serialized_td["append"])
+
+        if len(projection) < len(keys):
+            td = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(io.StringIO(line))[0]
+            projection = {key: td[key] for key in keys}
+
+        yield projection
+
+
+def load_uuids(traced_data_path):
+    """
+    Loads the participant uuids from a traced data file, and the uuids of the participants who withdrew consent.
+
+    :param traced_data_path: Path to a traced data JSONL file (either messages or individuals).
+    :type traced_data_path: str
+    :return: Tuple of (uuids of all the participants, uuids of the participants who withdrew consent).
+    :rtype: (set of str, set of str)
+    """
+    log.info(f"Loading uuids and consent statuses from traced data file '{traced_data_path}'...")
+    uuids = set()
+    opt_out_uuids = set()
+    traced_data_count = 0
+    with open(traced_data_path) as f:
+        for td in iter_traced_data_projections(f, ["participant_uuid", "consent_withdrawn"]):
+            if td["consent_withdrawn"] == Codes.TRUE:
+                opt_out_uuids.add(td["participant_uuid"])
+
+            uuids.add(td["participant_uuid"])
+            traced_data_count += 1
+    log.info(f"Loaded {len(uuids)} uuids from {traced_data_count} traced data objects in '{traced_data_path}'")
+
+    return uuids, opt_out_uuids
+
+
+def derive_key(uuid_table_credentials, purpose):
+    """
+    Derives a secret key from the uuid table credentials, for protecting data derived from the uuid table at rest.
+
+    :param uuid_table_credentials: Credentials used to access the uuid table. The key is derived from the service
+                                   account's "private_key".
+    :type uuid_table_credentials: dict
+    :param purpose: What the key will be used for. Each purpose gets an independent key.
+    :type purpose: bytes
+    :return: 64-byte key.
+    :rtype: bytes
+    """
+    master_key = hashlib.blake2b(uuid_table_credentials["private_key"].encode("utf-8"), digest_size=64).digest()
+    return hashlib.blake2b(purpose, key=master_key, digest_size=64).digest()
+
+
+# Number of uuids to request from the uuid table in each batch, and the number of batches to request at once.
+UUID_LOOKUP_BATCH_SIZE = 500
+UUID_LOOKUP_THREADS = 8
+
+
+def look_up_urns(uuid_table, uuids):
+    """
+    Looks up the urns of the given uuids in the uuid table, in batches of `UUID_LOOKUP_BATCH_SIZE` uuids that are
+    requested `UUID_LOOKUP_THREADS` at a time.
+
+    :param uuid_table: Uuid table to look the uuids up in.
+    :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :param uuids: Uuids to look up.
+    :type uuids: iterable of str
+    :return: Dictionary of uuid -> urn.
+    :rtype: dict of str -> str
+    """
+    uuids = sorted(uuids)
+    batches = [uuids[i:i + UUID_LOOKUP_BATCH_SIZE] for i in range(0, len(uuids), UUID_LOOKUP_BATCH_SIZE)]
+
+    urn_lut = dict()
+    with ThreadPoolExecutor(max_workers=UUID_LOOKUP_THREADS) as executor:
+        for batch_urn_lut in executor.map(uuid_table.uuid_to_data_batch, batches):
+            urn_lut.update(batch_urn_lut)
+
+    return urn_lut
+
+
+class UuidUrnCache:
+    def __init__(self, cache_dir, uuid_table_name, key):
+        """
+        On-disk cache of the urns that uuids have been re-identified to, so that each uuid only needs to be looked up
+        in the uuid table once. The urn of a uuid never changes, so cached urns never expire.
+
+        The cache is encrypted and authenticated with Fernet, using a key that is stored in the credentials bucket
+        rather than on the disk the cache is stored on. If the cache can't be decrypted with the key, e.g. because
+        the key was rotated, it is discarded and rebuilt from the uuid table. The cache files are also only readable
+        by the current user.
+
+        :param cache_dir: Directory to store the cache in. Each uuid table is cached in a separate file.
+        :type cache_dir: str
+        :param uuid_table_name: Name of the uuid table that the cached urns are looked up in.
+        :type uuid_table_name: str
+        :param key: Fernet key to encrypt the cache with, as generated by `cryptography.fernet.Fernet.generate_key`.
+        :type key: bytes | str
+        """
+        self._cache_dir = cache_dir
+        self._cache_path = os.path.join(cache_dir, f"{uuid_table_name.replace('/', '_')}.json.fernet")
+        # Path of the unencrypted cache written by earlier versions of this script, which is deleted when the
+        # encrypted cache is saved.
+        self._plaintext_cache_path = os.path.join(cache_dir, f"{uuid_table_name.replace('/', '_')}.json")
+        self._fernet = Fernet(key)
+
+    def _load(self):
+        if not os.path.exists(self._cache_path):
+            return dict()
+
+        with open(self._cache_path, "rb") as f:
+            token = f.read()
+        try:
+            return json.loads(self._fernet.decrypt(token))
+        except InvalidToken:
+            log.warning(f"Uuid cache {self._cache_path} couldn't be decrypted with the given key, so discarding it")
+            return dict()
+
+    def _save(self, urn_lut):
+        # Only allow the current user to read the cache, and replace it atomically so an interrupted write can't
+        # corrupt it.
+        os.makedirs(self._cache_dir, mode=0o700, exist_ok=True)
+        tmp_path = self._cache_path + ".tmp"
+        with open(tmp_path, "wb", opener=lambda path, flags: os.open(path, flags, 0o600)) as f:
+            f.write(self._fernet.encrypt(json.dumps(urn_lut).encode("utf-8")))
+        os.replace(tmp_path, self._cache_path)
+
+        if os.path.exists(self._plaintext_cache_path):
+            log.info(f"Deleting the unencrypted uuid cache {self._plaintext_cache_path}")
+            os.remove(self._plaintext_cache_path)
+
+    def uuid_to_data_batch(self, uuid_table, uuids):
+        """
+        Gets the urns of the given uuids, looking up any that aren't in the cache yet in the uuid table.
+
+        :param uuid_table: Uuid table to look up uuids that aren't in the cache in.
+        :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+        :param uuids: Uuids to get the urns of.
+        :type uuids: iterable of str
+        :return: Dictionary of uuid -> urn, for each of the `uuids`.
+        :rtype: dict of str -> str
+        """
+        urn_lut = self._load()
+        uncached_uuids = {uuid for uuid in uuids if uuid not in urn_lut}
+        log.info(f"Found {len(urn_lut)} uuids in the uuid cache. Looking up the {len(uncached_uuids)} requested "
+                 f"uuids that aren't cached in the uuid table...")
+
+        if len(uncached_uuids) > 0:
+            urn_lut.update(look_up_urns(uuid_table, uncached_uuids))
+            self._save(urn_lut)
+
+        return {uuid: urn_lut[uuid] for uuid in uuids}
+
+
+class OperatorPrefixTable:
+    # Urns of phone numbers are expected to be in this form, followed by the number's digits.
+    TEL_URN_PREFIX = "tel:+"
+
+    def __init__(self, prefix_length=5):
+        """
+        Lookup table of the mobile network operator of each phone number prefix, precomputed with
+        PhoneCleaner.clean_operator for the prefixes of the urns being classified, so that clean_operator only needs
+        to be called a few times per prefix rather than once per urn.
+
+        Urns of the form "tel:+<digits>" are keyed by their first `prefix_length` digits and their number of digits,
+        which are found by slicing the urn. The default of 5 covers a country code and network code, e.g. tel:+252 61
+        for Hormuud numbers in Somalia. Urns in any other form are classified by clean_operator directly.
+
+        clean_operator may look at more of a number than this, so the operator of each key is checked against
+        clean_operator on sample urns with that key, which between them have every digit in each position after the
+        prefix. If clean_operator gives any of them a different operator, the key is ambiguous, and every urn with
+        that key is classified by clean_operator instead.
+
+        :param prefix_length: Number of digits of each number that are expected to determine its operator.
+        :type prefix_length: int
+        """
+        self.prefix_length = prefix_length
+        self._operators = dict()  # of key -> operator, or None if the key is ambiguous
+
+    def _get_key(self, urn):
+        """
+        :return: Key of the urn, as (urn up to the end of the prefix, number of digits after the prefix), or None if
+                 the urn isn't of the form "tel:+<digits>" with more digits than the prefix.
+        :rtype: (str, int) | None
+        """
+        digits = urn[len(self.TEL_URN_PREFIX):]
+        if not urn.startswith(self.TEL_URN_PREFIX) or len(digits) <= self.prefix_length or \
+                not (digits.isascii() and digits.isdigit()):
+            return None
+        prefix_end = len(self.TEL_URN_PREFIX) + self.prefix_length
+        return urn[:prefix_end], len(urn) - prefix_end
+
+    @staticmethod
+    def get_sample_urns(key):
+        """
+        :param key: Key of the urns to sample, as (urn up to the end of the prefix, number of digits after the
+                    prefix).
+        :type key: (str, int)
+        :return: Sample urns with the given key, which between them have every digit in each position after the
+                 prefix.
+        :rtype: list of str
+        """
+        prefix, suffix_digits_count = key
+        return [prefix + str(digit) * suffix_digits_count for digit in range(10)] + \
+            [prefix + ("0123456789" * suffix_digits_count)[offset:offset + suffix_digits_count]
+             for offset in range(10)]
+
+    def _classify_key(self, key):
+        """
+        Adds the operator of the urns with the given key to this table, or marks the key as ambiguous if
+        PhoneCleaner.clean_operator gives the sample urns with that key different operators.
+        """
+        sample_operators = {PhoneCleaner.clean_operator(sample_urn) for sample_urn in self.get_sample_urns(key)}
+        if len(sample_operators) == 1:
+            self._operators[key] = sample_operators.pop()
+        else:
+            prefix, suffix_digits_count = key
+            log.warning(f"Urns of the form {prefix}{'0' * suffix_digits_count} have different operators "
+                        f"{sorted(sample_operators)}, so classifying each of them with PhoneCleaner.clean_operator")
+            self._operators[key] = None
+
+    def get_operator(self, urn):
+        """
+        :param urn: Urn of a phone number, e.g. "tel:+252612345678".
+        :type urn: str
+        :return: Operator of the phone number, as returned by PhoneCleaner.clean_operator.
+        :rtype: str
+        """
+        key = self._get_key(urn)
+        if key is None:
+            return PhoneCleaner.clean_operator(urn)
+
+        if key not in self._operators:
+            self._classify_key(key)
+        operator = self._operators[key]
+        if operator is None:
+            return PhoneCleaner.clean_operator(urn)
+        return operator
+
+    def group_urns_by_operator(self, urns):
+        """
+        Groups urns by the operator of their phone numbers.
+
+        :param urns: Urns of phone numbers to group.
+        :type urns: iterable of str
+        :return: Dictionary of operator -> urns from that operator.
+        :rtype: dict of str -> set of str
+        """
+        urns_by_operator = dict()  # of operator -> set of str
+        for urn in urns:
+            operator = self.get_operator(urn)
+            if operator not in urns_by_operator:
+                urns_by_operator[operator] = set()
+            urns_by_operator[operator].add(urn)
+
+        return urns_by_operator
+
+
+class UrnSnapshot:
+    # Identifies files written by this snapshot, and the version of the format they were written in.
+    _FILE_HEADER = b"urn-snapshot-v1"
+    _KEY_FINGERPRINT_LENGTH = 8
+
+    def __init__(self, snapshot_path, uuid_table_credentials):
+        """
+        Compact record of the urns in an export, so that the next export can be compared with it.
+
+        The snapshot stores a 64-bit hash of each urn, sorted, in a binary file. The hashes are keyed with a key
+        derived from the uuid table credentials, so the urns can't be recovered from the snapshot by hashing every
+        possible phone number. The file also stores a fingerprint of the key, so that a snapshot written with
+        different credentials is detected and discarded rather than compared against.
+
+        :param snapshot_path: Path to the snapshot file.
+        :type snapshot_path: str
+        :param uuid_table_credentials: Credentials used to access the uuid table.
+        :type uuid_table_credentials: dict
+        """
+        self._snapshot_path = snapshot_path
+        self._key = derive_key(uuid_table_credentials, b"urn-snapshot")
+
+    def _get_key_fingerprint(self):
+        return hashlib.blake2b(b"fingerprint", key=self._key, digest_size=self._KEY_FINGERPRINT_LENGTH).digest()
+
+    def hash_urn(self, urn):
+        """
+        :type urn: str
+        :return: 64-bit hash of the urn, as stored in the snapshot.
+        :rtype: int
+        """
+        return int.from_bytes(hashlib.blake2b(urn.encode("utf-8"), key=self._key, digest_size=8).digest(), "big")
+
+    def load(self):
+        """
+        :return: Hashes of the urns in the snapshot, or an empty set if there is no usable snapshot.
+        :rtype: set of int
+        """
+        if not os.path.exists(self._snapshot_path):
+            return set()
+
+        with open(self._snapshot_path, "rb") as f:
+            contents = f.read()
+
+        expected_header = self._FILE_HEADER + self._get_key_fingerprint()
+        if contents[:len(expected_header)] != expected_header:
+            log.warning(f"Ignoring the urn snapshot at {self._snapshot_path}, because it was not written with the "
+                        f"current uuid table credentials")
+            return set()
+
+        hashes = array("Q")
+        hashes.frombytes(contents[len(expected_header):])
+        return set(hashes)
+
+    def save(self, urns):
+        """
+        Replaces the snapshot with a snapshot of the given urns.
+
+        :type urns: iterable of str
+        """
+        hashes = array("Q", sorted(self.hash_urn(urn) for urn in urns))
+
+        with open(self._snapshot_path + ".tmp", "wb") as f:
+            f.write(self._FILE_HEADER + self._get_key_fingerprint())
+            hashes.tofile(f)
+        os.replace(self._snapshot_path + ".tmp", self._snapshot_path)
+
+
+def _write_contacts_csv(urns, csv_path):
+    # Writes urns, which must be sorted by namespace, to a single contacts CSV in one buffered pass, and returns the
+    # SHA-256 of the file that was written.
+    urn_namespaces = []  # of str, in the order they first appear in `urns`
+    rows = []  # of dict
+    for urn in urns:
+        namespace, value = urn.split(":", 1)
+        if len(urn_namespaces) == 0 or urn_namespaces[-1] != namespace:
+            urn_namespaces.append(namespace)
+        rows.append({f"URN:{namespace}": value})
+
+    f = io.StringIO()
+    writer = csv.DictWriter(f, fieldnames=[f"URN:{namespace}" for namespace in urn_namespaces], lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+
+    contents = f.getvalue().encode("utf-8")
+    if csv_path.endswith(".gz"):
+        contents = gzip.compress(contents, mtime=0)
+    with open(csv_path, "wb") as f:
+        f.write(contents)
+
+    return hashlib.sha256(contents).hexdigest()
+
+
+def export_contacts_csv(urns, csv_path, max_contacts_per_file=None):
+    """
+    Exports urns to a contacts CSV, in a format suitable for direct upload to Rapid Pro. Urns are sorted by namespace,
+    then by value. If `csv_path` ends in .gz, the CSV is gzip-compressed.
+
+    If `max_contacts_per_file` is set, the urns are split between as many CSVs as are needed to write at most that
+    many urns to each one, so that each file is small enough to be imported into Rapid Pro. The CSVs are named after
+    `csv_path` with a shard number added, e.g. contacts-001.csv, contacts-002.csv, and a manifest listing each
+    CSV with its number of contacts and SHA-256 checksum is written to e.g. contacts-manifest.json.
+
+    :param urns: Urns to export.
+    :type urns: iterable of str
+    :param csv_path: Path to write the contacts CSV to.
+    :type csv_path: str
+    :param max_contacts_per_file: Maximum number of urns to write to each CSV, or None to write all the urns to a single
+                                  CSV at `csv_path`.
+    :type max_contacts_per_file: int | None
+    """
+    urns = sorted(urns, key=lambda urn: urn.split(":", 1))
+    if max_contacts_per_file is None:
+        log.warning(f"Exporting {len(urns)} urns to {csv_path}...")
+        _write_contacts_csv(urns, csv_path)
+        log.info(f"Wrote {len(urns)} urns to {csv_path}")
+        return
+
+    extension = ".csv.gz" if csv_path.endswith(".csv.gz") else os.path.splitext(csv_path)[1]
+    path_prefix = csv_path[:len(csv_path) - len(extension)]
+    shards_count = max(1, (len(urns) + max_contacts_per_file - 1) // max_contacts_per_file)
+    log.warning(f"Exporting {len(urns)} urns to {shards_count} CSVs {path_prefix}-*{extension}...")
+
+    manifest_files = []  # of dict
+    for shard_number in range(1, shards_count + 1):
+        shard_urns = urns[(shard_number - 1) * max_contacts_per_file:shard_number * max_contacts_per_file]
+        shard_path = f"{path_prefix}-{shard_number:03d}{extension}"
+        sha256 = _write_contacts_csv(shard_urns, shard_path)
+        manifest_files.append({"path": os.path.basename(shard_path), "contacts": len(shard_urns), "sha256": sha256})
+        log.info(f"Wrote {len(shard_urns)} urns to {shard_path}")
+
+    manifest_path = f"{path_prefix}-manifest.json"
+    with open(manifest_path, "w") as f:
+        json.dump({"contacts": len(urns), "files": manifest_files}, f, indent=2)
+    log.info(f"Wrote {len(urns)} urns to {shards_count} CSVs, listed in {manifest_path}")
+
+
+def positive_int(value):
+    """
+    Parses a command line argument that must be a positive integer.
+
+    :param value: Value of the argument.
+    :type value: str
+    :rtype: int
+    """
+    value = int(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, but was {value}")
+    return value
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Exports weekly ad contacts from analysis Traced Data")
 
     parser.add_argument("--target-mnos", nargs="?", action="store",
                         help="Comma-separated list of mobile network operators to filter for. "
                              "For example, to export Golis/Hormuud urns only, use '--target-mnos=golis,hormud'")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of traced data files to load in parallel. Defaults to 1, which loads each file "
+                             "in turn in this process")
+    parser.add_argument("--uuid-cache-dir", metavar="uuid-cache-dir",
+                        help="Directory to cache the urns of re-identified uuids in. When exporting uuids that were "
+                             "exported by a previous run, only the uuids that are not already in this cache are "
+                             "looked up in the uuid table. The cache is encrypted with the key at "
+                             "--uuid-cache-key-file-url, which is required when using this option")
+    parser.add_argument("--uuid-cache-key-file-url", metavar="uuid-cache-key-file-url",
+                        help="GS URL of a text file containing the Fernet key to encrypt the uuid cache with, as "
+                             "generated by 'python -c \"from cryptography.fernet import Fernet; "
+                             "print(Fernet.generate_key().decode())\"'")
+    parser.add_argument("--snapshot-path", metavar="snapshot-path",
+                        help="Path to a snapshot of the urns in the previous export. When given, the contacts that "
+                             "were added and removed since that export are also exported to added-csv-output-path "
+                             "and removed-csv-output-path, and the snapshot is then updated to this export")
+    parser.add_argument("--added-csv-output-path", metavar="added-csv-output-path",
+                        help="Path to a CSV file to write the contacts that are new since the previous export to. "
+                             "Required when using --snapshot-path")
+    parser.add_argument("--removed-csv-output-path", metavar="removed-csv-output-path",
+                        help="Path to a CSV file to write the contacts that were in the previous export but are not "
+                             "in this one to, including contacts who withdrew consent. Required when using "
+                             "--snapshot-path")
+    parser.add_argument("--max-contacts-per-file", metavar="max-contacts-per-file", type=positive_int,
+                        help="Maximum number of contacts to write to each CSV. When given, each exported CSV is split "
+                             "into numbered shards of at most this many contacts, with a manifest of the shards' "
+                             "contact counts and checksums. Each output path may end in .gz to gzip the CSVs")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket"),
@@ -36,12 +517,39 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     target_mnos = None if args.target_mnos is None else args.target_mnos.split(",")
+    workers = args.workers
+    uuid_cache_dir = args.uuid_cache_dir
+    uuid_cache_key_file_url = args.uuid_cache_key_file_url
+    snapshot_path = args.snapshot_path
+    added_csv_output_path = args.added_csv_output_path
+    removed_csv_output_path = args.removed_csv_output_path
+    max_contacts_per_file = args.max_contacts_per_file
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     uuid_table_credentials_file_url = args.uuid_table_credentials_file_url
     uuid_table_name = args.uuid_table_name
     traced_data_paths = args.traced_data_paths
     csv_output_file_path = args.csv_output_file_path
 
+    if snapshot_path is not None and (added_csv_output_path is None or removed_csv_output_path is None):
+        log.error("--added-csv-output-path and --removed-csv-output-path are required when using --snapshot-path")
+        exit(1)
+
+    if uuid_cache_dir is not None and uuid_cache_key_file_url is None:
+        log.error("--uuid-cache-key-file-url is required when using --uuid-cache-dir")
+        exit(1)
+
+    uuid_cache = None
+    if uuid_cache_dir is not None:
+        log.info("Downloading the uuid cache key...")
+        uuid_cache_key = google_cloud_utils.download_blob_to_string(
+            google_cloud_credentials_file_path, uuid_cache_key_file_url
+        ).strip()
+        try:
+            uuid_cache = UuidUrnCache(uuid_cache_dir, uuid_table_name, uuid_cache_key)
+        except ValueError:
+            log.error(f"The uuid cache key at {uuid_cache_key_file_url} is not a valid Fernet key")
+            exit(1)
+
     log.info("Initialising uuid table client...")
     credentials = json.loads(google_cloud_utils.download_blob_to_string(
         google_cloud_credentials_file_path,
@@ -55,51 +563,65 @@ if __name__ == "__main__":
     )
     log.info("Initialised uuid table client")
 
+    if workers == 1:
+        results = list(map(load_uuids, traced_data_paths))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_uuids, traced_data_paths))
+
     uuids = set()
     opt_out_uuids = set()
-
-    for path in traced_data_paths:
-        log.info(f"Loading previous traced data from file '{path}'...")
-        with open(path) as f:
-            data = TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)
-        log.info(f"Loaded {len(data)} traced data objects")
-
-        for td in data:
-            if td["consent_withdrawn"] == Codes.TRUE:
-                opt_out_uuids.add(td["participant_uuid"])
-
-            uuids.add(td["participant_uuid"])
+    for file_uuids, file_opt_out_uuids in results:
+        uuids.update(file_uuids)
+        opt_out_uuids.update(file_opt_out_uuids)
     log.info(f"Loaded {len(uuids)} uuids from TracedData (of which {len(opt_out_uuids)} uuids withdrew consent)")
     uuids = uuids - opt_out_uuids
     log.info(f"Proceeding with {len(uuids)} opt-in uuids")
 
-    log.info(f"Converting {len(uuids)} uuids to urns...")
-    urn_lut = uuid_table.uuid_to_data_batch(uuids)
+    # When exporting the differences from the previous export, also re-identify the uuids that withdrew consent, so
+    # that they can be exported as removed contacts.
+    uuids_to_re_identify = uuids if snapshot_path is None else uuids | opt_out_uuids
+    log.info(f"Converting {len(uuids_to_re_identify)} uuids to urns...")
+    if uuid_cache is None:
+        urn_lut = look_up_urns(uuid_table, uuids_to_re_identify)
+    else:
+        urn_lut = uuid_cache.uuid_to_data_batch(uuid_table, uuids_to_re_identify)
     urns = {urn_lut[uuid] for uuid in uuids}
     log.info(f"Converted {len(uuids)} uuids to {len(urns)} urns")
 
     if target_mnos is not None:
         log.info(f"Filtering {len(urns)} urns for those from operators {target_mnos}...")
+        urns_by_operator = OperatorPrefixTable().group_urns_by_operator(urns)
+        log.info(f"Found urns from operators "
+                 f"{ {operator: len(operator_urns) for operator, operator_urns in urns_by_operator.items()} }")
         filtered_urns = set()
-        for urn in urns:
-            operator = PhoneCleaner.clean_operator(urn)
-            if operator in target_mnos:
-                filtered_urns.add(urn)
+        for operator in target_mnos:
+            filtered_urns.update(urns_by_operator.get(operator, set()))
         log.info(f"Filtered urns for those from operators {target_mnos}. {len(filtered_urns)}/{len(urns)} urns remain")
         urns = filtered_urns
 
     # Export contacts CSV
-    log.warning(f"Exporting {len(urns)} urns to {csv_output_file_path}...")
-    with open(csv_output_file_path, "w") as f:
-        urn_namespaces = {urn.split(":")[0] for urn in urns}
-        headers = [f"URN:{namespace}" for namespace in urn_namespaces]
+    export_contacts_csv(urns, csv_output_file_path, max_contacts_per_file)
 
-        writer = csv.DictWriter(f, fieldnames=headers, lineterminator="\n")
-        writer.writeheader()
-        for urn in urns:
-            namespace = urn.split(":")[0]
-            value = urn.split(":")[1]
-            writer.writerow({
-                f"URN:{namespace}": value
-            })
-        log.info(f"Wrote {len(urns)} urns to {csv_output_file_path}")
+    if snapshot_path is not None:
+        log.info(f"Comparing the {len(urns)} exported urns with the previous export's snapshot {snapshot_path}...")
+        snapshot = UrnSnapshot(snapshot_path, credentials)
+        previous_hashes = snapshot.load()
+        urns_by_hash = {snapshot.hash_urn(urn): urn for urn in urns}
+        added_urns = {urn for urn_hash, urn in urns_by_hash.items() if urn_hash not in previous_hashes}
+
+        # The snapshot only stores hashes, so removed urns can only be exported if they were seen again in this
+        # run, e.g. because their uuid withdrew consent or their operator was filtered out.
+        removed_hashes = previous_hashes - urns_by_hash.keys()
+        known_urns_by_hash = {snapshot.hash_urn(urn): urn for urn in urn_lut.values()}
+        removed_urns = {known_urns_by_hash[urn_hash] for urn_hash in removed_hashes if urn_hash in known_urns_by_hash}
+        log.info(f"Found {len(added_urns)} added urns and {len(removed_hashes)} removed urns since the previous "
+                 f"export")
+        if len(removed_urns) < len(removed_hashes):
+            log.warning(f"{len(removed_hashes) - len(removed_urns)} removed urns can't be exported, because their "
+                        f"uuids are no longer in the traced data")
+
+        export_contacts_csv(added_urns, added_csv_output_path, max_contacts_per_file)
+        export_contacts_csv(removed_urns, removed_csv_output_path, max_contacts_per_file)
+        snapshot.save(urns)
+        log.info(f"Updated the snapshot {snapshot_path} to this export")
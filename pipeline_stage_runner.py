@@ -0,0 +1,276 @@
+import argparse
+import functools
+import json
+import resource
+import runpy
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# This file is copied into the pipeline's containers by the docker-*.sh scripts and by run_pipeline.py, and runs each
+# stage's program in the pipeline's Python environment, so that every stage reports the resources it used in the same
+# way, whether it's run in its own container or in run_pipeline.py's reused container.
+
+# Prefix of the line that the resource usage of a stage's program is output on when it exits.
+STAGE_USAGE_LINE_PREFIX = "pipeline-stage-usage: "
+
+# Arguments that log_pipeline_event.py is run with to find the configuration and credentials in the container, as
+# copied in by the docker-*.sh scripts and by run_pipeline.py's reused container.
+_LOG_PIPELINE_EVENT_ARGS = ["configuration", "/credentials/google-cloud-credentials.json"]
+
+_counts = {"document_reads": 0, "document_writes": 0, "api_requests": 0}
+_counts_lock = threading.Lock()
+
+# Calls to instrumented functions are only counted if they aren't made by another instrumented function, e.g. when
+# DocumentReference.get is implemented with Client.get_all, or when a Firestore request refreshes its credentials with
+# requests. This records, for each thread, whether an instrumented function is currently running.
+_instrumented_call_state = threading.local()
+
+
+def _increment(name, amount=1):
+    with _counts_lock:
+        _counts[name] += amount
+
+
+@contextmanager
+def _uncounted():
+    """
+    Stops calls to instrumented functions in the current thread being counted, until the context exits.
+
+    :return: Whether calls were already uncounted when the context was entered, in which case the caller shouldn't
+             count its own call either.
+    :rtype: bool
+    """
+    already_uncounted = getattr(_instrumented_call_state, "uncounted", False)
+    _instrumented_call_state.uncounted = True
+    try:
+        yield already_uncounted
+    finally:
+        _instrumented_call_state.uncounted = already_uncounted
+
+
+def _count_calls(func, counts):
+    """
+    :param counts: Dictionary of count name -> amount to increment it by on each call to `func`.
+    :type counts: dict of str -> int
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _uncounted() as nested:
+            if not nested:
+                for name, amount in counts.items():
+                    _increment(name, amount)
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _count_streamed_documents(stream):
+    """
+    Counts a call to a function that streams documents as an API request, and each document it yields as a read.
+    """
+    def count_documents(documents):
+        while True:
+            # Only stop counting while the next document is being fetched, so that calls the caller makes between
+            # documents are still counted.
+            with _uncounted():
+                try:
+                    document = next(documents)
+                except StopIteration:
+                    return
+            _increment("document_reads")
+            yield document
+
+    @functools.wraps(stream)
+    def wrapper(*args, **kwargs):
+        with _uncounted() as nested:
+            documents = stream(*args, **kwargs)
+        if nested:
+            return documents
+        _increment("api_requests")
+        return count_documents(iter(documents))
+
+    return wrapper
+
+
+def install_instrumentation():
+    """
+    Instruments the libraries the pipeline uses to access its data, to count the Firestore documents a program reads
+    and writes and the API requests it makes. The counts are approximate: each call that makes a request is counted
+    as one API request, even if the library splits it into several requests, e.g. to page through results.
+
+    Libraries that aren't installed aren't instrumented.
+    """
+    try:
+        from google.cloud.firestore_v1.batch import WriteBatch
+        from google.cloud.firestore_v1.client import Client
+        from google.cloud.firestore_v1.document import DocumentReference
+        from google.cloud.firestore_v1.query import Query
+        from google.cloud.firestore_v1.transaction import Transaction
+    except ImportError:
+        pass
+    else:
+        DocumentReference.get = _count_calls(DocumentReference.get, {"document_reads": 1, "api_requests": 1})
+        Query.stream = _count_streamed_documents(Query.stream)
+        Client.get_all = _count_streamed_documents(Client.get_all)
+        # DocumentReference's create, set, update and delete are implemented with a WriteBatch, as are transactions,
+        # so every document write is made through one of these.
+        for method in ["create", "set", "update", "delete"]:
+            setattr(WriteBatch, method, _count_calls(getattr(WriteBatch, method), {"document_writes": 1}))
+        WriteBatch.commit = _count_calls(WriteBatch.commit, {"api_requests": 1})
+        # Transactions are committed with _commit rather than commit, when their transactional function returns.
+        Transaction._commit = _count_calls(Transaction._commit, {"api_requests": 1})
+
+    try:
+        import requests
+    except ImportError:
+        pass
+    else:
+        requests.Session.request = _count_calls(requests.Session.request, {"api_requests": 1})
+
+    try:
+        import httplib2
+    except ImportError:
+        pass
+    else:
+        httplib2.Http.request = _count_calls(httplib2.Http.request, {"api_requests": 1})
+
+
+def run_program(program, args):
+    """
+    Runs a Python program in this process, as if it had been run with `python <program> <args>`.
+
+    :param program: Path to the Python program to run.
+    :type program: str
+    :param args: Arguments to run the program with.
+    :type args: list of str
+    :return: The program's exit code.
+    :rtype: int
+    """
+    sys.argv = [program, *args]
+    try:
+        runpy.run_path(program, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return 0
+
+
+def get_stage_event_key(event, stage_name, metrics=None):
+    """
+    Gets the key to log a stage event to the operations dashboard with, e.g.
+    "StageEnd:sync-coda-to-engagement-db:succeeded=true,wall_time_seconds=1.2,...".
+
+    The metrics are included in the key because log_pipeline_event.py only logs a key. The key only contains letters,
+    digits and ".,:=_-", so that it can be passed to log_pipeline_event.py in a shell command without quoting.
+
+    :param event: "StageStart" or "StageEnd".
+    :type event: str
+    :param stage_name: Name of the stage.
+    :type stage_name: str
+    :param metrics: Metrics of the stage, to include in the key.
+    :type metrics: dict of str -> (bool | int | float) | None
+    :rtype: str
+    """
+    key = f"{event}:{stage_name}"
+    if metrics is None:
+        return key
+
+    formatted_metrics = []
+    for name, value in metrics.items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, float):
+            value = f"{value:.1f}"
+        formatted_metrics.append(f"{name}={value}")
+    return f"{key}:{','.join(formatted_metrics)}"
+
+
+def log_stage_event(run_id, event_key):
+    """
+    Logs a stage event to the operations dashboard, by running log_pipeline_event.py in this process.
+
+    The event isn't counted in the stage's metrics, and a failure to log it doesn't fail the stage.
+
+    :param run_id: Id of the pipeline run.
+    :type run_id: str
+    :param event_key: Key of the event, from `get_stage_event_key`.
+    :type event_key: str
+    """
+    with _uncounted():
+        exit_code = run_program("log_pipeline_event.py", [*_LOG_PIPELINE_EVENT_ARGS, run_id, event_key])
+    if exit_code != 0:
+        print(f"Warning: Failed to log stage event {event_key}, log_pipeline_event.py exited with code {exit_code}",
+              file=sys.stderr, flush=True)
+
+
+def run_stage_program(program, args, run_id=None, stage_name=None):
+    """
+    Runs a pipeline stage's program, then outputs the resources it used, as a JSON object on a line starting with
+    STAGE_USAGE_LINE_PREFIX: "succeeded", "wall_time_seconds", "cpu_time_seconds", "peak_rss_kb", and the
+    "document_reads", "document_writes" and "api_requests" counted by `install_instrumentation`.
+
+    :param program: Path to the stage's Python program.
+    :type program: str
+    :param args: Arguments to run the program with.
+    :type args: list of str
+    :param run_id: If not None, id of the pipeline run to log the stage's start and end to the operations dashboard
+                   under, with the metrics in the end event's key as described in `get_stage_event_key`.
+    :type run_id: str | None
+    :param stage_name: Name of the stage, to log the stage's events with. Required if `run_id` is given.
+    :type stage_name: str | None
+    :return: The program's exit code.
+    :rtype: int
+    """
+    if run_id is not None:
+        log_stage_event(run_id, get_stage_event_key("StageStart", stage_name))
+
+    install_instrumentation()
+    start_time = time.monotonic()
+    exit_code = run_program(program, args)
+    wall_time_seconds = time.monotonic() - start_time
+
+    usages = [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)]
+    with _counts_lock:
+        metrics = {
+            "succeeded": exit_code == 0,
+            "wall_time_seconds": wall_time_seconds,
+            "cpu_time_seconds": sum(usage.ru_utime + usage.ru_stime for usage in usages),
+            "peak_rss_kb": max(usage.ru_maxrss for usage in usages),
+            **_counts
+        }
+    print(STAGE_USAGE_LINE_PREFIX + json.dumps(metrics), flush=True)
+
+    if run_id is not None:
+        log_stage_event(run_id, get_stage_event_key("StageEnd", stage_name, metrics))
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a pipeline stage's program, then outputs the resources it used "
+                                                 f"on a line starting with '{STAGE_USAGE_LINE_PREFIX}'")
+
+    parser.add_argument("--log-stage-events", nargs=2, metavar=("run-id", "stage-name"),
+                        help="Log the start and end of the stage to the operations dashboard with "
+                             "log_pipeline_event.py, under the given pipeline run id and stage name. The end event's "
+                             "key includes the stage's metrics")
+    parser.add_argument("program", help="Path to the stage's Python program")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments to run the program with")
+
+    args = parser.parse_args()
+
+    run_id, stage_name = args.log_stage_events if args.log_stage_events is not None else (None, None)
+    exit(run_stage_program(args.program, args.args, run_id, stage_name))
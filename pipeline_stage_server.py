@@ -0,0 +1,195 @@
+import argparse
+import array
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+from pipeline_stage_runner import run_program
+
+# This file is copied into the reused pipeline container by run_pipeline.py, with pipeline_stage_runner.py, where it's
+# run in two ways:
+#  - `serve`, as the container's long-lived main process, in the pipeline's Python environment. It imports the
+#    pipeline's dependencies and configuration once, then forks a process to run each stage that it's sent.
+#  - `run`, with `docker exec`, to send a stage to the server and wait for it to exit. This only needs the standard
+#    library, so it's run with the image's python rather than with pdm, which would start the Python environment again.
+log = logging.getLogger(__name__)
+
+SOCKET_PATH = "/tmp/pipeline-stage-server.sock"
+
+# Each message is sent as a 4-byte big-endian length, then that many bytes of JSON.
+_LENGTH_FORMAT = "!I"
+
+
+def _send_message(sock, message, fds=None):
+    data = json.dumps(message).encode("utf-8")
+    data = struct.pack(_LENGTH_FORMAT, len(data)) + data
+    if fds is None:
+        sock.sendall(data)
+        return
+
+    # Send the file descriptors with the first part of the message, then the rest of the message if it didn't all fit.
+    sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+    sock.sendall(data[sent:])
+
+
+def _receive_exactly(sock, length):
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError("Connection closed before a whole message was received")
+        data += chunk
+    return data
+
+
+def _receive_message(sock, max_fds=0):
+    """
+    :return: Tuple of (message, file descriptors received with it).
+    :rtype: (dict, list of int)
+    """
+    length_size = struct.calcsize(_LENGTH_FORMAT)
+    fds = array.array("i")
+    data, ancillary_data, _, _ = sock.recvmsg(length_size, socket.CMSG_LEN(max_fds * fds.itemsize))
+    for level, message_type, fd_data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+    if len(data) == 0:
+        raise ConnectionError("Connection closed before a message was received")
+
+    data += _receive_exactly(sock, length_size - len(data))
+    message = json.loads(_receive_exactly(sock, struct.unpack(_LENGTH_FORMAT, data)[0]).decode("utf-8"))
+    return message, list(fds)
+
+
+def _run_program(program, args, cwd, fds):
+    """
+    Runs a Python program in this process, as if it had been run with `python <program> <args>`, then exits.
+
+    :param fds: File descriptors to use as stdin, stdout and stderr.
+    :type fds: list of int
+    """
+    exit_code = 1
+    try:
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        os.chdir(cwd)
+        exit_code = run_program(program, args)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        # Exit without running the server's cleanup, e.g. closing its socket. `run_program` flushes the program's
+        # output before it returns.
+        os._exit(exit_code)
+
+
+def _supervise_program(connection):
+    """
+    Runs the program requested on a connection in a child process, then sends the connection its exit code.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    request, fds = _receive_message(connection, max_fds=3)
+    pid = os.fork()
+    if pid == 0:
+        connection.close()
+        _run_program(request["program"], request["args"], request["cwd"], fds)
+    for fd in fds:
+        os.close(fd)
+
+    _, status = os.waitpid(pid, 0)
+    exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+    _send_message(connection, {"exit_code": exit_code})
+
+
+def serve(preload_modules):
+    """
+    Imports the given modules, then runs each program sent to SOCKET_PATH by `run` in a fork of this process, so that
+    the programs don't each have to start Python and import the modules again.
+
+    Each connection is handled by a forked supervisor process, which forks again to run the program, so that programs
+    can run at the same time and each program's exit code can be sent back when it exits.
+
+    The preloaded modules mustn't start threads or open network connections when they're imported, because these
+    aren't inherited safely by the forked processes. The pipeline's configuration modules only define the
+    configuration, so are safe to preload.
+
+    :param preload_modules: Names of the modules to import before accepting programs to run.
+    :type preload_modules: list of str
+    """
+    for module in preload_modules:
+        log.info(f"Preloading {module}...")
+        importlib.import_module(module)
+
+    # Let the kernel reap the supervisor processes when they exit.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen()
+    log.info(f"Listening on {SOCKET_PATH}")
+
+    while True:
+        connection, _ = server.accept()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            exit_code = 1
+            try:
+                server.close()
+                _supervise_program(connection)
+                exit_code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(exit_code)
+        connection.close()
+
+
+def run(program, args):
+    """
+    Runs a program with the server listening on SOCKET_PATH, with this process's stdin, stdout, stderr and working
+    directory, and waits for it to exit.
+
+    To report a stage's resource usage, run its program with pipeline_stage_runner.py.
+
+    :return: The program's exit code.
+    :rtype: int
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(SOCKET_PATH)
+        _send_message(client, {"program": program, "args": args, "cwd": os.getcwd()},
+                      fds=[sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        result, _ = _receive_message(client)
+
+    return result["exit_code"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs Python programs in forks of a long-lived server process")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Preload modules, then run the programs sent by `run`")
+    serve_parser.add_argument("preload_modules", metavar="preload-module", nargs="*",
+                              help="Module to import before accepting programs to run, e.g. configuration")
+
+    run_parser = subparsers.add_parser("run", help="Run a program with the server, and exit with its exit code")
+    run_parser.add_argument("program", help="Path to the Python program to run")
+    run_parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments to run the program with")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.mode == "serve":
+        serve(args.preload_modules)
+    else:
+        exit(run(args.program, args.args))
@@ -1,11 +1,24 @@
 import argparse
 import csv
+import gzip
+import json
+import os
 import re
-from collections import defaultdict
-import uuid
-from datetime import datetime, timedelta
+import resource
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, takewhile
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from functools import lru_cache
+from heapq import merge
 
+import numpy as np
 import pytz
 from core_data_modules.logging import Logger
 from dateutil.parser import isoparse
@@ -16,9 +29,38 @@ from temba_client.v2 import Message as RapidProMessage
 log = Logger(__name__)
 
 TARGET_SHORTCODE = "378"
+HORMUUD_TIMEZONE = pytz.timezone("Africa/Mogadishu")
+# Africa/Mogadishu has had a fixed offset from UTC since 1957, so the tzinfo pytz localizes to can be re-used for every
+# timestamp rather than localizing each one.
+HORMUUD_TZINFO = HORMUUD_TIMEZONE.localize(datetime(2000, 1, 1)).tzinfo
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime_to_epoch_microseconds(dt):
+    """
+    :param dt: Timezone-aware datetime to convert.
+    :type dt: datetime
+    :return: Number of microseconds between the unix epoch and `dt`.
+    :rtype: int
+    """
+    return (dt - UNIX_EPOCH) // ONE_MICROSECOND
+
+
+def epoch_microseconds_to_hormuud_datetime(epoch_microseconds):
+    """
+    :param epoch_microseconds: Number of microseconds since the unix epoch.
+    :type epoch_microseconds: int
+    :return: Datetime `epoch_microseconds` after the unix epoch, in EAT.
+    :rtype: datetime
+    """
+    return (UNIX_EPOCH + timedelta(microseconds=epoch_microseconds)).astimezone(HORMUUD_TZINFO)
 
 
 class MatchedMessage:
+    __slots__ = ["rapid_pro_message", "recovered_message"]
+
     def __init__(self, rapid_pro_message, recovered_message):
         """
         Represents two message objects, one from Rapid Pro, and one from a recovery CSV, that have been identified as
@@ -35,20 +77,173 @@ class MatchedMessage:
         self.recovered_message = recovered_message
 
 
+class HormuudTimestampParser:
+    # Formats of the "ReceivedOn" timestamps seen in Hormuud recovery CSVs, as (strptime format, regex matching that
+    # format, indices of the regex groups containing the (year, month, day, hour, minute, second, fraction)).
+    # The regexes accept the same strings as the strptime formats, but are much faster to apply.
+    FORMATS = [
+        ("%d/%m/%Y %H:%M:%S.%f",
+         re.compile("(\\d{1,2})/(\\d{1,2})/(\\d{4}) (\\d{1,2}):(\\d{1,2}):(\\d{1,2})\\.(\\d{1,6})"),
+         (3, 2, 1, 4, 5, 6, 7)),
+        ("%d/%m/%Y %H:%M:%S", re.compile("(\\d{1,2})/(\\d{1,2})/(\\d{4}) (\\d{1,2}):(\\d{1,2}):(\\d{1,2})"),
+         (3, 2, 1, 4, 5, 6, None)),
+        ("%Y-%m-%d %H:%M:%S", re.compile("(\\d{4})-(\\d{1,2})-(\\d{1,2}) (\\d{1,2}):(\\d{1,2}):(\\d{1,2})"),
+         (1, 2, 3, 4, 5, 6, None))
+    ]
+
+    def __init__(self):
+        """
+        Parses the "ReceivedOn" timestamps in a Hormuud recovery CSV into timezone-aware datetimes in EAT.
+
+        Recovery CSVs use one timestamp format per file, so the format is detected from the first timestamp parsed and
+        then reused for each following timestamp. The format is only detected again if a timestamp doesn't match it.
+        """
+        self._format = None
+
+    def _detect_format(self, raw_timestamp):
+        for timestamp_format in self.FORMATS:
+            if timestamp_format[1].fullmatch(raw_timestamp) is not None:
+                log.debug(f"Detected Hormuud timestamp format '{timestamp_format[0]}'")
+                return timestamp_format
+
+        raise ValueError(f"Timestamp '{raw_timestamp}' does not match any of the supported Hormuud timestamp formats "
+                         f"{[timestamp_format[0] for timestamp_format in self.FORMATS]}")
+
+    def parse(self, raw_timestamp):
+        """
+        :param raw_timestamp: Timestamp string from the "ReceivedOn" column of a Hormuud recovery CSV.
+        :type raw_timestamp: str
+        :rtype: datetime
+        """
+        match = None if self._format is None else self._format[1].fullmatch(raw_timestamp)
+        if match is None:
+            self._format = self._detect_format(raw_timestamp)
+            match = self._format[1].fullmatch(raw_timestamp)
+
+        year, month, day, hour, minute, second, fraction = self._format[2]
+        return datetime(
+            int(match.group(year)), int(match.group(month)), int(match.group(day)),
+            int(match.group(hour)), int(match.group(minute)), int(match.group(second)),
+            0 if fraction is None else int(match.group(fraction).ljust(6, "0")),
+            tzinfo=HORMUUD_TZINFO
+        )
+
+
+class RecoveredMessageStore:
+    def __init__(self):
+        """
+        Compact, columnar store of the messages in a recovery dataset.
+
+        Each message is identified by its integer row id in this store. Senders and receivers are interned, because
+        they repeat across many messages, and timestamps are stored as microseconds since the unix epoch in an array,
+        rather than as one timezone-aware datetime object per message.
+
+        Use `get` to access a message as a `RecoveredMessage`.
+        """
+        self.senders = []  # of str
+        self.receivers = []  # of str
+        self.texts = []  # of str
+        self.raw_timestamps = []  # of str
+        self.timestamps = array("q")  # of microseconds since the unix epoch
+
+    def __len__(self):
+        return len(self.texts)
+
+    def append(self, sender, receiver, text, timestamp, raw_timestamp):
+        """
+        Adds a message to this store.
+
+        :param sender: Urn of the message sender.
+        :type sender: str
+        :param receiver: Short code to which the message was sent.
+        :type receiver: str
+        :param text: Message text.
+        :type text: str
+        :param timestamp: Time the message was received.
+        :type timestamp: datetime
+        :param raw_timestamp: Time the message was received, as it appeared in the recovery dataset.
+        :type raw_timestamp: str
+        :return: Id of the added message.
+        :rtype: int
+        """
+        self.senders.append(sys.intern(sender))
+        self.receivers.append(sys.intern(receiver))
+        self.texts.append(text)
+        self.raw_timestamps.append(raw_timestamp)
+        self.timestamps.append(datetime_to_epoch_microseconds(timestamp))
+        return len(self.texts) - 1
+
+    def select(self, message_ids):
+        """
+        Creates a new store containing only the given messages.
+
+        :param message_ids: Ids of the messages to copy to the new store.
+        :type message_ids: list of int
+        :return: New store, where the message with id i is a copy of the message in this store with id message_ids[i].
+        :rtype: RecoveredMessageStore
+        """
+        selected = RecoveredMessageStore()
+        selected.senders = [self.senders[message_id] for message_id in message_ids]
+        selected.receivers = [self.receivers[message_id] for message_id in message_ids]
+        selected.texts = [self.texts[message_id] for message_id in message_ids]
+        selected.raw_timestamps = [self.raw_timestamps[message_id] for message_id in message_ids]
+        selected.timestamps = array("q", [self.timestamps[message_id] for message_id in message_ids])
+        return selected
+
+    def get(self, message_id):
+        """
+        :param message_id: Id of the message to get.
+        :type message_id: int
+        :rtype: RecoveredMessage
+        """
+        return RecoveredMessage(self, message_id)
+
+    def get_ids_sorted_by_timestamp(self):
+        """
+        :return: Ids of all the messages in this store, sorted by timestamp. Messages with the same timestamp are
+                 returned in the order they were added.
+        :rtype: list of int
+        """
+        return sorted(range(len(self)), key=self.timestamps.__getitem__)
+
+
 class RecoveredMessage:
-    def __init__(self, sender, receiver, text, timestamp, raw_timestamp, message_id=None):
-        if message_id is None:
-            message_id = uuid.uuid4()
+    __slots__ = ["store", "message_id"]
+
+    def __init__(self, store, message_id):
+        """
+        A message in a recovery dataset, backed by a row in a `RecoveredMessageStore`.
 
+        :param store: Store containing this message.
+        :type store: RecoveredMessageStore
+        :param message_id: Id of this message in the `store`.
+        :type message_id: int
+        """
+        self.store = store
         self.message_id = message_id
-        self.sender = sender
-        self.receiver = receiver
-        self.text = text
-        self.timestamp = timestamp
-        self.raw_timestamp = raw_timestamp
+
+    @property
+    def sender(self):
+        return self.store.senders[self.message_id]
+
+    @property
+    def receiver(self):
+        return self.store.receivers[self.message_id]
+
+    @property
+    def text(self):
+        return self.store.texts[self.message_id]
+
+    @property
+    def timestamp(self):
+        return epoch_microseconds_to_hormuud_datetime(self.store.timestamps[self.message_id])
+
+    @property
+    def raw_timestamp(self):
+        return self.store.raw_timestamps[self.message_id]
 
     @classmethod
-    def from_hormuud_csv_row(cls, row):
+    def from_hormuud_csv_row(cls, row, store, timestamp_parser=None):
         """
         Creates a `RecoveredMessage` from a row in a Hormuud recovery CSV.
 
@@ -57,34 +252,164 @@ class RecoveredMessage:
           - "Receiver": short code to which the message was sent.
           - "Message": raw message text
           - "ReceivedOn": string representing the date in EAT.
+
+        :param row: Row to create the `RecoveredMessage` from.
+        :type row: dict of str -> str
+        :param store: Store to add the message to.
+        :type store: RecoveredMessageStore
+        :param timestamp_parser: Parser to use to parse the "ReceivedOn" timestamp. Pass the same parser when
+                                 creating messages from many rows of the same file, so the timestamp format is only
+                                 detected once. If None, a new parser is used.
+        :type timestamp_parser: HormuudTimestampParser | None
         """
-        try:
-            timestamp = pytz.timezone("Africa/Mogadishu").localize(
-                datetime.strptime(row["ReceivedOn"], "%d/%m/%Y %H:%M:%S.%f")
-            )
-        except ValueError:
-            try:
-                timestamp = pytz.timezone("Africa/Mogadishu").localize(
-                    datetime.strptime(row["ReceivedOn"], "%d/%m/%Y %H:%M:%S")
-                )
-            except ValueError:
-                timestamp = pytz.timezone("Africa/Mogadishu").localize(
-                    datetime.strptime(row["ReceivedOn"], "%Y-%m-%d %H:%M:%S")
-                )
+        if timestamp_parser is None:
+            timestamp_parser = HormuudTimestampParser()
+        timestamp = timestamp_parser.parse(row["ReceivedOn"])
 
-        return RecoveredMessage(
+        return store.get(store.append(
             sender="tel:+" + row["Sender"],
             receiver=row["Receiver"],
             text=row["Message"],
             raw_timestamp=row["ReceivedOn"],
             timestamp=timestamp
-        )
+        ))
+
+
+class RapidProMessageCache:
+    def __init__(self, cache_dir, rapid_pro_domain):
+        """
+        On-disk cache of the raw messages downloaded from a Rapid Pro workspace, so that re-runs over overlapping time
+        ranges only need to download the messages that aren't already cached.
+
+        Messages are stored in one JSONL partition per UTC day of their `created_on`. Each partition has a watermark:
+        all the messages created on that day before the watermark are in the partition. A day whose watermark is the
+        end of the day is complete, and is never downloaded again.
+
+        :param cache_dir: Directory to store the cache in. Each Rapid Pro domain is cached in a separate
+                          sub-directory.
+        :type cache_dir: str
+        :param rapid_pro_domain: Domain of the Rapid Pro server that the cached messages are downloaded from.
+        :type rapid_pro_domain: str
+        """
+        self._cache_dir = os.path.join(cache_dir, rapid_pro_domain.replace("/", "_"))
+
+    def _get_partition_path(self, day):
+        return os.path.join(self._cache_dir, f"messages-{day.date().isoformat()}.jsonl")
+
+    def _get_watermarks_path(self):
+        return os.path.join(self._cache_dir, "watermarks.json")
+
+    def _load_watermarks(self):
+        if not os.path.exists(self._get_watermarks_path()):
+            return dict()
+
+        with open(self._get_watermarks_path()) as f:
+            return {day: isoparse(watermark) for day, watermark in json.load(f).items()}
+
+    def _save_watermarks(self, watermarks):
+        with open(self._get_watermarks_path() + ".tmp", "w") as f:
+            json.dump({day: watermark.isoformat() for day, watermark in watermarks.items()}, f, indent=2,
+                      sort_keys=True)
+        os.replace(self._get_watermarks_path() + ".tmp", self._get_watermarks_path())
+
+    def _load_partition(self, day):
+        if not os.path.exists(self._get_partition_path(day)):
+            return []
+
+        with open(self._get_partition_path(day)) as f:
+            return [RapidProMessage.deserialize(json.loads(line)) for line in f]
+
+    def _append_to_partition(self, day, messages):
+        # Rewrite the whole partition, skipping messages that are already in it, so that a run which is interrupted
+        # after writing a partition but before saving its watermark doesn't leave duplicates in the cache.
+        partition = self._load_partition(day)
+        cached_message_ids = {msg.id for msg in partition}
+        partition.extend(msg for msg in messages if msg.id not in cached_message_ids)
+
+        with open(self._get_partition_path(day) + ".tmp", "w") as f:
+            for msg in partition:
+                f.write(json.dumps(msg.serialize()) + "\n")
+        os.replace(self._get_partition_path(day) + ".tmp", self._get_partition_path(day))
+
+    def get_raw_messages(self, rapid_pro, created_after_inclusive, created_before_exclusive):
+        """
+        Gets the raw messages created in the given time range, downloading any that aren't in the cache yet.
+
+        :param rapid_pro: Client to use to download messages that aren't in the cache.
+        :type rapid_pro: rapid_pro_tools.rapid_pro_client.RapidProClient
+        :param created_after_inclusive: Start of the time range to get messages for.
+        :type created_after_inclusive: datetime
+        :param created_before_exclusive: End of the time range to get messages for.
+        :type created_before_exclusive: datetime
+        :rtype: list of RapidProMessage
+        """
+        os.makedirs(self._cache_dir, exist_ok=True)
+        watermarks = self._load_watermarks()
+
+        # Find the UTC days that overlap the requested time range.
+        days = []
+        day = datetime.combine(created_after_inclusive.astimezone(timezone.utc).date(), datetime.min.time(),
+                               tzinfo=timezone.utc)
+        while day < created_before_exclusive:
+            days.append(day)
+            day += timedelta(days=1)
+
+        # Download the messages for each run of consecutive days that are not complete in the cache, from the
+        # watermark of the first day in the run.
+        incomplete_days = [day for day in days
+                           if watermarks.get(day.date().isoformat(), day) < day + timedelta(days=1)]
+        runs = []  # of list of consecutive incomplete days
+        for day in incomplete_days:
+            if len(runs) > 0 and runs[-1][-1] + timedelta(days=1) == day:
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+
+        for run in runs:
+            download_start = watermarks.get(run[0].date().isoformat(), run[0])
+            download_end = run[-1] + timedelta(days=1)
+            # Cap the download at the current time, so that a day which hasn't ended yet is only cached as far as
+            # the time it was downloaded.
+            download_end = min(download_end, datetime.now(timezone.utc))
+            log.info(f"Downloading messages created between {download_start} and {download_end}, because they are "
+                     f"not in the Rapid Pro message cache...")
+            downloaded_messages = rapid_pro.get_raw_messages(
+                created_after_inclusive=download_start,
+                created_before_exclusive=download_end,
+                ignore_archives=True
+            )
+            log.info(f"Downloaded {len(downloaded_messages)} messages")
+
+            for day in run:
+                day_watermark = watermarks.get(day.date().isoformat(), day)
+                day_end = day + timedelta(days=1)
+                self._append_to_partition(
+                    day, [msg for msg in downloaded_messages if day_watermark <= msg.created_on < day_end]
+                )
+                watermarks[day.date().isoformat()] = max(day_watermark, min(day_end, download_end))
+            self._save_watermarks(watermarks)
+
+        log.info(f"Loading messages created between {created_after_inclusive} and {created_before_exclusive} from "
+                 f"the Rapid Pro message cache...")
+        messages = []
+        for day in days:
+            messages.extend(msg for msg in self._load_partition(day)
+                            if created_after_inclusive <= msg.created_on < created_before_exclusive)
+        log.info(f"Loaded {len(messages)} messages from the Rapid Pro message cache")
+
+        return messages
 
 
 def get_incoming_hormuud_messages_from_rapid_pro(google_cloud_credentials_file_path, rapid_pro_domain,
                                                  rapid_pro_token_file_url,
-                                                 created_after_inclusive=None, created_before_exclusive=None):
+                                                 created_after_inclusive=None, created_before_exclusive=None,
+                                                 cache_dir=None):
     """
+    :param cache_dir: Directory to cache the messages downloaded from Rapid Pro in, so that subsequent calls for
+                      overlapping time ranges only download the messages that aren't already cached.
+                      If None, or if either end of the time range is None, all the messages are downloaded from
+                      Rapid Pro.
+    :type cache_dir: str | None
     :rtype: list of RapidProMessage
     """
     log.info("Downloading Rapid Pro access token...")
@@ -93,12 +418,17 @@ def get_incoming_hormuud_messages_from_rapid_pro(google_cloud_credentials_file_p
 
     rapid_pro = RapidProClient(rapid_pro_domain, rapid_pro_token)
 
-    all_messages = rapid_pro.get_raw_messages(
-        created_after_inclusive=created_after_inclusive,
-        created_before_exclusive=created_before_exclusive,
-        ignore_archives=True
-    )
-    log.info(f"Downloaded {len(all_messages)} messages")
+    if cache_dir is not None and created_after_inclusive is not None and created_before_exclusive is not None:
+        all_messages = RapidProMessageCache(cache_dir, rapid_pro_domain).get_raw_messages(
+            rapid_pro, created_after_inclusive, created_before_exclusive
+        )
+    else:
+        all_messages = rapid_pro.get_raw_messages(
+            created_after_inclusive=created_after_inclusive,
+            created_before_exclusive=created_before_exclusive,
+            ignore_archives=True
+        )
+        log.info(f"Downloaded {len(all_messages)} messages")
 
     log.info(f"Filtering for messages from URNs on Hormuud's networks")
     hormuud_messages = [msg for msg in all_messages if msg.urn.startswith("tel:+25261") or msg.urn.startswith("tel:+25268")]
@@ -111,55 +441,471 @@ def get_incoming_hormuud_messages_from_rapid_pro(google_cloud_credentials_file_p
     return incoming_hormuud_messages
 
 
-def get_incoming_hormuud_messages_from_recovery_csv(csv_path,
-                                                    received_after_inclusive=None, received_before_exclusive=None):
+def get_run_arguments(start_date, end_date, rapid_pro_domain, recovery_csv_path):
+    """
+    Gets the arguments of a run that determine which messages it matches, to be saved with its checkpoints so that
+    they can't be resumed from by a run with different arguments.
+
+    :param start_date: Timestamp the datasets are filtered by (inclusive).
+    :type start_date: datetime.datetime
+    :param end_date: Timestamp the datasets are filtered by (exclusive).
+    :type end_date: datetime.datetime
+    :param rapid_pro_domain: URL of the Rapid Pro server the messages are downloaded from.
+    :type rapid_pro_domain: str
+    :param recovery_csv_path: Path to the recovery CSV the messages are recovered from.
+    :type recovery_csv_path: str
+    :rtype: dict of str -> str
+    """
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "rapid_pro_domain": rapid_pro_domain,
+        "recovery_csv_path": os.path.abspath(recovery_csv_path)
+    }
+
+
+def check_run_arguments(checkpoint_path, saved_run_arguments, run_arguments):
+    """
+    Checks that a checkpoint was saved by a run with the same arguments as this one.
+
+    :param checkpoint_path: Path to the checkpoint, for the error message.
+    :type checkpoint_path: str
+    :param saved_run_arguments: Arguments saved in the checkpoint, or None if the checkpoint has none.
+    :type saved_run_arguments: dict of str -> str | None
+    :param run_arguments: Arguments of this run, as returned by `get_run_arguments`.
+    :type run_arguments: dict of str -> str
+    :raises ValueError: If the arguments are different.
+    """
+    if saved_run_arguments is None:
+        raise ValueError(f"Checkpoint {checkpoint_path} doesn't record the arguments of the run that saved it, so it "
+                         f"can't be resumed from. Re-run without --resume")
+
+    differences = [f"{key} was {saved_run_arguments.get(key)} but is now {value}"
+                   for key, value in run_arguments.items() if saved_run_arguments.get(key) != value]
+    if len(differences) > 0:
+        raise ValueError(f"Checkpoint {checkpoint_path} was saved by a run with different arguments "
+                         f"({'; '.join(differences)}), so it can't be resumed from. Re-run without --resume, or "
+                         f"with the same arguments")
+
+
+def write_rapid_pro_messages(rapid_pro_messages, jsonl_path, run_arguments=None):
     """
-    :rtype: list of RecoveredMessage
+    Writes Rapid Pro messages to a JSONL file, so they can be read back by `read_rapid_pro_messages` instead of being
+    downloaded again.
+
+    :type rapid_pro_messages: list of RapidProMessage
+    :type jsonl_path: str
+    :param run_arguments: If not None, arguments of the run that downloaded the messages, as returned by
+                          `get_run_arguments`. These are written to a file alongside the messages, at
+                          `{jsonl_path}.arguments.json`.
+    :type run_arguments: dict of str -> str | None
+    """
+    if run_arguments is not None:
+        with open(jsonl_path + ".arguments.json.tmp", "w") as f:
+            json.dump(run_arguments, f)
+        os.replace(jsonl_path + ".arguments.json.tmp", jsonl_path + ".arguments.json")
+
+    with open(jsonl_path + ".tmp", "w") as f:
+        for msg in rapid_pro_messages:
+            f.write(json.dumps(msg.serialize()) + "\n")
+    os.replace(jsonl_path + ".tmp", jsonl_path)
+
+
+def read_rapid_pro_messages(jsonl_path, run_arguments=None):
+    """
+    :type jsonl_path: str
+    :param run_arguments: If not None, arguments of this run, as returned by `get_run_arguments`. The messages are
+                          only read if they were written by a run with the same arguments.
+    :type run_arguments: dict of str -> str | None
+    :raises ValueError: If `run_arguments` is not None and the messages were written by a run with different
+                        arguments.
+    :rtype: list of RapidProMessage
+    """
+    if run_arguments is not None:
+        saved_run_arguments = None
+        if os.path.exists(jsonl_path + ".arguments.json"):
+            with open(jsonl_path + ".arguments.json") as f:
+                saved_run_arguments = json.load(f)
+        check_run_arguments(jsonl_path, saved_run_arguments, run_arguments)
+
+    with open(jsonl_path) as f:
+        return [RapidProMessage.deserialize(json.loads(line)) for line in f]
+
+
+def load_incoming_hormuud_messages_from_recovery_csv(csv_path, recovered_message_store,
+                                                     received_after_inclusive=None, received_before_exclusive=None):
+    """
+    Streams the messages sent to the target short code in the given time range from a Hormuud recovery CSV into a
+    `RecoveredMessageStore`.
+
+    Rows are filtered on their "Receiver" before any other processing, and on their timestamp before they are added
+    to the store, so that the (typically very many) rows that are not needed are cheap to skip.
+
+    :param csv_path: Path to the Hormuud recovery CSV to load.
+    :type csv_path: str
+    :param recovered_message_store: Store to add the loaded messages to.
+    :type recovered_message_store: RecoveredMessageStore
     """
     log.info(f"Loading recovered messages from Hormuud csv at {csv_path}...")
-    all_recovered_messages = []
+    timestamp_parser = HormuudTimestampParser()
+    rows_read = 0
+    rows_to_target_shortcode = 0
+    rows_loaded = 0
     with open(csv_path) as f:
-        reader = csv.DictReader(f)
-        for line in reader:
-            all_recovered_messages.append(RecoveredMessage.from_hormuud_csv_row(line))
-    log.info(f"Loaded {len(all_recovered_messages)} messages")
+        reader = csv.reader(f)
+        header = next(reader)
+        sender_col = header.index("Sender")
+        receiver_col = header.index("Receiver")
+        message_col = header.index("Message")
+        received_on_col = header.index("ReceivedOn")
+
+        for row in reader:
+            rows_read += 1
+            if row[receiver_col] != TARGET_SHORTCODE:
+                continue
+            rows_to_target_shortcode += 1
 
-    log.info(f"Filtering for messages sent to the target short code {TARGET_SHORTCODE}...")
-    incoming_recovered_messages = [msg for msg in all_recovered_messages if msg.receiver == TARGET_SHORTCODE]
-    log.info(f"Filtered for messages sent to the target short code {TARGET_SHORTCODE}: "
-             f"{len(incoming_recovered_messages)} recovered messages remain")
+            timestamp = timestamp_parser.parse(row[received_on_col])
+            if received_after_inclusive is not None and timestamp < received_after_inclusive:
+                continue
+            if received_before_exclusive is not None and timestamp >= received_before_exclusive:
+                continue
+            rows_loaded += 1
+
+            recovered_message_store.append(
+                sender="tel:+" + row[sender_col],
+                receiver=row[receiver_col],
+                text=row[message_col],
+                raw_timestamp=row[received_on_col],
+                timestamp=timestamp
+            )
 
-    if received_after_inclusive is not None:
-        log.info(f"Filtering out messages sent before {received_after_inclusive}...")
-        incoming_recovered_messages = [msg for msg in incoming_recovered_messages
-                                       if msg.timestamp >= received_after_inclusive]
-        log.info(f"Filtered out messages sent before {received_after_inclusive}: "
-                 f"{len(incoming_recovered_messages)} messages remain")
-    if received_before_exclusive is not None:
-        log.info(f"Filtering out messages sent after {received_before_exclusive}...")
-        incoming_recovered_messages = [msg for msg in incoming_recovered_messages
-                                       if msg.timestamp < received_before_exclusive]
-        log.info(f"Filtered out messages sent after {received_before_exclusive}: "
-                 f"{len(incoming_recovered_messages)} messages remain")
+    log.info(f"Loaded {rows_read} messages, of which {rows_to_target_shortcode} were sent to the target short code "
+             f"{TARGET_SHORTCODE} and {rows_loaded} of those were received between {received_after_inclusive} "
+             f"and {received_before_exclusive}")
 
-    return incoming_recovered_messages
+
+def get_incoming_hormuud_messages_from_recovery_csv(csv_path,
+                                                    received_after_inclusive=None, received_before_exclusive=None):
+    """
+    :rtype: RecoveredMessageStore
+    """
+    recovered_message_store = RecoveredMessageStore()
+    load_incoming_hormuud_messages_from_recovery_csv(
+        csv_path, recovered_message_store, received_after_inclusive, received_before_exclusive
+    )
+    return recovered_message_store
 
 
-def filter_matched_messages_from_recovered(matched_messages, recovered_messages):
+def group_recovered_messages_by_urn(recovered_message_store, recovered_message_ids):
     """
-    :type matched_messages: list of MatchedMessage
-    :type recovered_messages: list of RecoveredMessage
+    :type recovered_message_store: RecoveredMessageStore
+    :type recovered_message_ids: list of int
+    :return: Dictionary of urn -> ids of the recovered messages from this urn.
+    :rtype: dict of str -> (list of int)
     """
-    matched_message_ids = {match.recovered_message.message_id for match in matched_messages}
-    return [msg for msg in recovered_messages if msg.message_id not in matched_message_ids]
+    urn_to_recovered_message_ids = defaultdict(list)
+    senders = recovered_message_store.senders
+    for message_id in recovered_message_ids:
+        urn_to_recovered_message_ids[senders[message_id]].append(message_id)
+    return urn_to_recovered_message_ids
+
+
+class RecoveredMessageIndex:
+    def __init__(self, recovered_message_store, urn_to_recovered_message_ids):
+        """
+        Index of recovered messages that supports fast lookup of the messages from a given urn that were received
+        before a given time.
+
+        Message ids are stored sorted by timestamp for each urn, so the candidates for a Rapid Pro message can be found
+        with a bisect rather than by testing every message from the same urn. Messages that have been matched are
+        marked as consumed rather than deleted, so one index can be built up-front and updated in place as each
+        match strategy is applied, and consumed messages are not returned by later lookups.
+
+        :param recovered_message_store: Store containing the recovered messages to index.
+        :type recovered_message_store: RecoveredMessageStore
+        :param urn_to_recovered_message_ids: Ids of the recovered messages to index, grouped by urn of the message
+                                             sender.
+        :type urn_to_recovered_message_ids: dict of str -> (list of int)
+        """
+        self._store = recovered_message_store
+        self._urn_to_message_ids = dict()  # of urn -> array of message id, sorted by timestamp
+        self._urn_to_timestamps = dict()  # of urn -> array of epoch microseconds, parallel to _urn_to_message_ids
+        self._urn_to_remaining_count = dict()  # of urn -> number of messages from that urn not yet consumed
+        # Position in _urn_to_message_ids[urn] before which every message is known to be consumed. Matches are usually
+        # the earliest remaining messages, so this lets lookups skip over most of the consumed messages.
+        self._urn_to_first_remaining = dict()  # of urn -> int
+        self._consumed = bytearray(len(recovered_message_store))  # of 1 if message id i is consumed, otherwise 0
+        self._remaining_count = 0
+        store_timestamps = recovered_message_store.timestamps
+        for urn, message_ids in urn_to_recovered_message_ids.items():
+            message_ids = sorted(message_ids, key=store_timestamps.__getitem__)
+            self._urn_to_message_ids[urn] = array("q", message_ids)
+            self._urn_to_timestamps[urn] = array("q", [store_timestamps[message_id] for message_id in message_ids])
+            self._urn_to_remaining_count[urn] = len(message_ids)
+            self._urn_to_first_remaining[urn] = 0
+            self._remaining_count += len(message_ids)
+
+        # Arrays describing the indexed messages for `find_earliest_matches`, built on demand.
+        self._vectorized_arrays = None
+
+        # Prefix tries over the texts of each urn's messages, built on demand by `get_prefix_candidates`.
+        # Each trie node is a dict of next character -> child node, and the node reached by a message's text holds
+        # a list of (position in _urn_to_message_ids[urn], message id) at the key None.
+        self._urn_to_prefix_trie = dict()  # of urn -> trie root node
+
+    def __len__(self):
+        return self._remaining_count
+
+    def count_messages(self, urn):
+        """
+        :type urn: str
+        :return: Number of messages from the given urn remaining in this index.
+        :rtype: int
+        """
+        return self._urn_to_remaining_count.get(urn, 0)
+
+    def has_messages(self, urn):
+        """
+        :type urn: str
+        :return: Whether there are any messages from the given urn remaining in this index.
+        :rtype: bool
+        """
+        return self.count_messages(urn) > 0
+
+    def get_remaining_message_ids(self, message_ids):
+        """
+        :param message_ids: Ids of messages in this index.
+        :type message_ids: iterable of int
+        :return: The ids in `message_ids` of the messages that haven't been consumed, in the same order.
+        :rtype: list of int
+        """
+        consumed = self._consumed
+        return [message_id for message_id in message_ids if not consumed[message_id]]
+
+    def get_candidates(self, urn, received_before_inclusive=None):
+        """
+        Gets the messages from the given urn that were received before the given time, in timestamp order.
+
+        Note that the returned iterable is lazy, so must not be used after calling `remove`.
+
+        :param urn: Urn of the sender to get the messages of.
+        :type urn: str
+        :param received_before_inclusive: Latest timestamp to return messages for, or None to return all the messages
+                                          from this urn.
+        :type received_before_inclusive: datetime | None
+        :rtype: iterable of RecoveredMessage
+        """
+        if urn not in self._urn_to_message_ids:
+            return iter(())
+
+        message_ids = self._urn_to_message_ids[urn]
+        consumed = self._consumed
+        start = self._urn_to_first_remaining[urn]
+        while start < len(message_ids) and consumed[message_ids[start]]:
+            start += 1
+        self._urn_to_first_remaining[urn] = start
+
+        end = len(message_ids)
+        if received_before_inclusive is not None:
+            end = bisect_right(self._urn_to_timestamps[urn], datetime_to_epoch_microseconds(received_before_inclusive))
+
+        return (self._store.get(message_id) for message_id in islice(message_ids, start, end)
+                if not consumed[message_id])
+
+    def _get_vectorized_arrays(self):
+        if self._vectorized_arrays is None:
+            # Give every indexed urn and text an integer id, so that messages can be grouped with array operations.
+            urn_ids = dict()  # of urn -> int
+            text_ids = dict()  # of text -> int
+            message_ids = []  # of int, in the order of the per-urn arrays
+            message_urn_ids = []  # of int, parallel to message_ids
+            message_text_ids = []  # of int, parallel to message_ids
+            texts = self._store.texts
+            for urn, urn_message_ids in self._urn_to_message_ids.items():
+                urn_id = urn_ids.setdefault(urn, len(urn_ids))
+                for message_id in urn_message_ids:
+                    message_ids.append(message_id)
+                    message_urn_ids.append(urn_id)
+                    message_text_ids.append(text_ids.setdefault(texts[message_id], len(text_ids)))
+
+            message_ids = np.array(message_ids, dtype=np.int64)
+            self._vectorized_arrays = (
+                urn_ids, text_ids, message_ids, np.array(message_urn_ids, dtype=np.int64),
+                np.array(message_text_ids, dtype=np.int64),
+                np.array(self._store.timestamps, dtype=np.int64)[message_ids]
+            )
+        return self._vectorized_arrays
+
+    def find_earliest_matches(self, rapid_pro_messages, latest_timestamps, match_on_text):
+        """
+        Finds the message each of the given Rapid Pro messages would be matched with if, in order, each Rapid Pro
+        message were matched with the earliest remaining message from the same urn that was received by its latest
+        timestamp and, if `match_on_text` is True, that has the same text.
+
+        All the matches are found at once with array operations. Within each group of messages with the same urn (and
+        text), the number of recovered messages the i'th Rapid Pro message could match is
+        c_i = #{recovered timestamps <= latest_timestamps[i]}, so the number matched by the first i + 1 Rapid Pro
+        messages is m_i = min(m_{i-1} + 1, c_i), which is min(i + 1, i + min_{k <= i}(c_k - k)). The i'th Rapid Pro
+        message is matched if m_i > m_{i-1}, to the m_{i-1}'th recovered message.
+
+        This index is not modified. The caller should `remove` the matched messages.
+
+        :param rapid_pro_messages: Rapid Pro messages to find matches for, in the order they would be matched.
+        :type rapid_pro_messages: list of RapidProMessage
+        :param latest_timestamps: Latest time each Rapid Pro message's match can have been received, in epoch
+                                  microseconds. These must be in non-decreasing order.
+        :type latest_timestamps: list of int
+        :param match_on_text: Whether matching messages must have the same text.
+        :type match_on_text: bool
+        :return: Message that each Rapid Pro message would be matched with, or None if it wouldn't be matched.
+        :rtype: list of (RecoveredMessage | None)
+        """
+        urn_ids, text_ids, message_ids, message_urn_ids, message_text_ids, message_timestamps = \
+            self._get_vectorized_arrays()
+
+        # Assign each message to a group, such that messages can only match messages in the same group.
+        # Rapid Pro messages that can't be in a group with any recovered messages are given the group -1.
+        rapid_pro_urn_ids = np.array([urn_ids.get(msg.urn, -1) for msg in rapid_pro_messages], dtype=np.int64)
+        if match_on_text:
+            rapid_pro_text_ids = np.array([text_ids.get(msg.text, -1) for msg in rapid_pro_messages], dtype=np.int64)
+            rapid_pro_groups = np.where(
+                (rapid_pro_urn_ids >= 0) & (rapid_pro_text_ids >= 0),
+                rapid_pro_urn_ids * len(text_ids) + rapid_pro_text_ids, -1
+            )
+            recovered_groups = message_urn_ids * len(text_ids) + message_text_ids
+        else:
+            rapid_pro_groups = rapid_pro_urn_ids
+            recovered_groups = message_urn_ids
+
+        # Only the recovered messages that haven't been consumed can be matched.
+        remaining = np.frombuffer(self._consumed, dtype=np.uint8)[message_ids] == 0
+        recovered_ids = message_ids[remaining]
+        recovered_groups = recovered_groups[remaining]
+        recovered_timestamps = message_timestamps[remaining]
+
+        rapid_pro_indices = np.flatnonzero(rapid_pro_groups >= 0)
+        rapid_pro_groups = rapid_pro_groups[rapid_pro_indices]
+        rapid_pro_timestamps = np.array(latest_timestamps, dtype=np.int64)[rapid_pro_indices]
+
+        # Sort all the messages by (group, timestamp), with recovered messages before Rapid Pro messages with the same
+        # timestamp, because a recovered message received exactly at the latest timestamp can match. The sort is
+        # stable, so recovered messages with the same timestamp stay in index order and Rapid Pro messages stay in the
+        # order they are matched in.
+        recovered_count = len(recovered_ids)
+        groups = np.concatenate([recovered_groups, rapid_pro_groups])
+        timestamps = np.concatenate([recovered_timestamps, rapid_pro_timestamps])
+        is_rapid_pro = np.concatenate([np.zeros(recovered_count, dtype=np.int8),
+                                       np.ones(len(rapid_pro_groups), dtype=np.int8)])
+        order = np.lexsort((is_rapid_pro, timestamps, groups))
+        sorted_is_rapid_pro = is_rapid_pro[order] == 1
+        # Number of recovered messages before each position in the sorted order.
+        recovered_before = np.cumsum(~sorted_is_rapid_pro) - (~sorted_is_rapid_pro)
+
+        sorted_recovered_ids = recovered_ids[order[~sorted_is_rapid_pro]]
+        sorted_recovered_groups = groups[order[~sorted_is_rapid_pro]]
+
+        # For each Rapid Pro message in (group, timestamp) order: its group, the position in sorted_recovered_ids
+        # where its group starts, and c, the number of its group's recovered messages received by its latest time.
+        rapid_pro_order = order[sorted_is_rapid_pro] - recovered_count  # index into rapid_pro_indices
+        group = groups[order[sorted_is_rapid_pro]]
+        group_start = np.searchsorted(sorted_recovered_groups, group, side="left")
+        c = recovered_before[sorted_is_rapid_pro] - group_start
+
+        # Position of each Rapid Pro message within its group.
+        n = len(group)
+        positions = np.arange(n, dtype=np.int64)
+        is_group_start = np.ones(n, dtype=bool)
+        is_group_start[1:] = group[1:] != group[:-1]
+        position_in_group = positions - np.maximum.accumulate(np.where(is_group_start, positions, 0))
+
+        # Cumulative minimum of c - position within each group. Offset each group's values below every earlier
+        # group's, so that a single cumulative minimum over all the groups never crosses a group boundary.
+        # c - position is in [-n, recovered_count], so offsets this far apart are enough.
+        group_number = np.cumsum(is_group_start) - 1
+        offset = (n + recovered_count + 1) * group_number
+        running_min = np.minimum.accumulate(c - position_in_group - offset) + offset
+        matched_count = np.minimum(position_in_group + 1, position_in_group + running_min)
+        previous_matched_count = np.where(is_group_start, 0, np.concatenate([[0], matched_count[:-1]]))
+        is_matched = matched_count > previous_matched_count
+
+        matches = np.full(len(rapid_pro_messages), -1, dtype=np.int64)
+        matches[rapid_pro_indices[rapid_pro_order[is_matched]]] = \
+            sorted_recovered_ids[group_start[is_matched] + previous_matched_count[is_matched]]
+        return [None if message_id < 0 else self._store.get(message_id) for message_id in matches.tolist()]
+
+    def _build_prefix_trie(self, urn):
+        root = dict()
+        consumed = self._consumed
+        for position, message_id in enumerate(self._urn_to_message_ids.get(urn, [])):
+            # Messages are never un-consumed, so there's no need to add the messages that are already consumed.
+            if consumed[message_id]:
+                continue
+
+            node = root
+            for c in self._store.texts[message_id]:
+                node = node.setdefault(c, dict())
+            node.setdefault(None, []).append((position, message_id))
+
+        self._urn_to_prefix_trie[urn] = root
+
+    def get_prefix_candidates(self, urn, text, received_before_inclusive=None):
+        """
+        Gets the messages from the given urn whose texts are non-empty prefixes of the given text and that were
+        received before the given time, in timestamp order.
+
+        The messages are found with a single walk down a prefix trie of the urn's message texts, rather than by
+        testing every message from the urn.
+
+        Note that the returned iterable is lazy, so must not be used after calling `remove`.
+
+        :param urn: Urn of the sender to get the messages of.
+        :type urn: str
+        :param text: Text that the returned messages' texts must be prefixes of.
+        :type text: str
+        :param received_before_inclusive: Latest timestamp to return messages for, or None to return all the messages
+                                          from this urn whose texts are prefixes of `text`.
+        :type received_before_inclusive: datetime | None
+        :rtype: iterable of RecoveredMessage
+        """
+        if urn not in self._urn_to_prefix_trie:
+            self._build_prefix_trie(urn)
+
+        latest_timestamp = None
+        if received_before_inclusive is not None:
+            latest_timestamp = datetime_to_epoch_microseconds(received_before_inclusive)
+        store_timestamps = self._store.timestamps
+        consumed = self._consumed
+
+        # Collect the messages with each prefix of `text` that were received early enough. Each node's messages are
+        # in timestamp order, so stop at the first message that was received too late.
+        hits = []  # of iterable of (position, message id), for each prefix of `text` that is the text of a message
+        node = self._urn_to_prefix_trie[urn]
+        for c in text:
+            node = node.get(c)
+            if node is None:
+                break
+
+            entries = node.get(None)
+            if not entries:
+                continue
 
+            entries = (entry for entry in entries if not consumed[entry[1]])
+            if latest_timestamp is not None:
+                entries = takewhile(lambda entry: store_timestamps[entry[1]] <= latest_timestamp, entries)
+            hits.append(entries)
 
-def group_recovered_messages_by_urn(recovered_messages):
-    urn_to_recovered_messages = defaultdict(list)  # of urn -> list of recovered message from this urn.
-    for recovered_msg in recovered_messages:
-        urn = recovered_msg.sender
-        urn_to_recovered_messages[urn].append(recovered_msg)
-    return urn_to_recovered_messages
+        return (self._store.get(message_id) for _, message_id in merge(*hits))
+
+    def remove(self, recovered_message):
+        """
+        Removes a message from this index e.g. because it has been matched.
+
+        :type recovered_message: RecoveredMessage
+        """
+        self._consumed[recovered_message.message_id] = 1
+        self._urn_to_remaining_count[recovered_message.sender] -= 1
+        self._remaining_count -= 1
 
 
 class MatchStrategy:
@@ -174,6 +920,41 @@ class MatchStrategy:
         """
         self.name = name
         self.csv_log_file_path = csv_log_file_path
+        self.max_time_delta = None
+        # If not None, messages match under this strategy exactly when they have the same sender, the recovered
+        # message was received by `get_latest_match_timestamp`, and, if this is True, they have the same text. This
+        # lets `apply_match_strategy` find all of the strategy's matches at once with
+        # `RecoveredMessageIndex.find_earliest_matches`, instead of testing each pair of messages.
+        self.vectorized_match_on_text = None
+
+    def get_latest_match_timestamp(self, rapid_pro_message):
+        """
+        Gets the latest timestamp a recovered message can have and still be matched with the given Rapid Pro message
+        under this strategy.
+
+        :type rapid_pro_message: RapidProMessage
+        :return: Latest timestamp a matching recovered message can have, or None if this strategy doesn't constrain
+                 the timestamps of matching messages.
+        :rtype: datetime | None
+        """
+        if self.max_time_delta is None:
+            return None
+        return rapid_pro_message.sent_on + self.max_time_delta
+
+    def get_candidates(self, rapid_pro_message, recovered_message_index):
+        """
+        Gets the recovered messages that could match the given Rapid Pro message under this strategy, in the order to
+        test them with `messages_match`.
+
+        By default, these are all the messages from the same urn that were received early enough to be a match.
+
+        :type rapid_pro_message: RapidProMessage
+        :type recovered_message_index: RecoveredMessageIndex
+        :rtype: iterable of RecoveredMessage
+        """
+        return recovered_message_index.get_candidates(
+            rapid_pro_message.urn, self.get_latest_match_timestamp(rapid_pro_message)
+        )
 
     def messages_match(self, rapid_pro_message, recovered_message):
         """
@@ -185,14 +966,14 @@ class MatchStrategy:
         """
         return False
 
-    def skip_message(self, rapid_pro_message, matched_messages):
+    def skip_message(self, rapid_pro_message, matched_urns_and_texts):
         """
         Whether the given Rapid Pro message should be skipped without looking for a match e.g. because it is a duplicate
 
         :param rapid_pro_message: Rapid Pro message to test whether it should be skipped.
         :type rapid_pro_message: RapidProMessage
-        :param matched_messages: Messages that have been matched so far.
-        :type matched_messages: list of MatchedMessage
+        :param matched_urns_and_texts: (urn, text) of each of the Rapid Pro messages that have been matched so far.
+        :type matched_urns_and_texts: set of (str, str)
         """
         return False
 
@@ -205,6 +986,7 @@ class ExactMatch(MatchStrategy):
         """
         super().__init__("Exact Match", csv_log_file_path)
         self.max_time_delta = max_time_delta
+        self.vectorized_match_on_text = True
 
     def messages_match(self, rapid_pro_message, recovered_message):
         if rapid_pro_message.urn != recovered_message.sender:
@@ -219,6 +1001,49 @@ class ExactMatch(MatchStrategy):
         return True
 
 
+# Patterns used to reproduce the changes Excel makes to text when it is saved to a recovery CSV.
+NUMBER_IN_WHITESPACE_REGEX = re.compile("^\\s*[0-9]+\\s*$")
+ZERO_IN_WHITESPACE_REGEX = re.compile("\\s*0+\\s*")
+STRICTLY_QUOTED_TEXT_REGEX = re.compile("^\".*\"$")
+
+
+@lru_cache(maxsize=2 ** 20)
+def excel_mangle_text(text):
+    """
+    Applies some common Excel-manipulations to the given text, producing the text that would be expected in a
+    recovery CSV if the original text was opened and re-saved in Excel.
+
+    Results are cached, because the same text is typically compared against many candidate recovered messages.
+
+    :param text: Text to mangle, e.g. the text of a Rapid Pro message.
+    :type text: str
+    :rtype: str
+    """
+    text = text.replace("\n", " ")  # newlines -> spaces
+    text = text.strip()
+    # Match numbers in whitespace, unless the number is zero.
+    if NUMBER_IN_WHITESPACE_REGEX.fullmatch(text) and not ZERO_IN_WHITESPACE_REGEX.fullmatch(text):
+        text = text.strip()  # numbers with whitespace -> just the number
+        if text.startswith("0"):
+            text = text[1:]  # replace leading 0
+        if Decimal(text) > 1000000000:
+            text = f"{Decimal(text):.4E}"  # big numbers -> scientific notation
+    if STRICTLY_QUOTED_TEXT_REGEX.match(text):
+        text = text.replace("\"", "")  # strictly quoted text -> just the text
+    return to_excel_ascii(text)
+
+
+@lru_cache(maxsize=2 ** 20)
+def to_excel_ascii(text):
+    """
+    :param text: Text to convert.
+    :type text: str
+    :return: `text`, with non-ascii characters replaced with '?'.
+    :rtype: str
+    """
+    return text.encode("ascii", "replace").decode("ascii")
+
+
 class ExcelMangledMatch(MatchStrategy):
     def __init__(self, max_time_delta, csv_log_file_path=None):
         """
@@ -235,21 +1060,8 @@ class ExcelMangledMatch(MatchStrategy):
         if recovered_message.timestamp - rapid_pro_message.sent_on > self.max_time_delta:
             return False
 
-        rapid_pro_text = rapid_pro_message.text
-        rapid_pro_text = rapid_pro_text.replace("\n", " ")  # newlines -> spaces
-        rapid_pro_text = rapid_pro_text.strip()
-        # Match numbers in whitespace, unless the number is zero.
-        if re.compile("^\\s*[0-9]+\\s*$").fullmatch(rapid_pro_text) and not re.compile("\\s*0+\\s*").fullmatch(rapid_pro_text):
-            rapid_pro_text = rapid_pro_text.strip()  # numbers with whitespace -> just the number
-            if rapid_pro_text.startswith("0"):
-                rapid_pro_text = rapid_pro_text[1:]  # replace leading 0
-            if Decimal(rapid_pro_text) > 1000000000:
-                rapid_pro_text = f"{Decimal(rapid_pro_text):.4E}"  # big numbers -> scientific notation
-        if re.compile("^\".*\"$").match(rapid_pro_text):
-            rapid_pro_text = rapid_pro_text.replace("\"", "")  # strictly quoted text -> just the text
-        rapid_pro_text = rapid_pro_text.encode("ascii", "replace").decode("ascii")  # non-ascii characters -> '?'
-
-        recovered_text = recovered_message.text.encode("ascii", "replace").decode("ascii")  # non-ascii characters -> '?'
+        rapid_pro_text = excel_mangle_text(rapid_pro_message.text)
+        recovered_text = to_excel_ascii(recovered_message.text)
 
         # Match messages erroneously interpreted as a formula
         if rapid_pro_text.startswith("=") and recovered_text == "#NAME?":
@@ -268,17 +1080,10 @@ class Duplicates(MatchStrategy):
         """
         super().__init__("Duplicates", csv_log_file_path)
 
-    def skip_message(self, rapid_pro_message, matched_messages):
+    def skip_message(self, rapid_pro_message, matched_urns_and_texts):
         # A Rapid Pro message is a duplicate if contains the same text and sender as another Rapid Pro message
         # that was successfully matched.
-        matched_rapid_pro_messages = [match.rapid_pro_message for match in matched_messages
-                                      if match.rapid_pro_message is not None]
-
-        for msg in matched_rapid_pro_messages:
-            if rapid_pro_message.urn == msg.urn and rapid_pro_message.text == msg.text:
-                return True
-
-        return False
+        return (rapid_pro_message.urn, rapid_pro_message.text) in matched_urns_and_texts
 
 
 class ClippedMatch(MatchStrategy):
@@ -288,8 +1093,15 @@ class ClippedMatch(MatchStrategy):
         the recovered message, and their timestamps differ by less than the `max_time_delta`. This handles messages that
         have been clipped in the recovery dataset.
         """
-        self.max_time_delta = max_time_delta
         super().__init__("Clipped", csv_log_file_path)
+        self.max_time_delta = max_time_delta
+
+    def get_candidates(self, rapid_pro_message, recovered_message_index):
+        # Only the recovered messages whose texts are prefixes of the Rapid Pro message's text can match, so look
+        # these up in the index's prefix trie instead of testing every message from the same urn.
+        return recovered_message_index.get_prefix_candidates(
+            rapid_pro_message.urn, rapid_pro_message.text, self.get_latest_match_timestamp(rapid_pro_message)
+        )
 
     def messages_match(self, rapid_pro_message, recovered_message):
         if rapid_pro_message.urn != recovered_message.sender:
@@ -315,6 +1127,7 @@ class TimestampMatch(MatchStrategy):
         """
         super().__init__("Timestamp Match", csv_log_file_path)
         self.max_time_delta = max_time_delta
+        self.vectorized_match_on_text = False
 
     def messages_match(self, rapid_pro_message, recovered_message):
         if rapid_pro_message.urn != recovered_message.sender:
@@ -326,8 +1139,164 @@ class TimestampMatch(MatchStrategy):
         return True
 
 
-def apply_match_strategy(match_strategy, rapid_pro_messages_to_match, urn_to_recovered_messages,
-                         previously_matched_messages):
+def get_memory_usage():
+    """
+    :return: Tuple of (current resident set size, peak resident set size) of this process, in bytes. The current size
+             is None on platforms that don't provide /proc/self/statm.
+    :rtype: (int | None, int)
+    """
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open("/proc/self/statm") as f:
+            current_rss = int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        current_rss = None
+    return current_rss, peak_rss
+
+
+class MatchStrategyMetrics:
+    def __init__(self, strategy_name):
+        """
+        Measurements of the work done by a match strategy, for sizing runs and finding the strategies that dominate the
+        runtime on a given dataset.
+
+        :param strategy_name: Name of the strategy being measured.
+        :type strategy_name: str
+        """
+        self.strategy_name = strategy_name
+        self.wall_time_seconds = 0.0
+        self.rapid_pro_messages = 0
+        self.messages_match_calls = 0
+        # Number of Rapid Pro messages that examined n candidates, keyed on n.bit_length() i.e. in power-of-2 buckets.
+        self.candidates_examined_histogram = Counter()
+        self.urn_to_peak_candidates = dict()  # of urn -> the most recovered messages from that urn searched at once
+        self.memory_at_start = None  # of (current rss, peak rss) in bytes
+        self.memory_at_end = None  # of (current rss, peak rss) in bytes
+        self._start_time = None
+
+    def start(self):
+        self.memory_at_start = get_memory_usage()
+        self._start_time = time.perf_counter()
+
+    def end(self):
+        self.wall_time_seconds += time.perf_counter() - self._start_time
+        self.memory_at_end = get_memory_usage()
+
+    def record_rapid_pro_message(self, urn, candidates_count, candidates_examined):
+        """
+        :param urn: Urn of the Rapid Pro message.
+        :type urn: str
+        :param candidates_count: Number of recovered messages from this urn that could have been searched.
+        :type candidates_count: int
+        :param candidates_examined: Number of recovered messages that were tested against the Rapid Pro message.
+        :type candidates_examined: int
+        """
+        self.rapid_pro_messages += 1
+        self.messages_match_calls += candidates_examined
+        self.candidates_examined_histogram[candidates_examined.bit_length()] += 1
+        if candidates_count > self.urn_to_peak_candidates.get(urn, 0):
+            self.urn_to_peak_candidates[urn] = candidates_count
+
+    def merge(self, other):
+        """
+        Merges the metrics measured for the same strategy on another shard of the data into these metrics.
+
+        Shards are matched concurrently, so the wall time and memory usage reported are the maximum of the shards'.
+
+        :type other: MatchStrategyMetrics
+        """
+        self.wall_time_seconds = max(self.wall_time_seconds, other.wall_time_seconds)
+        self.rapid_pro_messages += other.rapid_pro_messages
+        self.messages_match_calls += other.messages_match_calls
+        self.candidates_examined_histogram.update(other.candidates_examined_histogram)
+        for urn, peak_candidates in other.urn_to_peak_candidates.items():
+            self.urn_to_peak_candidates[urn] = max(self.urn_to_peak_candidates.get(urn, 0), peak_candidates)
+        for attr in ["memory_at_start", "memory_at_end"]:
+            if getattr(self, attr) is None:
+                setattr(self, attr, getattr(other, attr))
+            elif getattr(other, attr) is not None:
+                setattr(self, attr, tuple(
+                    None if a is None or b is None else max(a, b)
+                    for a, b in zip(getattr(self, attr), getattr(other, attr))
+                ))
+
+    def get_state(self):
+        """
+        :return: All of these metrics, as a JSON-serializable dict that can be restored with `from_state`.
+        :rtype: dict
+        """
+        return {
+            "strategy_name": self.strategy_name,
+            "wall_time_seconds": self.wall_time_seconds,
+            "rapid_pro_messages": self.rapid_pro_messages,
+            "messages_match_calls": self.messages_match_calls,
+            "candidates_examined_histogram": sorted(self.candidates_examined_histogram.items()),
+            "urn_to_peak_candidates": self.urn_to_peak_candidates,
+            "memory_at_start": self.memory_at_start,
+            "memory_at_end": self.memory_at_end
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        :param state: Metrics state, as returned by `get_state`.
+        :type state: dict
+        :rtype: MatchStrategyMetrics
+        """
+        metrics = cls(state["strategy_name"])
+        metrics.wall_time_seconds = state["wall_time_seconds"]
+        metrics.rapid_pro_messages = state["rapid_pro_messages"]
+        metrics.messages_match_calls = state["messages_match_calls"]
+        metrics.candidates_examined_histogram = Counter(dict(state["candidates_examined_histogram"]))
+        metrics.urn_to_peak_candidates = state["urn_to_peak_candidates"]
+        metrics.memory_at_start = None if state["memory_at_start"] is None else tuple(state["memory_at_start"])
+        metrics.memory_at_end = None if state["memory_at_end"] is None else tuple(state["memory_at_end"])
+        return metrics
+
+    def to_dict(self, top_urns_count=20):
+        """
+        :param top_urns_count: Number of urns with the largest peak candidate counts to include.
+        :type top_urns_count: int
+        :rtype: dict
+        """
+        def bucket_name(bit_length):
+            if bit_length <= 1:
+                return str(bit_length)
+            return f"{2 ** (bit_length - 1)}-{2 ** bit_length - 1}"
+
+        def memory_dict(memory):
+            return None if memory is None else {"rss_bytes": memory[0], "peak_rss_bytes": memory[1]}
+
+        top_urns = sorted(self.urn_to_peak_candidates.items(), key=lambda x: (-x[1], x[0]))[:top_urns_count]
+        return {
+            "strategy": self.strategy_name,
+            "wall_time_seconds": self.wall_time_seconds,
+            "rapid_pro_messages": self.rapid_pro_messages,
+            "messages_match_calls": self.messages_match_calls,
+            "candidates_examined_histogram": {
+                bucket_name(bit_length): self.candidates_examined_histogram[bit_length]
+                for bit_length in sorted(self.candidates_examined_histogram)
+            },
+            "peak_candidates": max(self.urn_to_peak_candidates.values(), default=0),
+            "peak_candidates_by_urn": [{"urn": urn, "peak_candidates": peak} for urn, peak in top_urns],
+            "memory_at_start": memory_dict(self.memory_at_start),
+            "memory_at_end": memory_dict(self.memory_at_end)
+        }
+
+
+def write_match_metrics(metrics_by_strategy, json_path):
+    """
+    :type metrics_by_strategy: list of MatchStrategyMetrics
+    :type json_path: str
+    """
+    log.info(f"Writing match strategy metrics to {json_path}...")
+    with open(json_path, "w") as f:
+        json.dump([metrics.to_dict() for metrics in metrics_by_strategy], f, indent=2)
+
+
+def apply_match_strategy(match_strategy, rapid_pro_messages_to_match, recovered_message_index, matched_urns_and_texts,
+                         metrics=None, match_log_writer=None):
     """
     Applies a match strategy to find all the matches between sets of Rapid Pro messages and recovery messages.
 
@@ -335,59 +1304,892 @@ def apply_match_strategy(match_strategy, rapid_pro_messages_to_match, urn_to_rec
     :type match_strategy: MatchStrategy
     :param rapid_pro_messages_to_match: Rapid Pro messages to try to match using this strategy.
     :type rapid_pro_messages_to_match: list of RapidProMessage
-    :param urn_to_recovered_messages: Recovery messages to try to match using this strategy, grouped by urn of the
-                                      message sender.
-    :type urn_to_recovered_messages: dict of str -> (list of RecoveredMessage)
-    :param previously_matched_messages: Messages that were matched by previous match strategies.
-    :type previously_matched_messages: list of MatchedMessage
+    :param recovered_message_index: Index of the recovery messages to try to match using this strategy. Messages
+                                    matched by this strategy are removed from the index in-place.
+    :type recovered_message_index: RecoveredMessageIndex
+    :param matched_urns_and_texts: (urn, text) of each of the Rapid Pro messages that have been matched so far.
+                                   This is updated in-place with the (urn, text) of each message matched by this
+                                   strategy.
+    :type matched_urns_and_texts: set of (str, str)
+    :param metrics: Metrics to record the work done by this strategy in, or None to not record metrics.
+    :type metrics: MatchStrategyMetrics | None
+    :param match_log_writer: If not None, writer to log each match to as soon as it is made, as opened by
+                             `open_match_log_writer`.
+    :type match_log_writer: MessageWriter | None
     :return: Tuple of (messages that were matched, messages that were skipped, messages that were not matched).
     :rtype: (list of MatchedMessage, list of RapidProMessage, list of RapidProMessage)
     """
-    matched_message_ids = set()  # of str
+    if metrics is not None:
+        metrics.start()
+
     matched_messages = []  # of MatchedMessage
     unmatched_rapid_pro_messages = []  # of RapidProMessage
     skipped_messages = []  # of RapidProMessage
 
-    # For each Rapid Pro message to be matched:
-    # Search all the recovered messages from the same urn for a message that matches, or check if this message should
-    # be skipped
-    for rapid_pro_msg in rapid_pro_messages_to_match:
-        recovered_messages = urn_to_recovered_messages[rapid_pro_msg.urn]
+    # If this strategy's matches can be found with array operations, find them all up-front. This needs the Rapid
+    # Pro messages to be in order of their latest match timestamps, which they are when sorted by sent_on.
+    vectorized_matches = None  # of RecoveredMessage | None, for each Rapid Pro message
+    if match_strategy.vectorized_match_on_text is not None:
+        no_limit = np.iinfo(np.int64).max
+        latest_timestamps = []  # of int
+        for rapid_pro_msg in rapid_pro_messages_to_match:
+            latest_timestamp = match_strategy.get_latest_match_timestamp(rapid_pro_msg)
+            latest_timestamps.append(
+                no_limit if latest_timestamp is None else datetime_to_epoch_microseconds(latest_timestamp)
+            )
+        if all(a <= b for a, b in zip(latest_timestamps, latest_timestamps[1:])):
+            vectorized_matches = recovered_message_index.find_earliest_matches(
+                rapid_pro_messages_to_match, latest_timestamps, match_strategy.vectorized_match_on_text
+            )
 
-        for recovered_msg in recovered_messages:
-            if recovered_msg.message_id in matched_message_ids:
-                continue
+    # For each Rapid Pro message to be matched:
+    # Search the unmatched recovered messages from the same urn that were received early enough to be a match for a
+    # message that matches, or check if this message should be skipped
+    for i, rapid_pro_msg in enumerate(rapid_pro_messages_to_match):
+        if not recovered_message_index.has_messages(rapid_pro_msg.urn):
+            unmatched_rapid_pro_messages.append(rapid_pro_msg)
+            continue
 
-            if match_strategy.messages_match(rapid_pro_msg, recovered_msg):
-                matched_message_ids.add(recovered_msg.message_id)
-                matched_messages.append(MatchedMessage(
-                    rapid_pro_message=rapid_pro_msg,
-                    recovered_message=recovered_msg
-                ))
-                break
+        matching_recovered_msg = None
+        candidates_examined = 0
+        if vectorized_matches is not None:
+            matching_recovered_msg = vectorized_matches[i]
+        else:
+            candidates = match_strategy.get_candidates(rapid_pro_msg, recovered_message_index)
+            for recovered_msg in candidates:
+                candidates_examined += 1
+                if match_strategy.messages_match(rapid_pro_msg, recovered_msg):
+                    matching_recovered_msg = recovered_msg
+                    break
+
+        if metrics is not None:
+            metrics.record_rapid_pro_message(
+                rapid_pro_msg.urn, recovered_message_index.count_messages(rapid_pro_msg.urn), candidates_examined
+            )
 
-            if match_strategy.skip_message(rapid_pro_msg, previously_matched_messages):
-                skipped_messages.append(rapid_pro_msg)
-                break
+        if matching_recovered_msg is not None:
+            recovered_message_index.remove(matching_recovered_msg)
+            matched_urns_and_texts.add((rapid_pro_msg.urn, rapid_pro_msg.text))
+            match = MatchedMessage(
+                rapid_pro_message=rapid_pro_msg,
+                recovered_message=matching_recovered_msg
+            )
+            matched_messages.append(match)
+            if match_log_writer is not None:
+                match_log_writer.write(get_match_log_record(match))
+        elif match_strategy.skip_message(rapid_pro_msg, matched_urns_and_texts):
+            skipped_messages.append(rapid_pro_msg)
         else:
             unmatched_rapid_pro_messages.append(rapid_pro_msg)
 
-    if strategy.csv_log_file_path is not None:
-        log.info(f"Logging matches to {strategy.csv_log_file_path}...")
-        with open(strategy.csv_log_file_path, "w") as f:
-            writer = csv.DictWriter(f, fieldnames=["URN", "Rapid Pro Text", "Recovered Text"])
-            writer.writeheader()
-
-            for match in matched_messages:
-                writer.writerow({
-                    "URN": match.rapid_pro_message.urn,
-                    "Rapid Pro Text": match.rapid_pro_message.text,
-                    "Recovered Text": match.recovered_message.text
-                })
+    if metrics is not None:
+        metrics.end()
 
     return matched_messages, skipped_messages, unmatched_rapid_pro_messages
 
 
+# Formats that message logs and exports can be written in, selected by the extension of the path written to.
+MESSAGE_FILE_FORMATS = ["csv", "csv.gz", "jsonl", "jsonl.gz"]
+
+
+class MessageWriter:
+    def __init__(self, file_path, fieldnames):
+        """
+        Streams records to a file as they are produced, through a buffer, rather than collecting them all before
+        writing them out.
+
+        The format is selected by the file's extension: files ending in .jsonl or .jsonl.gz are written as JSON Lines,
+        and all other files as CSV. Files ending in .gz are gzip-compressed.
+
+        Records must be written with `write`, and the writer closed with `close` (or by using it as a context manager)
+        to flush the buffered records to the file.
+
+        :param file_path: Path of the file to write to.
+        :type file_path: str
+        :param fieldnames: Names of the fields of each record, in the order to write them in.
+        :type fieldnames: list of str
+        """
+        self.file_path = file_path
+        self.records_written = 0
+        if file_path.endswith(".gz"):
+            self._f = gzip.open(file_path, "wt")
+        else:
+            self._f = open(file_path, "w", buffering=1024 * 1024)
+
+        if file_path.endswith(".jsonl") or file_path.endswith(".jsonl.gz"):
+            self._csv_writer = None
+        else:
+            self._csv_writer = csv.DictWriter(self._f, fieldnames=fieldnames)
+            self._csv_writer.writeheader()
+
+    def write(self, record):
+        """
+        :param record: Record to write, as a dict of field name -> value.
+        :type record: dict
+        """
+        if self._csv_writer is None:
+            self._f.write(json.dumps(record) + "\n")
+        else:
+            self._csv_writer.writerow(record)
+        self.records_written += 1
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_match_log_writer(match_strategy):
+    """
+    Opens a writer for the match strategy's log file, if it has one.
+
+    :type match_strategy: MatchStrategy
+    :return: Writer for records made with `get_match_log_record`, or None if the strategy doesn't have a log file.
+    :rtype: MessageWriter | None
+    """
+    if match_strategy.csv_log_file_path is None:
+        return None
+
+    log.info(f"Logging matches to {match_strategy.csv_log_file_path}...")
+    return MessageWriter(match_strategy.csv_log_file_path, ["URN", "Rapid Pro Text", "Recovered Text"])
+
+
+def get_match_log_record(match):
+    """
+    :type match: MatchedMessage
+    :rtype: dict
+    """
+    return {
+        "URN": match.rapid_pro_message.urn,
+        "Rapid Pro Text": match.rapid_pro_message.text,
+        "Recovered Text": match.recovered_message.text
+    }
+
+
+def write_match_log(match_strategy, matched_messages):
+    """
+    Writes the messages matched by a match strategy to the strategy's log file, if it has one.
+
+    :type match_strategy: MatchStrategy
+    :type matched_messages: iterable of MatchedMessage
+    """
+    writer = open_match_log_writer(match_strategy)
+    if writer is None:
+        return
+
+    with writer:
+        for match in matched_messages:
+            writer.write(get_match_log_record(match))
+
+
+def export_skipped_messages(skipped_rapid_pro_messages, skipped_csv_path):
+    """
+    Exports skipped Rapid Pro messages to a CSV, in the format used by tools/archive_matching_messages.py, or to any
+    of the other `MESSAGE_FILE_FORMATS` selected by the path's extension.
+
+    :type skipped_rapid_pro_messages: iterable of RapidProMessage
+    :type skipped_csv_path: str
+    """
+    log.info(f"Exporting skipped messages to {skipped_csv_path}...")
+    with MessageWriter(skipped_csv_path, ["urn", "text", "timestamp"]) as writer:
+        for msg in skipped_rapid_pro_messages:
+            writer.write({
+                "urn": msg.urn,
+                "text": msg.text,
+                "timestamp": msg.sent_on.isoformat()
+            })
+    log.info(f"Exported {writer.records_written} skipped messages")
+
+
+def export_unmatched_recovered_messages(unmatched_recovered_messages, output_csv_path):
+    """
+    Exports recovered messages to a CSV, in the format that can be processed by de_identify_csv.py, or to any of the
+    other `MESSAGE_FILE_FORMATS` selected by the path's extension.
+
+    :type unmatched_recovered_messages: iterable of RecoveredMessage
+    :type output_csv_path: str
+    """
+    log.info(f"Exporting unmatched recovered messages to {output_csv_path}...")
+    with MessageWriter(output_csv_path, ["Sender", "Receiver", "Message", "ReceivedOn"]) as writer:
+        for recovered_msg in unmatched_recovered_messages:
+            writer.write({
+                "Sender": recovered_msg.sender,
+                "Receiver": recovered_msg.receiver,
+                "Message": recovered_msg.text,
+                "ReceivedOn": recovered_msg.raw_timestamp
+            })
+    log.info(f"Exported {writer.records_written} unmatched recovered messages")
+
+
+def create_match_strategies(max_time_delta, log_dir_path=None, log_format="csv"):
+    """
+    Creates the sequence of match strategies to use to match Rapid Pro messages with recovered messages.
+
+    :param max_time_delta: Maximum time difference between a Rapid Pro message and a recovered message for them to be
+                           considered a match.
+    :type max_time_delta: timedelta
+    :param log_dir_path: Directory to write each strategy's log of matched messages to, or None to not write logs.
+    :type log_dir_path: str | None
+    :param log_format: Format to write the logs in. One of `MESSAGE_FILE_FORMATS`.
+    :type log_format: str
+    :rtype: list of MatchStrategy
+    """
+    def log_path(file_name):
+        return None if log_dir_path is None else f"{log_dir_path}/{file_name}.{log_format}"
+
+    return [
+        ExactMatch(max_time_delta, csv_log_file_path=log_path("exact-match-log")),
+        ExcelMangledMatch(max_time_delta, csv_log_file_path=log_path("excel-mangled-log")),
+        Duplicates(csv_log_file_path=log_path("duplicates-log")),
+        ClippedMatch(max_time_delta, csv_log_file_path=log_path("clipped-log")),
+        TimestampMatch(max_time_delta, csv_log_file_path=log_path("timestamp-log"))
+    ]
+
+
+class MatchCheckpoint:
+    def __init__(self, checkpoint_path, run_arguments=None):
+        """
+        On-disk record of the progress made by `match_messages`, saved after each match strategy completes, so that an
+        interrupted run can resume from the last completed strategy instead of starting again.
+
+        Messages are recorded by Rapid Pro message id and by id in the recovered message store, so a checkpoint can
+        only be resumed from with the same Rapid Pro messages and a store loaded from the same recovery csv and dates.
+        To enforce this, the arguments of the run are saved in the checkpoint and checked when it is loaded.
+
+        :param checkpoint_path: Path to the JSON file to store the checkpoint in.
+        :type checkpoint_path: str
+        :param run_arguments: If not None, arguments of this run, as returned by `get_run_arguments`.
+        :type run_arguments: dict of str -> str | None
+        """
+        self._checkpoint_path = checkpoint_path
+        self._run_arguments = run_arguments
+
+    def exists(self):
+        return os.path.exists(self._checkpoint_path)
+
+    def save(self, match_strategies, rapid_pro_messages_count, recovered_messages_count, matched_messages_by_strategy,
+             skipped_rapid_pro_messages_by_strategy, remaining_rapid_pro_messages, remaining_recovered_message_ids,
+             metrics_by_strategy):
+        """
+        Saves the state of `match_messages` after the strategies in `matched_messages_by_strategy` have completed.
+
+        :param match_strategies: All the match strategies being applied, including those that haven't completed yet.
+        :type match_strategies: list of MatchStrategy
+        :param rapid_pro_messages_count: Number of Rapid Pro messages that `match_messages` started with.
+        :type rapid_pro_messages_count: int
+        :param recovered_messages_count: Number of recovered messages that `match_messages` started with.
+        :type recovered_messages_count: int
+        :param matched_messages_by_strategy: Messages matched by each of the completed strategies.
+        :type matched_messages_by_strategy: list of (list of MatchedMessage)
+        :param skipped_rapid_pro_messages_by_strategy: Messages skipped by each of the completed strategies.
+        :type skipped_rapid_pro_messages_by_strategy: list of (list of RapidProMessage)
+        :param remaining_rapid_pro_messages: Rapid Pro messages that haven't been matched or skipped yet.
+        :type remaining_rapid_pro_messages: list of RapidProMessage
+        :param remaining_recovered_message_ids: Ids of the recovered messages that haven't been matched yet.
+        :type remaining_recovered_message_ids: list of int
+        :param metrics_by_strategy: Metrics measured for each of the completed strategies.
+        :type metrics_by_strategy: list of MatchStrategyMetrics
+        """
+        checkpoint = {
+            "run_arguments": self._run_arguments,
+            "match_strategies": [strategy.name for strategy in match_strategies],
+            "rapid_pro_messages_count": rapid_pro_messages_count,
+            "recovered_messages_count": recovered_messages_count,
+            "matched_ids_by_strategy": [
+                [[match.rapid_pro_message.id,
+                  None if match.recovered_message is None else match.recovered_message.message_id]
+                 for match in matched_messages]
+                for matched_messages in matched_messages_by_strategy
+            ],
+            "skipped_rapid_pro_ids_by_strategy": [
+                [msg.id for msg in skipped_rapid_pro_messages]
+                for skipped_rapid_pro_messages in skipped_rapid_pro_messages_by_strategy
+            ],
+            "remaining_rapid_pro_ids": [msg.id for msg in remaining_rapid_pro_messages],
+            "remaining_recovered_message_ids": list(remaining_recovered_message_ids),
+            "metrics_by_strategy": [metrics.get_state() for metrics in metrics_by_strategy]
+        }
+
+        # Write to a temporary file then move it into place, so that a run which is killed while saving doesn't
+        # corrupt the previous checkpoint.
+        with open(self._checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f, separators=(",", ":"))
+        os.replace(self._checkpoint_path + ".tmp", self._checkpoint_path)
+
+    def load(self, match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids):
+        """
+        Loads the state of `match_messages` that was saved in this checkpoint.
+
+        :param match_strategies: All the match strategies being applied.
+        :type match_strategies: list of MatchStrategy
+        :param rapid_pro_messages: All the Rapid Pro messages that `match_messages` started with.
+        :type rapid_pro_messages: list of RapidProMessage
+        :param recovered_message_store: Store containing the recovery messages.
+        :type recovered_message_store: RecoveredMessageStore
+        :param recovered_message_ids: Ids of all the recovery messages that `match_messages` started with.
+        :type recovered_message_ids: list of int
+        :return: Tuple of (messages matched by each completed strategy, messages skipped by each completed strategy,
+                 remaining Rapid Pro messages, ids of the remaining recovered messages, metrics measured for each
+                 completed strategy).
+        :rtype: (list of (list of MatchedMessage), list of (list of RapidProMessage), list of RapidProMessage,
+                 list of int, list of MatchStrategyMetrics)
+        :raises ValueError: If this checkpoint has run arguments and the checkpoint was saved by a run with different
+                            arguments.
+        """
+        with open(self._checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+        if self._run_arguments is not None:
+            check_run_arguments(self._checkpoint_path, checkpoint.get("run_arguments"), self._run_arguments)
+
+        assert checkpoint["match_strategies"] == [strategy.name for strategy in match_strategies] and \
+            checkpoint["rapid_pro_messages_count"] == len(rapid_pro_messages), \
+            f"Checkpoint {self._checkpoint_path} was saved for different match strategies or Rapid Pro messages"
+        assert checkpoint["recovered_messages_count"] == len(recovered_message_ids), \
+            f"Checkpoint {self._checkpoint_path} was saved for a different set of recovered messages"
+
+        rapid_pro_messages_by_id = {msg.id: msg for msg in rapid_pro_messages}
+        matched_messages_by_strategy = [
+            [MatchedMessage(
+                rapid_pro_message=rapid_pro_messages_by_id[rapid_pro_id],
+                recovered_message=None if recovered_message_id is None else
+                recovered_message_store.get(recovered_message_id)
+            ) for rapid_pro_id, recovered_message_id in matched_ids]
+            for matched_ids in checkpoint["matched_ids_by_strategy"]
+        ]
+        skipped_rapid_pro_messages_by_strategy = [
+            [rapid_pro_messages_by_id[rapid_pro_id] for rapid_pro_id in skipped_ids]
+            for skipped_ids in checkpoint["skipped_rapid_pro_ids_by_strategy"]
+        ]
+
+        return (
+            matched_messages_by_strategy,
+            skipped_rapid_pro_messages_by_strategy,
+            [rapid_pro_messages_by_id[rapid_pro_id] for rapid_pro_id in checkpoint["remaining_rapid_pro_ids"]],
+            checkpoint["remaining_recovered_message_ids"],
+            [MatchStrategyMetrics.from_state(state) for state in checkpoint["metrics_by_strategy"]]
+        )
+
+
+def match_messages(match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids,
+                   metrics_by_strategy=None, checkpoint_path=None, resume=False, write_match_logs=False,
+                   run_arguments=None):
+    """
+    Applies a sequence of match strategies, where each strategy only considers the messages that were not matched or
+    skipped by the strategies before it.
+
+    :param match_strategies: Match strategies to apply, in the order to apply them.
+    :type match_strategies: list of MatchStrategy
+    :param rapid_pro_messages: Rapid Pro messages to match, sorted by sent_on.
+    :type rapid_pro_messages: list of RapidProMessage
+    :param recovered_message_store: Store containing the recovery messages.
+    :type recovered_message_store: RecoveredMessageStore
+    :param recovered_message_ids: Ids of the recovery messages to match, sorted by timestamp.
+    :type recovered_message_ids: list of int
+    :param metrics_by_strategy: If not None, the metrics measured for each strategy are appended to this list.
+    :type metrics_by_strategy: list of MatchStrategyMetrics | None
+    :param checkpoint_path: If not None, path to save a `MatchCheckpoint` to after each strategy completes.
+    :type checkpoint_path: str | None
+    :param resume: Whether to resume from the checkpoint at `checkpoint_path`, if there is one, rather than starting
+                   from the first strategy.
+    :type resume: bool
+    :param write_match_logs: Whether to write each strategy's log of matched messages while the strategy is applied,
+                             so that the matches made so far are on disk if this run is interrupted.
+    :type write_match_logs: bool
+    :param run_arguments: If not None, arguments of this run to save in the checkpoint and to check against those saved
+                          in it when resuming, as returned by `get_run_arguments`.
+    :type run_arguments: dict of str -> str | None
+    :return: Tuple of (messages matched by each strategy, messages skipped by each strategy, Rapid Pro messages that
+             were not matched, ids of recovery messages that were not matched).
+    :rtype: (list of (list of MatchedMessage), list of (list of RapidProMessage), list of RapidProMessage,
+             list of int)
+    """
+    checkpoint = None if checkpoint_path is None else MatchCheckpoint(checkpoint_path, run_arguments)
+    rapid_pro_messages_count = len(rapid_pro_messages)
+    recovered_messages_count = len(recovered_message_ids)
+
+    matched_messages_by_strategy = []  # of list of MatchedMessage
+    skipped_rapid_pro_messages_by_strategy = []  # of list of RapidProMessage
+    completed_metrics_by_strategy = []  # of MatchStrategyMetrics
+    if resume and checkpoint is not None and checkpoint.exists():
+        matched_messages_by_strategy, skipped_rapid_pro_messages_by_strategy, rapid_pro_messages, \
+            recovered_message_ids, completed_metrics_by_strategy = checkpoint.load(
+                match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids
+            )
+        log.info(f"Resuming from checkpoint {checkpoint_path}, after match strategy "
+                 f"{len(matched_messages_by_strategy)}/{len(match_strategies)}")
+
+    matched_urns_and_texts = {
+        (match.rapid_pro_message.urn, match.rapid_pro_message.text)
+        for matched_messages in matched_messages_by_strategy for match in matched_messages
+    }  # of (urn, text) of each matched Rapid Pro message
+
+    # Group the recovered messages by urn once, then update the same index in-place as each strategy makes matches.
+    recovered_message_index = RecoveredMessageIndex(
+        recovered_message_store, group_recovered_messages_by_urn(recovered_message_store, recovered_message_ids)
+    )
+    for i, strategy in enumerate(match_strategies):
+        if i < len(matched_messages_by_strategy):
+            if write_match_logs:
+                write_match_log(strategy, matched_messages_by_strategy[i])
+            continue
+
+        log.info(f"Applying match strategy {i + 1}/{len(match_strategies)} '{strategy.name}' to "
+                 f"{len(rapid_pro_messages)} Rapid Pro messages and {len(recovered_message_index)} recovered messages")
+        metrics = MatchStrategyMetrics(strategy.name)
+        match_log_writer = open_match_log_writer(strategy) if write_match_logs else None
+        try:
+            matched_messages, skipped_rapid_pro_messages, unmatched_rapid_pro_messages = apply_match_strategy(
+                strategy, rapid_pro_messages, recovered_message_index, matched_urns_and_texts, metrics,
+                match_log_writer
+            )
+        finally:
+            if match_log_writer is not None:
+                match_log_writer.close()
+        completed_metrics_by_strategy.append(metrics)
+        matched_messages_by_strategy.append(matched_messages)
+        skipped_rapid_pro_messages_by_strategy.append(skipped_rapid_pro_messages)
+        rapid_pro_messages = unmatched_rapid_pro_messages
+        log.info(f"Applied match strategy '{strategy.name}'. {len(matched_messages)} Rapid Pro messages matched by "
+                 f"this strategy, {len(skipped_rapid_pro_messages)} skipped, and {len(rapid_pro_messages)} "
+                 f"remaining, in {metrics.wall_time_seconds:.1f}s using {metrics.messages_match_calls} comparisons")
+
+        if checkpoint is not None:
+            checkpoint.save(
+                match_strategies, rapid_pro_messages_count, recovered_messages_count, matched_messages_by_strategy,
+                skipped_rapid_pro_messages_by_strategy, rapid_pro_messages,
+                recovered_message_index.get_remaining_message_ids(recovered_message_ids), completed_metrics_by_strategy
+            )
+
+    if metrics_by_strategy is not None:
+        metrics_by_strategy.extend(completed_metrics_by_strategy)
+
+    return matched_messages_by_strategy, skipped_rapid_pro_messages_by_strategy, rapid_pro_messages, \
+        recovered_message_index.get_remaining_message_ids(recovered_message_ids)
+
+
+def _match_shard(match_strategies, rapid_pro_messages, recovered_message_store, checkpoint_path=None, resume=False,
+                 run_arguments=None):
+    """
+    Runs `match_messages` on one shard of the data in a worker process.
+
+    The results are returned as indices into `rapid_pro_messages` and ids in `recovered_message_store`, so that they
+    are cheap to send back to the parent process.
+
+    :rtype: (list of (list of (int, int)), list of (list of int), list of int, list of int,
+             list of MatchStrategyMetrics)
+    """
+    rapid_pro_message_indices = {id(msg): i for i, msg in enumerate(rapid_pro_messages)}
+    metrics_by_strategy = []
+    matched_messages_by_strategy, skipped_rapid_pro_messages_by_strategy, unmatched_rapid_pro_messages, \
+        unmatched_recovered_message_ids = match_messages(
+            match_strategies, rapid_pro_messages, recovered_message_store, list(range(len(recovered_message_store))),
+            metrics_by_strategy, checkpoint_path, resume, run_arguments=run_arguments
+        )
+
+    matched_indices_by_strategy = [
+        [(rapid_pro_message_indices[id(match.rapid_pro_message)], match.recovered_message.message_id)
+         for match in matched_messages]
+        for matched_messages in matched_messages_by_strategy
+    ]
+    skipped_indices_by_strategy = [
+        [rapid_pro_message_indices[id(msg)] for msg in skipped_rapid_pro_messages]
+        for skipped_rapid_pro_messages in skipped_rapid_pro_messages_by_strategy
+    ]
+    unmatched_rapid_pro_indices = [rapid_pro_message_indices[id(msg)] for msg in unmatched_rapid_pro_messages]
+
+    return matched_indices_by_strategy, skipped_indices_by_strategy, unmatched_rapid_pro_indices, \
+        unmatched_recovered_message_ids, metrics_by_strategy
+
+
+def _shard_messages_by_urn(rapid_pro_messages, recovered_message_store, recovered_message_ids, shards):
+    """
+    Assigns each message to one of `shards` shards by urn, so that all the messages for an urn are in the same shard.
+
+    :return: Tuple of (indices into `rapid_pro_messages` in each shard, recovered message ids in each shard).
+    :rtype: (list of (list of int), list of (list of int))
+    """
+    # Use a stable hash rather than `hash`, which is randomised for each Python process.
+    def get_shard(urn):
+        return zlib.crc32(urn.encode("utf-8")) % shards
+
+    rapid_pro_indices_by_shard = [[] for _ in range(shards)]  # of list of index into rapid_pro_messages
+    for i, msg in enumerate(rapid_pro_messages):
+        rapid_pro_indices_by_shard[get_shard(msg.urn)].append(i)
+
+    recovered_message_ids_by_shard = [[] for _ in range(shards)]  # of list of id in recovered_message_store
+    for message_id in recovered_message_ids:
+        recovered_message_ids_by_shard[get_shard(recovered_message_store.senders[message_id])].append(message_id)
+
+    return rapid_pro_indices_by_shard, recovered_message_ids_by_shard
+
+
+def _merge_shard_results(match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids,
+                         rapid_pro_indices_by_shard, recovered_message_ids_by_shard, shard_results,
+                         metrics_by_strategy=None):
+    """
+    Maps the results of running `_match_shard` on each shard back to the original messages, in the order
+    `match_messages` would have returned them in.
+
+    :rtype: (list of (list of MatchedMessage), list of (list of RapidProMessage), list of RapidProMessage,
+             list of int)
+    """
+    matched_messages_by_strategy = [[] for _ in match_strategies]  # of list of (rapid pro index, MatchedMessage)
+    skipped_indices_by_strategy = [[] for _ in match_strategies]  # of list of rapid pro index
+    unmatched_rapid_pro_indices = []
+    unmatched_recovered_message_ids = []
+    for rapid_pro_indices, shard_recovered_message_ids, shard_result in \
+            zip(rapid_pro_indices_by_shard, recovered_message_ids_by_shard, shard_results):
+        shard_matched_by_strategy, shard_skipped_by_strategy, shard_unmatched_rapid_pro, shard_unmatched_recovered, \
+            shard_metrics_by_strategy = shard_result
+
+        for matched_messages, shard_matched in zip(matched_messages_by_strategy, shard_matched_by_strategy):
+            for rapid_pro_index, recovered_message_id in shard_matched:
+                matched_messages.append((rapid_pro_indices[rapid_pro_index], MatchedMessage(
+                    rapid_pro_message=rapid_pro_messages[rapid_pro_indices[rapid_pro_index]],
+                    recovered_message=recovered_message_store.get(shard_recovered_message_ids[recovered_message_id])
+                )))
+        for skipped_indices, shard_skipped in zip(skipped_indices_by_strategy, shard_skipped_by_strategy):
+            skipped_indices.extend(rapid_pro_indices[i] for i in shard_skipped)
+        unmatched_rapid_pro_indices.extend(rapid_pro_indices[i] for i in shard_unmatched_rapid_pro)
+        unmatched_recovered_message_ids.extend(shard_recovered_message_ids[i] for i in shard_unmatched_recovered)
+
+    if metrics_by_strategy is not None:
+        for i, strategy in enumerate(match_strategies):
+            metrics = MatchStrategyMetrics(strategy.name)
+            for shard_result in shard_results:
+                metrics.merge(shard_result[4][i])
+            metrics_by_strategy.append(metrics)
+
+    recovered_message_positions = {message_id: i for i, message_id in enumerate(recovered_message_ids)}
+    return (
+        [[match for _, match in sorted(matched_messages, key=lambda x: x[0])]
+         for matched_messages in matched_messages_by_strategy],
+        [[rapid_pro_messages[i] for i in sorted(skipped_indices)] for skipped_indices in skipped_indices_by_strategy],
+        [rapid_pro_messages[i] for i in sorted(unmatched_rapid_pro_indices)],
+        sorted(unmatched_recovered_message_ids, key=recovered_message_positions.__getitem__)
+    )
+
+
+def match_messages_in_parallel(match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids,
+                               workers, metrics_by_strategy=None, checkpoint_dir_path=None, resume=False,
+                               run_arguments=None):
+    """
+    Applies a sequence of match strategies in the same way as `match_messages`, but shards the messages by urn and
+    matches each shard in a separate process.
+
+    Matching is independent for each urn, so the results are identical to those of `match_messages`, and are
+    returned in the same order.
+
+    :param workers: Number of worker processes to use.
+    :type workers: int
+    :param metrics_by_strategy: If not None, the metrics measured for each strategy, merged across all the shards, are
+                                appended to this list.
+    :type metrics_by_strategy: list of MatchStrategyMetrics | None
+    :param checkpoint_dir_path: If not None, directory to save a `MatchCheckpoint` for each shard to.
+    :type checkpoint_dir_path: str | None
+    :param resume: Whether to resume each shard from its checkpoint in `checkpoint_dir_path`, if there is one.
+    :type resume: bool
+    :param run_arguments: If not None, arguments of this run to save in each shard's checkpoint, as returned by
+                          `get_run_arguments`.
+    :type run_arguments: dict of str -> str | None
+    """
+    rapid_pro_indices_by_shard, recovered_message_ids_by_shard = _shard_messages_by_urn(
+        rapid_pro_messages, recovered_message_store, recovered_message_ids, workers
+    )
+
+    log.info(f"Matching messages in {workers} shards, containing "
+             f"{[len(shard) for shard in rapid_pro_indices_by_shard]} Rapid Pro messages and "
+             f"{[len(shard) for shard in recovered_message_ids_by_shard]} recovered messages")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shard_results = list(executor.map(
+            _match_shard,
+            [match_strategies] * workers,
+            [[rapid_pro_messages[i] for i in shard] for shard in rapid_pro_indices_by_shard],
+            [recovered_message_store.select(shard) for shard in recovered_message_ids_by_shard],
+            [None if checkpoint_dir_path is None else f"{checkpoint_dir_path}/matches-shard-{i + 1}-of-{workers}.json"
+             for i in range(workers)],
+            [resume] * workers,
+            [run_arguments] * workers
+        ))
+
+    return _merge_shard_results(
+        match_strategies, rapid_pro_messages, recovered_message_store, recovered_message_ids,
+        rapid_pro_indices_by_shard, recovered_message_ids_by_shard, shard_results, metrics_by_strategy
+    )
+
+
+def match_messages_in_windows(window_match_strategies, window_rapid_pro_messages, recovered_message_store,
+                              window_recovered_message_ids, workers, window_metrics_by_strategy=None,
+                              checkpoint_dir_path=None, resume=False, run_arguments=None):
+    """
+    Applies a sequence of match strategies to each of several recovery windows concurrently, in the same way as
+    `match_messages`.
+
+    Every window is matched in its own process. If there are more workers than windows, the messages in each window
+    are also sharded by urn, as in `match_messages_in_parallel`.
+
+    :param window_match_strategies: Match strategies to apply in each window.
+    :type window_match_strategies: list of (list of MatchStrategy)
+    :param window_rapid_pro_messages: Rapid Pro messages to match in each window, sorted by sent_on.
+    :type window_rapid_pro_messages: list of (list of RapidProMessage)
+    :param recovered_message_store: Store containing the recovery messages.
+    :type recovered_message_store: RecoveredMessageStore
+    :param window_recovered_message_ids: Ids of the recovery messages to match in each window, sorted by timestamp.
+    :type window_recovered_message_ids: list of (list of int)
+    :param workers: Number of worker processes to use. At least one process is used for each window.
+    :type workers: int
+    :param window_metrics_by_strategy: If not None, the metrics measured for each strategy in each window are appended
+                                       to the list for that window.
+    :type window_metrics_by_strategy: list of (list of MatchStrategyMetrics) | None
+    :param checkpoint_dir_path: If not None, directory to save a `MatchCheckpoint` for each shard of each window to.
+    :type checkpoint_dir_path: str | None
+    :param resume: Whether to resume each shard from its checkpoint in `checkpoint_dir_path`, if there is one.
+    :type resume: bool
+    :param run_arguments: If not None, arguments of this run to save in each shard's checkpoint, as returned by
+                          `get_run_arguments`.
+    :type run_arguments: dict of str -> str | None
+    :return: The results `match_messages` would return for each window.
+    :rtype: list of tuple
+    """
+    windows = len(window_match_strategies)
+    shards = max(1, workers // windows)
+
+    window_shards = []  # of (rapid pro indices by shard, recovered message ids by shard) for each window
+    for rapid_pro_messages, recovered_message_ids in zip(window_rapid_pro_messages, window_recovered_message_ids):
+        window_shards.append(_shard_messages_by_urn(
+            rapid_pro_messages, recovered_message_store, recovered_message_ids, shards
+        ))
+
+    log.info(f"Matching messages in {windows} windows of {shards} shards each")
+    with ProcessPoolExecutor(max_workers=max(workers, windows)) as executor:
+        futures = []  # of list of shard future, for each window
+        for window, (rapid_pro_indices_by_shard, recovered_message_ids_by_shard) in enumerate(window_shards):
+            match_strategies = window_match_strategies[window]
+            rapid_pro_messages = window_rapid_pro_messages[window]
+            futures.append([
+                executor.submit(
+                    _match_shard, match_strategies, [rapid_pro_messages[i] for i in rapid_pro_indices],
+                    recovered_message_store.select(shard_recovered_message_ids),
+                    None if checkpoint_dir_path is None else
+                    f"{checkpoint_dir_path}/matches-window-{window + 1}-shard-{shard + 1}-of-{shards}.json",
+                    resume, run_arguments
+                )
+                for shard, (rapid_pro_indices, shard_recovered_message_ids) in
+                enumerate(zip(rapid_pro_indices_by_shard, recovered_message_ids_by_shard))
+            ])
+        window_shard_results = [[future.result() for future in shard_futures] for shard_futures in futures]
+
+    results = []
+    for i, shard_results in enumerate(window_shard_results):
+        rapid_pro_indices_by_shard, recovered_message_ids_by_shard = window_shards[i]
+        results.append(_merge_shard_results(
+            window_match_strategies[i], window_rapid_pro_messages[i], recovered_message_store,
+            window_recovered_message_ids[i], rapid_pro_indices_by_shard, recovered_message_ids_by_shard, shard_results,
+            None if window_metrics_by_strategy is None else window_metrics_by_strategy[i]
+        ))
+    return results
+
+
+# The maximum time difference we can observe between a message in rapid pro and in the recovery csv for it to count as
+# a match depends on the state of the short code's realtime connection at the time. Each epoch is a tuple of
+# (start date (inclusive) or None, end date (exclusive) or None, max_time_delta), in date order.
+MAX_TIME_DELTA_EPOCHS = [
+    # During Pool-CSAP-Somalia projects that took place before April 3rd, the realtime connection was extremely
+    # unreliable (typical message loss rate was 50%), but the delay was typically about 4 minutes, and all
+    # less than 5.
+    (None, isoparse("2022-04-03T00:00+03:00"), timedelta(minutes=5)),
+    # When the realtime connection was improved from April 3rd 2022, message loss rate decreased to 1-2% but
+    # the maximum delay slightly increased. Use 7 minutes for messages received since that date.
+    (isoparse("2022-04-03T00:00+03:00"), isoparse("2022-09-01T00:00+03:00"), timedelta(minutes=7)),
+    # Since at least September 1st 2022 (and possibly earlier, when there were no projects running on the short
+    # code), loss-rate remains at ~2% but the maximum delay has increased significantly in a small number of cases.
+    (isoparse("2022-09-01T00:00+03:00"), None, timedelta(days=30))
+]
+
+
+def plan_recovery_windows(start_date, end_date):
+    """
+    Splits a date range into windows at the boundaries of the `MAX_TIME_DELTA_EPOCHS`, so that each window can be
+    matched with a single max_time_delta.
+
+    :param start_date: Start of the date range (inclusive).
+    :type start_date: datetime.datetime
+    :param end_date: End of the date range (exclusive).
+    :type end_date: datetime.datetime
+    :return: Windows covering the date range, as tuples of (start date (inclusive), end date (exclusive),
+             max_time_delta), in date order.
+    :rtype: list of (datetime.datetime, datetime.datetime, datetime.timedelta)
+    """
+    windows = []
+    for epoch_start, epoch_end, max_time_delta in MAX_TIME_DELTA_EPOCHS:
+        window_start = start_date if epoch_start is None else max(start_date, epoch_start)
+        window_end = end_date if epoch_end is None else min(end_date, epoch_end)
+        if window_start < window_end:
+            windows.append((window_start, window_end, max_time_delta))
+    return windows
+
+
+def recover_messages(rapid_pro_messages, recovered_message_store, recovery_windows, log_dir_path, skipped_csv_path,
+                     output_csv_path, workers=1, checkpoint_dir_path=None, resume=False, log_format="csv",
+                     run_arguments=None):
+    """
+    Matches the given Rapid Pro messages against the given recovered messages, logs the matches made by each
+    strategy, and exports the skipped Rapid Pro messages and the recovered messages that had no match in Rapid Pro.
+
+    Each recovery window is matched separately, using its own max_time_delta, and the results of all the windows are
+    merged into a single set of logs and outputs. Nothing is exported if any of the Rapid Pro messages couldn't be
+    matched, or if the number of unmatched recovered messages in any window isn't the number expected.
+
+    :param rapid_pro_messages: Incoming messages downloaded from Rapid Pro, for the date range covered by
+                               `recovery_windows`.
+    :type rapid_pro_messages: list of temba_client.v2.Message
+    :param recovered_message_store: Store of the messages recovered from the operator, for the date range covered by
+                                    `recovery_windows`.
+    :type recovered_message_store: RecoveredMessageStore
+    :param recovery_windows: Windows to match the messages in, as returned by `plan_recovery_windows`.
+    :type recovery_windows: list of (datetime.datetime, datetime.datetime, datetime.timedelta)
+    :param log_dir_path: Directory to log the matched messages and match metrics to.
+    :type log_dir_path: str
+    :param skipped_csv_path: Path to CSV to write the skipped messages to. The file is written in the format selected
+                             by its extension, as described in `MessageWriter`.
+    :type skipped_csv_path: str
+    :param output_csv_path: Path to CSV to write the unmatched recovered messages to. The file is written in the
+                            format selected by its extension, as described in `MessageWriter`.
+    :type output_csv_path: str
+    :param workers: Number of processes to match messages with.
+    :type workers: int
+    :param checkpoint_dir_path: If not None, directory to save the progress of matching to after each match strategy
+                                completes, so that it can be resumed if this run is interrupted.
+    :type checkpoint_dir_path: str | None
+    :param resume: Whether to resume matching from the checkpoints in `checkpoint_dir_path`, if there are any.
+    :type resume: bool
+    :param log_format: Format to write the logs of matched messages in. One of `MESSAGE_FILE_FORMATS`.
+    :type log_format: str
+    :param run_arguments: If not None, arguments of this run to save in the checkpoints, as returned by
+                          `get_run_arguments`. Checkpoints saved by a run with different arguments are not resumed
+                          from.
+    :type run_arguments: dict of str -> str | None
+    :return: Whether the messages were all matched as expected and the outputs were exported.
+    :rtype: bool
+    :raises ValueError: If resuming from a checkpoint that was saved by a run with different arguments.
+    """
+    if len(recovery_windows) == 0:
+        raise ValueError("No recovery windows to match messages in. Check that the start date is before the end date")
+
+    rapid_pro_messages = sorted(rapid_pro_messages, key=lambda msg: msg.sent_on)
+    recovered_message_ids = recovered_message_store.get_ids_sorted_by_timestamp()
+
+    # Split the messages between the windows. Rapid Pro messages are assigned by the time they were created, and
+    # recovered messages by the time they were received, consistent with how both datasets are downloaded.
+    window_rapid_pro_messages = []  # of list of RapidProMessage, for each window
+    window_recovered_message_ids = []  # of list of int, for each window
+    for window_start, window_end, _ in recovery_windows:
+        window_rapid_pro_messages.append(
+            [msg for msg in rapid_pro_messages if window_start <= msg.created_on < window_end]
+        )
+        window_start_microseconds = datetime_to_epoch_microseconds(window_start)
+        window_end_microseconds = datetime_to_epoch_microseconds(window_end)
+        window_recovered_message_ids.append([
+            message_id for message_id in recovered_message_ids
+            if window_start_microseconds <= recovered_message_store.timestamps[message_id] < window_end_microseconds
+        ])
+
+    window_match_strategies = [create_match_strategies(max_time_delta, log_dir_path, log_format)
+                               for _, _, max_time_delta in recovery_windows]
+
+    # Apply all the match strategies in sequence, in each window. When matching in this process, each strategy logs its
+    # matches as it makes them. Otherwise, the logs are written from the merged results of all the processes.
+    match_logs_written = len(recovery_windows) == 1 and workers == 1
+    window_metrics_by_strategy = [[] for _ in recovery_windows]  # of list of MatchStrategyMetrics, for each window
+    if len(recovery_windows) > 1:
+        window_results = match_messages_in_windows(
+            window_match_strategies, window_rapid_pro_messages, recovered_message_store, window_recovered_message_ids,
+            workers, window_metrics_by_strategy, checkpoint_dir_path, resume, run_arguments
+        )
+    elif workers == 1:
+        window_results = [match_messages(
+            window_match_strategies[0], window_rapid_pro_messages[0], recovered_message_store,
+            window_recovered_message_ids[0], window_metrics_by_strategy[0],
+            None if checkpoint_dir_path is None else f"{checkpoint_dir_path}/matches.json", resume,
+            write_match_logs=True, run_arguments=run_arguments
+        )]
+    else:
+        window_results = [match_messages_in_parallel(
+            window_match_strategies[0], window_rapid_pro_messages[0], recovered_message_store,
+            window_recovered_message_ids[0], workers, window_metrics_by_strategy[0], checkpoint_dir_path, resume,
+            run_arguments
+        )]
+
+    # Merge the results of each window, in date order
+    match_strategies = window_match_strategies[0]
+    metrics_by_strategy = []  # of MatchStrategyMetrics
+    for i, strategy in enumerate(match_strategies):
+        metrics = MatchStrategyMetrics(strategy.name)
+        for window_metrics in window_metrics_by_strategy:
+            metrics.merge(window_metrics[i])
+        metrics_by_strategy.append(metrics)
+    write_match_metrics(metrics_by_strategy, f"{log_dir_path}/match-strategy-metrics.json")
+
+    matched_count = 0
+    all_skipped_rapid_pro_messages = []  # of RapidProMessage
+    for i, strategy in enumerate(match_strategies):
+        matched_messages = []  # of MatchedMessage
+        for matched_messages_by_strategy, skipped_rapid_pro_messages_by_strategy, _, _ in window_results:
+            matched_messages.extend(matched_messages_by_strategy[i])
+            all_skipped_rapid_pro_messages.extend(skipped_rapid_pro_messages_by_strategy[i])
+        if not match_logs_written:
+            write_match_log(strategy, matched_messages)
+        matched_count += sum(1 for match in matched_messages if match.recovered_message is not None)
+
+    # Ensure we matched all the Rapid Pro messages
+    unmatched_rapid_pro_messages = [msg for _, _, window_unmatched, _ in window_results for msg in window_unmatched]
+    if len(unmatched_rapid_pro_messages) > 0:
+        log.error(f"{len(unmatched_rapid_pro_messages)} unmatched Rapid Pro messages remain after attempting all "
+                  f"automated matching techniques. The first remaining message is:")
+        log.error(unmatched_rapid_pro_messages[0].serialize())
+        return False
+
+    # Count the recovered messages that weren't matched
+    unmatched_recovered_messages_count = sum(len(window_unmatched) for _, _, _, window_unmatched in window_results)
+    log.info(f"Found {unmatched_recovered_messages_count} recovered messages that had no match in Rapid Pro "
+             f"({matched_count} did have a match, {len(all_skipped_rapid_pro_messages)} were skipped)")
+
+    # Check the number of unmatched messages in each window separately, so that errors in one window can't be
+    # cancelled out by errors in another.
+    for (window_start, window_end, _), window_rapid_pro, window_recovered_ids, window_result in \
+            zip(recovery_windows, window_rapid_pro_messages, window_recovered_message_ids, window_results):
+        _, skipped_rapid_pro_messages_by_strategy, _, window_unmatched_recovered_ids = window_result
+        expected_unmatched_messages_count = len(window_recovered_ids) - len(window_rapid_pro) + \
+            sum(len(skipped_messages) for skipped_messages in skipped_rapid_pro_messages_by_strategy)
+        if len(recovery_windows) > 1:
+            log.info(f"Expected unmatched messages in window {window_start.isoformat()} to {window_end.isoformat()} "
+                     f"was {expected_unmatched_messages_count} ({len(window_unmatched_recovered_ids)} found)")
+        else:
+            log.info(f"Total expected unmatched messages was {expected_unmatched_messages_count}")
+
+        if expected_unmatched_messages_count != len(window_unmatched_recovered_ids):
+            log.error("Number of unmatched messages != expected number of unmatched messages")
+            return False
+
+    # Export skipped messages to a csv that can be used for further processing of duplicates.
+    # The output is in the format used by tools/archive_matching_messages.py, as this is the most likely next step
+    # for these messages.
+    export_skipped_messages(all_skipped_rapid_pro_messages, skipped_csv_path)
+
+    # Export recovered messages to a csv that can be processed by de_identify_csv.py. The messages are read from the
+    # store as they are written, rather than all being loaded up-front.
+    unmatched_recovered_messages = (recovered_message_store.get(message_id)
+                                    for _, _, _, window_unmatched in window_results for message_id in window_unmatched)
+    export_unmatched_recovered_messages(unmatched_recovered_messages, output_csv_path)
+
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Uses Rapid Pro's message logs to filter a Hormuud recovery csv for incoming messages on this "
@@ -396,6 +2198,22 @@ if __name__ == "__main__":
                     "applying Excel's data-mangling algorithms, then (iii) matching by timestamp. "
                     "Matches made by method (iii) are exported for manual review")
 
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to match messages with. Messages are sharded by sender urn between "
+                             "the processes. Defaults to 1, which matches all the messages in this process")
+    parser.add_argument("--rapid-pro-cache-dir", metavar="rapid-pro-cache-dir",
+                        help="Directory to cache the messages downloaded from Rapid Pro in. When re-running over "
+                             "overlapping date ranges, only the messages that are not already in this cache are "
+                             "downloaded")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from the checkpoints saved in log-dir-path by a previous run with the same "
+                             "arguments that was interrupted. The Rapid Pro messages that run downloaded are re-used, "
+                             "and matching continues from the last match strategy it completed. Fails if the start "
+                             "and end dates, Rapid Pro domain or recovery CSV path are different")
+    parser.add_argument("--log-format", choices=MESSAGE_FILE_FORMATS, default="csv",
+                        help="Format to write the logs of matched messages in. Defaults to csv. The skipped and "
+                             "output files are written in the format given by the extension of their paths, so "
+                             "e.g. an output-csv-path ending in .jsonl.gz is written as gzipped JSON Lines")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
                              "credentials bucket")
@@ -419,6 +2237,10 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    workers = args.workers
+    rapid_pro_cache_dir = args.rapid_pro_cache_dir
+    resume = args.resume
+    log_format = args.log_format
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     rapid_pro_domain = args.rapid_pro_domain
     rapid_pro_token_file_url = args.rapid_pro_token_file_url
@@ -429,118 +2251,51 @@ if __name__ == "__main__":
     skipped_csv_path = args.skipped_csv_path
     output_csv_path = args.output_csv_path
 
-    # Define the maximum time difference we can observe between a message in rapid pro and in the recovery csv for it
-    # to count as a match.
-    if end_date < isoparse("2022-04-03T00:00+03:00"):
-        # During Pool-CSAP-Somalia projects that took place before April 3rd, the realtime connection was extremely
-        # unreliable (typical message loss rate was 50%), but the delay was typically about 4 minutes, and all
-        # less than 5.
-        max_time_delta = timedelta(minutes=5)
-    elif start_date >= isoparse("2022-04-03T00:00+03:00") and end_date < isoparse("2022-09-01T00:00+03:00"):
-        # When the realtime connection was improved from April 3rd 2022, message loss rate decreased to 1-2% but
-        # the maximum delay slightly increased. Use 7 minutes for messages received since that date.
-        max_time_delta = timedelta(minutes=7)
-    elif start_date >= isoparse("2022-09-01T00:00+03:00"):
-        # Since at least September 1st 2022 (and possibly earlier, when there were no projects running on the short
-        # code), loss-rate remains at ~2% but the maximum delay has increased significantly in a small number of cases.
-        max_time_delta = timedelta(days=30)
-    else:
-        assert False, "Unsupported data-range due to data crossing a max_time_delta definition boundary. " \
-                      "Either check the dates, update the date-ranges in the source code, or break the recovery " \
-                      "dataset into a chunks for each supported time range."
-    log.info(f"Using maximum message time delta of {max_time_delta}")
+    if start_date >= end_date:
+        log.error(f"start-date {start_date.isoformat()} must be before end-date {end_date.isoformat()}")
+        exit(1)
+
+    # Split the date range at the boundaries of the max_time_delta epochs, so each part can be matched using its own
+    # maximum time difference.
+    recovery_windows = plan_recovery_windows(start_date, end_date)
+    for window_start, window_end, max_time_delta in recovery_windows:
+        log.info(f"Using maximum message time delta of {max_time_delta} for messages received between "
+                 f"{window_start.isoformat()} and {window_end.isoformat()}")
+
+    # Save checkpoints as the run progresses, so that an interrupted run can be resumed without downloading the
+    # Rapid Pro messages or re-applying the match strategies that had already completed.
+    checkpoint_dir_path = f"{log_dir_path}/checkpoints"
+    os.makedirs(checkpoint_dir_path, exist_ok=True)
+    rapid_pro_messages_checkpoint_path = f"{checkpoint_dir_path}/rapid-pro-messages.jsonl"
+    run_arguments = get_run_arguments(start_date, end_date, rapid_pro_domain, hormuud_csv_input_path)
 
     # Get messages from Rapid Pro and from the recovery csv
-    rapid_pro_messages = get_incoming_hormuud_messages_from_rapid_pro(
-        google_cloud_credentials_file_path, rapid_pro_domain, rapid_pro_token_file_url,
-        created_after_inclusive=start_date,
-        created_before_exclusive=end_date,
-    )
-    all_rapid_pro_messages = rapid_pro_messages
+    if resume and os.path.exists(rapid_pro_messages_checkpoint_path):
+        log.info(f"Resuming with the Rapid Pro messages in {rapid_pro_messages_checkpoint_path}...")
+        try:
+            rapid_pro_messages = read_rapid_pro_messages(rapid_pro_messages_checkpoint_path, run_arguments)
+        except ValueError as e:
+            log.error(str(e))
+            exit(1)
+    else:
+        rapid_pro_messages = get_incoming_hormuud_messages_from_rapid_pro(
+            google_cloud_credentials_file_path, rapid_pro_domain, rapid_pro_token_file_url,
+            created_after_inclusive=start_date,
+            created_before_exclusive=end_date,
+            cache_dir=rapid_pro_cache_dir
+        )
+        write_rapid_pro_messages(rapid_pro_messages, rapid_pro_messages_checkpoint_path, run_arguments)
 
-    recovered_messages = get_incoming_hormuud_messages_from_recovery_csv(
+    recovered_message_store = get_incoming_hormuud_messages_from_recovery_csv(
         hormuud_csv_input_path, received_after_inclusive=start_date, received_before_exclusive=end_date
     )
-    all_recovered_messages = recovered_messages
 
-    rapid_pro_messages.sort(key=lambda msg: msg.sent_on)
-    recovered_messages.sort(key=lambda msg: msg.timestamp)
-
-    # Group the messages by the sender's urn
-    urn_to_recovered_messages = group_recovered_messages_by_urn(recovered_messages)
-
-    match_strategies = [
-        ExactMatch(max_time_delta, csv_log_file_path=f"{log_dir_path}/exact-match-log.csv"),
-        ExcelMangledMatch(max_time_delta, csv_log_file_path=f"{log_dir_path}/excel-mangled-log.csv"),
-        Duplicates(csv_log_file_path=f"{log_dir_path}/duplicates-log.csv"),
-        ClippedMatch(max_time_delta, csv_log_file_path=f"{log_dir_path}/clipped-log.csv"),
-        TimestampMatch(max_time_delta, csv_log_file_path=f"{log_dir_path}/timestamp-log.csv")
-    ]
-
-    # Apply all the match strategies in sequence
-    all_matched_messages = []  # of MatchedMessage
-    all_skipped_rapid_pro_messages = []  # of RapidProMessage
-    for i, strategy in enumerate(match_strategies):
-        log.info(f"Applying match strategy {i + 1}/{len(match_strategies)} '{strategy.name}' to "
-                 f"{len(rapid_pro_messages)} Rapid Pro messages and {len(recovered_messages)} recovered messages")
-        urn_to_recovered_messages = group_recovered_messages_by_urn(recovered_messages)
-        matched_messages, skipped_rapid_pro_messages, unmatched_rapid_pro_messages = apply_match_strategy(
-            strategy, rapid_pro_messages, urn_to_recovered_messages, all_matched_messages
-        )
-        all_matched_messages.extend(matched_messages)
-        all_skipped_rapid_pro_messages.extend(skipped_rapid_pro_messages)
-        rapid_pro_messages = unmatched_rapid_pro_messages
-        recovered_messages = filter_matched_messages_from_recovered(matched_messages, recovered_messages)
-        log.info(f"Applied match strategy '{strategy.name}'. {len(matched_messages)} Rapid Pro messages matched by "
-                 f"this strategy, {len(skipped_rapid_pro_messages)} skipped, and {len(rapid_pro_messages)} "
-                 f"remaining")
-
-    # Ensure we matched all the Rapid Pro messages
-    if len(rapid_pro_messages) > 0:
-        log.error(f"{len(rapid_pro_messages)} unmatched Rapid Pro messages remain after attempting all automated "
-                  f"matching techniques. The first remaining message is:")
-        log.error(rapid_pro_messages[0].serialize())
+    try:
+        succeeded = recover_messages(rapid_pro_messages, recovered_message_store, recovery_windows, log_dir_path,
+                                     skipped_csv_path, output_csv_path, workers, checkpoint_dir_path, resume,
+                                     log_format, run_arguments)
+    except ValueError as e:
+        log.error(str(e))
         exit(1)
-
-    # Get the recovered messages that weren't matched
-    unmatched_recovered_messages = recovered_messages
-    matched_recovered_messages = [match.recovered_message for match in all_matched_messages
-                                  if match.recovered_message is not None]
-    log.info(f"Found {len(unmatched_recovered_messages)} recovered messages that had no match in Rapid Pro "
-             f"({len(matched_recovered_messages)} did have a match, {len(all_skipped_rapid_pro_messages)} were skipped)")
-    expected_unmatched_messages_count = \
-        len(all_recovered_messages) - len(all_rapid_pro_messages) + len(all_skipped_rapid_pro_messages)
-    log.info(f"Total expected unmatched messages was {expected_unmatched_messages_count}")
-
-    if expected_unmatched_messages_count != len(unmatched_recovered_messages):
-        log.error("Number of unmatched messages != expected number of unmatched messages")
+    if not succeeded:
         exit(1)
-
-    # Export skipped messages to a csv that can be used for further processing of duplicates.
-    # The output is in the format used by tools/archive_matching_messages.py, as this is the most likely next step
-    # for these messages.
-    log.info(f"Exporting {len(all_skipped_rapid_pro_messages)} skipped messages to {skipped_csv_path}")
-    with open(skipped_csv_path, "w") as f:
-        writer = csv.DictWriter(f, fieldnames=["urn", "text", "timestamp"])
-        writer.writeheader()
-
-        for msg in all_skipped_rapid_pro_messages:
-            writer.writerow({
-                "urn": msg.urn,
-                "text": msg.text,
-                "timestamp": msg.sent_on.isoformat()
-            })
-
-    # Export recovered messages to a csv that can be processed by de_identify_csv.py
-    log.info(f"Exporting {len(unmatched_recovered_messages)} unmatched recovered messages to {output_csv_path}...")
-    with open(output_csv_path, "w") as f:
-        writer = csv.DictWriter(f, fieldnames=["Sender", "Receiver", "Message", "ReceivedOn"])
-        writer.writeheader()
-
-        for recovered_msg in unmatched_recovered_messages:
-            writer.writerow({
-                "Sender": recovered_msg.sender,
-                "Receiver": recovered_msg.receiver,
-                "Message": recovered_msg.text,
-                "ReceivedOn": recovered_msg.raw_timestamp
-            })
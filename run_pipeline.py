@@ -0,0 +1,569 @@
+import argparse
+import json
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from pipeline_stage_runner import STAGE_USAGE_LINE_PREFIX, get_stage_event_key
+from pipeline_stage_server import SOCKET_PATH
+
+# This orchestrator only uses the standard library, so that it can be run with the host's python3, without installing
+# the pipeline's dependencies. The stages themselves run in docker.
+log = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    def __init__(self, name, command, dependencies=None, logs_stage_events=False):
+        """
+        A stage of the pipeline, which can be run once all the stages it depends on have succeeded.
+
+        :param name: Name of this stage, used to identify it in logs and in the dependencies of other stages.
+        :type name: str
+        :param command: Command to run this stage, as a list of the program to run and its arguments.
+        :type command: list of str
+        :param dependencies: Names of the stages that must succeed before this stage can be run.
+        :type dependencies: list of str | None
+        :param logs_stage_events: Whether the command logs the stage's start and end to the operations dashboard
+                                  itself, with pipeline_stage_runner.py's --log-stage-events.
+        :type logs_stage_events: bool
+        """
+        if dependencies is None:
+            dependencies = []
+
+        self.name = name
+        self.command = command
+        self.dependencies = dependencies
+        self.logs_stage_events = logs_stage_events
+
+
+def run_stage(stage, metrics=None):
+    """
+    Runs a pipeline stage, prefixing each line it outputs with the stage's name so that the output of stages that run
+    at the same time can be told apart.
+
+    :param stage: Stage to run.
+    :type stage: PipelineStage
+    :param metrics: If not None, this is updated with the metrics the stage reported on a line starting with
+                    STAGE_USAGE_LINE_PREFIX, if it's run with pipeline_stage_runner.py, then with the stage's
+                    "wall_time_seconds", including the time to create and tear down its container.
+    :type metrics: dict | None
+    :return: Whether the stage succeeded. A stage that can't be run, e.g. because its program doesn't exist, fails.
+    :rtype: bool
+    """
+    log.info(f"Starting stage '{stage.name}'...")
+    start_time = time.monotonic()
+    process = None
+    try:
+        # Decode the output leniently, so that a stage which outputs invalid UTF-8 can't crash the orchestrator.
+        process = subprocess.Popen(stage.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   errors="replace", bufsize=1)
+        for line in process.stdout:
+            if line.startswith(STAGE_USAGE_LINE_PREFIX):
+                try:
+                    usage = json.loads(line[len(STAGE_USAGE_LINE_PREFIX):])
+                except ValueError:
+                    log.warning(f"Ignoring malformed resource usage output from stage '{stage.name}': {line.strip()}")
+                    continue
+                if metrics is not None:
+                    metrics.update(usage)
+                continue
+            print(f"[{stage.name}] {line}", end="", flush=True)
+        exit_code = process.wait()
+    except Exception as e:
+        log.error(f"Stage '{stage.name}' failed to run: {type(e).__name__}: {e}")
+        if process is not None:
+            process.kill()
+            process.wait()
+        return False
+    finally:
+        if metrics is not None:
+            metrics["wall_time_seconds"] = time.monotonic() - start_time
+
+    if exit_code != 0:
+        log.error(f"Stage '{stage.name}' failed with exit code {exit_code}")
+        return False
+    log.info(f"Stage '{stage.name}' succeeded")
+    return True
+
+
+class StageEventLogger:
+    def __init__(self, run_id, metrics_path, log_event=None):
+        """
+        Records the start and end of each stage of a pipeline run, and the resources each stage used.
+
+        A "StageStart" and a "StageEnd" event are appended to a JSONL file for each stage, so that trends can be
+        compared across runs. Each event has the "run_id", "event", "stage" and "timestamp". The StageEnd event also
+        has the stage's metrics: "succeeded", "wall_time_seconds", and, for stages run with pipeline_stage_runner.py,
+        "cpu_time_seconds", "peak_rss_kb", "document_reads", "document_writes" and "api_requests".
+
+        :param run_id: Id of the pipeline run.
+        :type run_id: str
+        :param metrics_path: Path to the JSONL file to append the events of each stage to.
+        :type metrics_path: str
+        :param log_event: If not None, function to also log the events of the stages that don't log their own events
+                          to the operations dashboard with, given the event key from
+                          `pipeline_stage_runner.get_stage_event_key`.
+        :type log_event: (func of str -> bool) | None
+        """
+        self.run_id = run_id
+        self.metrics_path = metrics_path
+        self.log_event = log_event
+        self._lock = threading.Lock()
+
+    def _record_event(self, event, stage, metrics=None):
+        record = {"run_id": self.run_id, "event": event, "stage": stage.name,
+                  "timestamp": datetime.now(timezone.utc).isoformat()}
+        if metrics is not None:
+            record.update(metrics)
+
+        with self._lock:
+            with open(self.metrics_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        if self.log_event is not None and not stage.logs_stage_events:
+            self.log_event(get_stage_event_key(event, stage.name, metrics))
+
+    def run_stage(self, stage):
+        """
+        Runs a pipeline stage, recording its start, end and metrics.
+
+        :type stage: PipelineStage
+        :return: Whether the stage succeeded.
+        :rtype: bool
+        """
+        self._record_event("StageStart", stage)
+
+        metrics = dict()
+        succeeded = run_stage(stage, metrics)
+        metrics["succeeded"] = succeeded
+        log.info(f"Stage '{stage.name}' took {metrics['wall_time_seconds']:.1f}s"
+                 + ("" if "cpu_time_seconds" not in metrics else
+                    f", using {metrics['cpu_time_seconds']:.1f}s of CPU time and a peak RSS of "
+                    f"{metrics['peak_rss_kb'] / 1024:.0f}MB, reading {metrics['document_reads']} and writing "
+                    f"{metrics['document_writes']} documents with {metrics['api_requests']} API requests"))
+
+        self._record_event("StageEnd", stage, metrics)
+
+        return succeeded
+
+
+def run_stages(stages, max_parallel_stages, stage_event_logger=None):
+    """
+    Runs pipeline stages in dependency order, running stages that don't depend on each other at the same time.
+
+    If a stage fails, the stages that depend on it (directly or indirectly) are not run. All the other stages are
+    still run.
+
+    :param stages: Stages to run. Every dependency of each stage must be one of these stages.
+    :type stages: list of PipelineStage
+    :param max_parallel_stages: Maximum number of stages to run at the same time.
+    :type max_parallel_stages: int
+    :param stage_event_logger: If not None, logger to run each stage with, to record its events and metrics.
+    :type stage_event_logger: StageEventLogger | None
+    :return: Dictionary of stage name -> "succeeded", "failed", or "skipped" if it wasn't run because a stage it
+             depends on didn't succeed.
+    :rtype: dict of str -> str
+    """
+    stage_names = {stage.name for stage in stages}
+    for stage in stages:
+        for dependency in stage.dependencies:
+            assert dependency in stage_names, f"Stage '{stage.name}' depends on unknown stage '{dependency}'"
+
+    run = run_stage if stage_event_logger is None else stage_event_logger.run_stage
+
+    results = dict()  # of stage name -> str
+    pending_stages = list(stages)
+    running_stages = dict()  # of Future -> PipelineStage
+    with ThreadPoolExecutor(max_workers=max_parallel_stages) as executor:
+        while len(pending_stages) > 0 or len(running_stages) > 0:
+            # Start every pending stage whose dependencies have all succeeded, and skip every pending stage that has a
+            # dependency which didn't. Skipping a stage can make its dependents skippable, so repeat until no more
+            # stages change.
+            changed = True
+            while changed:
+                changed = False
+                for stage in list(pending_stages):
+                    dependency_results = [results.get(dependency) for dependency in stage.dependencies]
+                    if any(result in {"failed", "skipped"} for result in dependency_results):
+                        log.warning(f"Skipping stage '{stage.name}', because a stage it depends on didn't succeed")
+                        results[stage.name] = "skipped"
+                    elif all(result == "succeeded" for result in dependency_results):
+                        running_stages[executor.submit(run, stage)] = stage
+                    else:
+                        continue
+                    pending_stages.remove(stage)
+                    changed = True
+
+            if len(running_stages) == 0:
+                assert len(pending_stages) == 0, \
+                    f"Stages {[stage.name for stage in pending_stages]} have circular dependencies"
+                break
+
+            completed, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+            for future in completed:
+                stage = running_stages.pop(future)
+                results[stage.name] = "succeeded" if future.result() else "failed"
+
+    return results
+
+
+class ReusedContainer:
+    def __init__(self, image_name, cache_volume_names, archive_dir):
+        """
+        A single, long-lived container of the pipeline's docker image, that all the pipeline's stages are run in.
+
+        The credentials, code schemes and configuration are copied into the container once when it is started,
+        rather than into a new container for every stage. The container's main process is a pipeline_stage_server.py
+        server, which starts Python and imports the pipeline's dependencies and configuration once. Each stage is then
+        run in a fork of the server, with `docker exec` and pipeline_stage_server.py's `run` mode, so that the stages
+        don't each pay the cost of starting Python and importing the dependencies again.
+
+        :param image_name: Name of the docker image to run.
+        :type image_name: str
+        :param cache_volume_names: Dictionary of cache name -> name of the docker volume to mount at
+                                   /cache/<cache name>, for the incremental cache of each stage.
+        :type cache_volume_names: dict of str -> str
+        :param archive_dir: Directory on the host to bind mount at /archives, for uploading the archive files.
+        :type archive_dir: str
+        """
+        self.image_name = image_name
+        self.cache_volume_names = cache_volume_names
+        self.archive_dir = archive_dir
+        self.container = None
+
+    def start(self, google_cloud_credentials_file_path, configuration_file_path, code_schemes_dir,
+              server_timeout_seconds=600):
+        """
+        Creates and starts the container, copies the pipeline's inputs into it, and waits for its stage server to be
+        ready to run stages.
+
+        :type google_cloud_credentials_file_path: str
+        :type configuration_file_path: str
+        :type code_schemes_dir: str
+        :param server_timeout_seconds: Time to wait for the stage server to preload the configuration and start
+                                       listening, before giving up.
+        :type server_timeout_seconds: float
+        """
+        mount_args = []
+        for cache_name, volume_name in self.cache_volume_names.items():
+            mount_args.extend(["--mount", f"source={volume_name},target=/cache/{cache_name}"])
+        mount_args.extend(["--mount", f"type=bind,source={os.path.abspath(self.archive_dir)},target=/archives"])
+
+        self.container = subprocess.run(
+            ["docker", "container", "create", "-w", "/app", *mount_args, self.image_name,
+             "pdm", "run", "python", "-u", "pipeline_stage_server.py", "serve", "configuration"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        log.info(f"Created container {self.container}")
+
+        for source, target in [(google_cloud_credentials_file_path, "/credentials/google-cloud-credentials.json"),
+                               (code_schemes_dir, "/app/code_schemes"),
+                               (configuration_file_path, "/app/configuration.py"),
+                               ("pipeline_stage_server.py", "/app/pipeline_stage_server.py"),
+                               ("pipeline_stage_runner.py", "/app/pipeline_stage_runner.py")]:
+            log.info(f"Copying {source} -> {self.container[:7]}:{target}")
+            subprocess.run(["docker", "cp", source, f"{self.container}:{target}"], check=True)
+
+        subprocess.run(["docker", "start", self.container], stdout=subprocess.DEVNULL, check=True)
+        log.info(f"Started container {self.container[:7]}, waiting for its stage server...")
+
+        deadline = time.monotonic() + server_timeout_seconds
+        while subprocess.run(["docker", "exec", self.container, "test", "-S", SOCKET_PATH]).returncode != 0:
+            running = subprocess.run(
+                ["docker", "container", "inspect", "-f", "{{.State.Running}}", self.container],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+            if running != "true":
+                raise RuntimeError(f"The stage server in container {self.container} exited before it was ready. "
+                                   f"See `docker logs {self.container}`")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"The stage server in container {self.container} wasn't ready after "
+                                   f"{server_timeout_seconds}s")
+            time.sleep(1)
+        log.info(f"Stage server in container {self.container[:7]} is ready")
+
+    def get_run_command(self, program, args):
+        """
+        :param program: Python program in the image to run, with the container's stage server.
+        :type program: str
+        :param args: Arguments to run the program with.
+        :type args: list of str
+        :return: Command that runs the program in this container.
+        :rtype: list of str
+        """
+        # The client only needs the standard library, so is run with the image's python rather than started with pdm.
+        return ["docker", "exec", self.container, "python", "-u", "pipeline_stage_server.py", "run", program, *args]
+
+    def stop(self, remove):
+        """
+        :param remove: Whether to remove the container once it has stopped. A container that isn't removed can be
+                       inspected to debug a failed run.
+        :type remove: bool
+        """
+        if self.container is None:
+            return
+        subprocess.run(["docker", "stop", self.container], stdout=subprocess.DEVNULL, check=True)
+        if remove:
+            subprocess.run(["docker", "container", "rm", self.container], stdout=subprocess.DEVNULL, check=True)
+        else:
+            log.warning(f"Stopped container {self.container}, and left it for debugging")
+
+
+def get_cache_volume_names(pipeline_name):
+    """
+    :param pipeline_name: Name of the pipeline.
+    :type pipeline_name: str
+    :return: Dictionary of incremental cache name -> docker volume name.
+    :rtype: dict of str -> str
+    """
+    cache_names = [
+        "rapid-pro-to-engagement-db-cache", "csv-to-engagement-db-cache", "google-forms-to-engagement-db-cache",
+        "kobotoolbox-to-engagement-db-cache", "engagement-db-to-coda-cache", "coda-to-engagement-db-cache",
+        "engagement-db-to-rapid-pro-cache", "engagement-db-to-analysis-cache"
+    ]
+    return {cache_name: f"{pipeline_name}-{cache_name}" for cache_name in cache_names}
+
+
+def get_pipeline_stages(user, pipeline_name, google_cloud_credentials_file_path, configuration_file_path,
+                        code_schemes_dir, data_dir, archive_dir, archive_file_path, reused_container=None,
+                        stage_events_run_id=None):
+    """
+    Gets the stages of an end-to-end pipeline run, and the dependencies between them.
+
+    The sources are synced to the engagement database independently of each other. Once they have all been synced, the
+    engagement database is synced with Coda, then exported to Rapid Pro, then to analysis. Finally, the data directory
+    is archived and the archive uploaded.
+
+    Each stage backs its incremental cache up to its own directory, <data_dir>/Cache/<cache name>, so stages that run
+    at the same time can't overwrite each other's caches. The export to analysis is run after the export to Rapid Pro
+    rather than at the same time, as in run_pipeline.sh's original sequence, because they haven't been shown to be
+    independent.
+
+    Each stage that runs in docker runs its program with pipeline_stage_runner.py, which reports the resources the
+    program used, and logs the stage's start and end to the operations dashboard if `stage_events_run_id` is given.
+
+    :param reused_container: If not None, the started container to run each stage in. Otherwise, each stage is run in
+                             a new container by its docker-*.sh script.
+    :type reused_container: ReusedContainer | None
+    :param stage_events_run_id: If not None, id of the pipeline run to log the start and end of each stage that runs in
+                                docker to the operations dashboard under.
+    :type stage_events_run_id: str | None
+    :rtype: list of PipelineStage
+    """
+    cache_volume_names = get_cache_volume_names(pipeline_name)
+
+    def stage_event_args(name):
+        if stage_events_run_id is None:
+            return []
+        return ["--log-stage-events", stage_events_run_id, name]
+
+    def docker_stage(name, script, program, cache_name, dependencies, program_args=None, uses_data_dir=True,
+                     copies_out_data=False):
+        if reused_container is None:
+            command = [f"./{script}", *stage_event_args(name), "--incremental-cache-volume",
+                       cache_volume_names[cache_name], user, google_cloud_credentials_file_path,
+                       configuration_file_path, code_schemes_dir]
+            if uses_data_dir:
+                command.append(data_dir)
+            return PipelineStage(name, command, dependencies, logs_stage_events=stage_events_run_id is not None)
+
+        # Run the program in the reused container, then copy its outputs out in the same way as its docker-*.sh script.
+        commands = [reused_container.get_run_command(
+            "pipeline_stage_runner.py",
+            [*stage_event_args(name), program, "--incremental-cache-path", f"/cache/{cache_name}", user,
+             "/credentials/google-cloud-credentials.json", "configuration", *(program_args or [])]
+        )]
+        if copies_out_data:
+            commands.append(["docker", "cp", f"{reused_container.container}:/data/.", data_dir])
+        if uses_data_dir:
+            commands.append(["mkdir", "-p", f"{data_dir}/Cache/{cache_name}"])
+            commands.append(["docker", "cp", f"{reused_container.container}:/cache/{cache_name}/.",
+                             f"{data_dir}/Cache/{cache_name}"])
+        return PipelineStage(name, ["bash", "-c", " && ".join(shlex.join(command) for command in commands)],
+                             dependencies, logs_stage_events=stage_events_run_id is not None)
+
+    source_syncs = [
+        docker_stage("sync-rapid-pro-to-engagement-db", "docker-sync-rapid-pro-to-engagement-db.sh",
+                     "sync_rapid_pro_to_engagement_db.py", "rapid-pro-to-engagement-db-cache", []),
+        docker_stage("sync-csvs-to-engagement-db", "docker-sync-csvs-to-engagement-db.sh",
+                     "sync_csvs_to_engagement_db.py", "csv-to-engagement-db-cache", []),
+        docker_stage("sync-google-forms-to-engagement-db", "docker-sync-google-forms-to-engagement-db.sh",
+                     "sync_google_forms_to_engagement_db.py", "google-forms-to-engagement-db-cache", []),
+        docker_stage("sync-kobotoolbox-to-engagement-db", "docker-run-kobotoolbox-to-engagement-db.sh",
+                     "sync_kobotoolbox_to_engagement_db.py", "kobotoolbox-to-engagement-db-cache", [])
+    ]
+
+    if reused_container is None:
+        upload_command = ["./docker-run-upload-archive-files.sh", *stage_event_args("upload-archive-files"), user,
+                          google_cloud_credentials_file_path, configuration_file_path, code_schemes_dir, archive_dir]
+    else:
+        upload_command = reused_container.get_run_command(
+            "pipeline_stage_runner.py",
+            [*stage_event_args("upload-archive-files"), "upload_archive_files.py", user,
+             "/credentials/google-cloud-credentials.json", "configuration", "/archives"]
+        )
+
+    return source_syncs + [
+        docker_stage("sync-engagement-db-to-coda", "docker-sync-engagement-db-to-coda.sh",
+                     "sync_engagement_db_to_coda.py", "engagement-db-to-coda-cache",
+                     [stage.name for stage in source_syncs]),
+        docker_stage("sync-coda-to-engagement-db", "docker-sync-coda-to-engagement-db.sh",
+                     "sync_coda_to_engagement_db.py", "coda-to-engagement-db-cache", ["sync-engagement-db-to-coda"]),
+        docker_stage("sync-engagement-db-to-rapid-pro", "docker-sync-engagement-db-to-rapid-pro.sh",
+                     "sync_engagement_db_to_rapid_pro.py", "engagement-db-to-rapid-pro-cache",
+                     ["sync-coda-to-engagement-db"], uses_data_dir=False),
+        docker_stage("run-engagement-db-to-analysis", "docker-run-engagement-db-to-analysis.sh",
+                     "engagement_db_to_analysis.py", "engagement-db-to-analysis-cache",
+                     ["sync-engagement-db-to-rapid-pro"],
+                     program_args=["/data/membership-groups", "/data/analysis-outputs"], copies_out_data=True),
+        PipelineStage("archive-data-dir", ["./archive_data_dir.sh", data_dir, archive_file_path],
+                      ["run-engagement-db-to-analysis"]),
+        PipelineStage("upload-archive-files", upload_command, ["archive-data-dir"],
+                      logs_stage_events=stage_events_run_id is not None)
+    ]
+
+
+def log_pipeline_event(configuration_file_path, code_schemes_dir, google_cloud_credentials_file_path, run_id,
+                       event_key, reused_container=None):
+    """
+    Logs a pipeline event to the operations dashboard, using docker-run-log-pipeline-event.sh, or in the reused
+    container if there is one.
+
+    :return: Whether the event was logged.
+    :rtype: bool
+    """
+    if reused_container is None:
+        command = ["./docker-run-log-pipeline-event.sh", configuration_file_path, code_schemes_dir,
+                   google_cloud_credentials_file_path, run_id, event_key]
+    else:
+        command = reused_container.get_run_command(
+            "log_pipeline_event.py", ["configuration", "/credentials/google-cloud-credentials.json", run_id, event_key]
+        )
+    return run_stage(PipelineStage(f"log-{event_key}", command))
+
+
+def run_pipeline(user, pipeline_name, google_cloud_credentials_file_path, configuration_file_path, code_schemes_dir,
+                 data_dir, archive_dir, run_id, max_parallel_stages, reused_container=None, log_stage_events=False):
+    """
+    Runs all the stages of the pipeline, between PipelineRunStart and PipelineRunEnd events.
+
+    The start and end of each stage, with the stage's metrics, are appended to <data_dir>/pipeline-stage-metrics.jsonl,
+    as described in `StageEventLogger`.
+
+    :param log_stage_events: Whether to also log the start and end of each stage to the operations dashboard, with the
+                             stage's metrics in the StageEnd event's key. Stages that run in docker log their own
+                             events, in their container, and the other stages' events are logged with
+                             `log_pipeline_event`.
+    :type log_stage_events: bool
+    :return: Whether all the stages succeeded.
+    :rtype: bool
+    """
+    def log_event(event_key):
+        return log_pipeline_event(configuration_file_path, code_schemes_dir, google_cloud_credentials_file_path,
+                                  run_id, event_key, reused_container)
+
+    if not log_event("PipelineRunStart"):
+        return False
+
+    stages = get_pipeline_stages(user, pipeline_name, google_cloud_credentials_file_path, configuration_file_path,
+                                 code_schemes_dir, data_dir, archive_dir, f"{archive_dir}/data-{run_id}.tar.gzip",
+                                 reused_container, run_id if log_stage_events else None)
+    os.makedirs(data_dir, exist_ok=True)
+    stage_event_logger = StageEventLogger(run_id, f"{data_dir}/pipeline-stage-metrics.jsonl",
+                                          log_event if log_stage_events else None)
+    results = run_stages(stages, max_parallel_stages, stage_event_logger)
+
+    unsuccessful_stages = [stage.name for stage in stages if results[stage.name] != "succeeded"]
+    if len(unsuccessful_stages) > 0:
+        log.error(f"Pipeline run {run_id} failed. Stages that didn't succeed: "
+                  f"{ {name: results[name] for name in unsuccessful_stages} }")
+        return False
+
+    return log_event("PipelineRunEnd")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the pipeline end-to-end (sync sources to engagement-db, sync engagement-db to and from "
+                    "Coda, sync engagement-db to Rapid Pro, run engagement-db to analysis, archive). Stages that "
+                    "don't depend on each other can be run at the same time with --max-parallel-stages")
+
+    parser.add_argument("--max-parallel-stages", type=int, default=4,
+                        help="Maximum number of stages to run at the same time. Defaults to 4, which runs all the "
+                             "source syncs at once. Use 1 to run one stage at a time, in the order they are listed "
+                             "in get_pipeline_stages")
+    parser.add_argument("--reuse-container", action="store_true",
+                        help="Run all the stages in a single long-lived container, which the credentials, code "
+                             "schemes and configuration are copied into once, rather than in a new container per "
+                             "stage. The container runs a pipeline_stage_server.py server, which imports the "
+                             "pipeline's dependencies and configuration once and runs each stage in a fork of itself")
+    parser.add_argument("--log-stage-events", action="store_true",
+                        help="Log the start and end of each stage to the operations dashboard, as well as the start "
+                             "and end of the run. Stages that run in docker log their own events from their "
+                             "container. The StageEnd event's key includes the stage's metrics, e.g. "
+                             "StageEnd:<stage>:succeeded=true,wall_time_seconds=12.3,...,api_requests=45. The "
+                             "metrics are always recorded in <data-dir>/pipeline-stage-metrics.jsonl")
+    parser.add_argument("user", help="Identifier of the user launching this program")
+    parser.add_argument("pipeline_name", metavar="pipeline-name",
+                        help="Name of the pipeline, used to name the incremental cache volumes")
+    parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
+                        help="Path to a Google Cloud service account credentials file to use to access the "
+                             "credentials bucket")
+    parser.add_argument("configuration_file_path", metavar="configuration-file",
+                        help="Path to the pipeline configuration file")
+    parser.add_argument("code_schemes_dir", metavar="code-schemes-dir",
+                        help="Directory containing the code schemes used by the configuration")
+    parser.add_argument("data_dir", metavar="data-dir",
+                        help="Directory to write the pipeline's outputs and caches to")
+    parser.add_argument("archive_dir", metavar="archive-dir",
+                        help="Directory to write the archive of data-dir to, before it is uploaded")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    max_parallel_stages = args.max_parallel_stages
+    reuse_container = args.reuse_container
+    log_stage_events = args.log_stage_events
+    user = args.user
+    pipeline_name = args.pipeline_name
+    google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
+    configuration_file_path = args.configuration_file_path
+    code_schemes_dir = args.code_schemes_dir
+    data_dir = args.data_dir
+    archive_dir = args.archive_dir
+
+    date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    commit_hash = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True) \
+        .stdout.strip()
+    run_id = f"{date}-{commit_hash}"
+    log.info(f"Starting a new pipeline run with id {run_id}")
+
+    if not reuse_container:
+        succeeded = run_pipeline(user, pipeline_name, google_cloud_credentials_file_path, configuration_file_path,
+                                 code_schemes_dir, data_dir, archive_dir, run_id, max_parallel_stages,
+                                 log_stage_events=log_stage_events)
+    else:
+        with open("configurations/docker_image_name.txt") as f:
+            image_name = f.read().strip()
+        os.makedirs(archive_dir, exist_ok=True)
+        reused_container = ReusedContainer(image_name, get_cache_volume_names(pipeline_name), archive_dir)
+        succeeded = False
+        try:
+            reused_container.start(google_cloud_credentials_file_path, configuration_file_path, code_schemes_dir)
+            succeeded = run_pipeline(user, pipeline_name, google_cloud_credentials_file_path, configuration_file_path,
+                                     code_schemes_dir, data_dir, archive_dir, run_id, max_parallel_stages,
+                                     reused_container, log_stage_events)
+        except RuntimeError as e:
+            log.error(e)
+        finally:
+            reused_container.stop(remove=succeeded)
+
+    if not succeeded:
+        exit(1)
+    log.info(f"Pipeline run {run_id} succeeded")
@@ -0,0 +1,91 @@
+import io
+import unittest
+
+from core_data_modules.traced_data import Metadata, TracedData
+from core_data_modules.traced_data.io import TracedDataJsonIO
+
+from export_weekly_ad_contacts import iter_traced_data_projections
+
+KEYS = ["participant_uuid", "consent_withdrawn"]
+
+
+def make_metadata(source):
+    return Metadata("test_user", source, "2022-09-01T00:00:00+03:00")
+
+
+def make_fixtures():
+    """
+    :return: TracedData objects whose latest values of `KEYS` are set by updates and by appended TracedData in
+             different ways.
+    :rtype: list of TracedData
+    """
+    fixtures = []
+
+    # Keys set once.
+    td = TracedData({"participant_uuid": "avf-participant-uuid-1", "consent_withdrawn": "false"},
+                    make_metadata("initial"))
+    fixtures.append(td)
+
+    # A key that is overwritten by later updates.
+    td = TracedData({"participant_uuid": "avf-participant-uuid-2", "consent_withdrawn": "false"},
+                    make_metadata("initial"))
+    td.append_data({"consent_withdrawn": "true"}, make_metadata("opt_out"))
+    td.append_data({"age": "23"}, make_metadata("demog"))
+    fixtures.append(td)
+
+    # A key that is only set in an appended TracedData, which was itself overwritten in the appended TracedData's
+    # history.
+    appended = TracedData({"consent_withdrawn": "false"}, make_metadata("appended_initial"))
+    appended.append_data({"consent_withdrawn": "true"}, make_metadata("appended_opt_out"))
+    td = TracedData({"participant_uuid": "avf-participant-uuid-3"}, make_metadata("initial"))
+    td.append_traced_data("appended", appended, make_metadata("append"))
+    td.append_data({"age": "23"}, make_metadata("demog"))
+    fixtures.append(td)
+
+    # A key that is set in an appended TracedData, then overwritten by an update after it was appended.
+    appended = TracedData({"consent_withdrawn": "false"}, make_metadata("appended_initial"))
+    td = TracedData({"participant_uuid": "avf-participant-uuid-4"}, make_metadata("initial"))
+    td.append_traced_data("appended", appended, make_metadata("append"))
+    td.append_data({"consent_withdrawn": "true"}, make_metadata("opt_out"))
+    fixtures.append(td)
+
+    # A key that is set before a TracedData is appended, then overwritten by the appended TracedData.
+    appended = TracedData({"consent_withdrawn": "true"}, make_metadata("appended_opt_out"))
+    td = TracedData({"participant_uuid": "avf-participant-uuid-5", "consent_withdrawn": "false"},
+                    make_metadata("initial"))
+    td.append_traced_data("appended", appended, make_metadata("append"))
+    fixtures.append(td)
+
+    # TracedData appended to TracedData that was then appended, with keys overwritten before each append.
+    inner = TracedData({"consent_withdrawn": "false"}, make_metadata("inner_initial"))
+    inner.append_data({"consent_withdrawn": "true"}, make_metadata("inner_opt_out"))
+    outer = TracedData({"participant_uuid": "avf-participant-uuid-0"}, make_metadata("outer_initial"))
+    outer.append_data({"participant_uuid": "avf-participant-uuid-6"}, make_metadata("outer_update"))
+    outer.append_traced_data("inner", inner, make_metadata("append_inner"))
+    td = TracedData({"age": "23"}, make_metadata("initial"))
+    td.append_traced_data("outer", outer, make_metadata("append_outer"))
+    fixtures.append(td)
+
+    return fixtures
+
+
+class TestIterTracedDataProjections(unittest.TestCase):
+    def test_projections_match_deserialized_traced_data(self):
+        f = io.StringIO()
+        TracedDataJsonIO.export_traced_data_iterable_to_jsonl(make_fixtures(), f)
+
+        f.seek(0)
+        expected = [{key: td[key] for key in KEYS} for td in TracedDataJsonIO.import_jsonl_to_traced_data_iterable(f)]
+
+        f.seek(0)
+        projections = list(iter_traced_data_projections(f, KEYS))
+
+        self.assertEqual(projections, expected)
+        self.assertEqual(
+            [projection["consent_withdrawn"] for projection in projections],
+            ["false", "true", "true", "true", "true", "true"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import preprocess_recovered_hormuud_messages
+from benchmark_preprocess_recovered_hormuud_messages import generate_dataset
+from preprocess_recovered_hormuud_messages import (MAX_TIME_DELTA_EPOCHS, plan_recovery_windows, recover_messages,
+                                                   get_incoming_hormuud_messages_from_recovery_csv)
+
+MESSAGE_COUNT = 3000
+URN_COUNT = 150
+
+# Start of the last of the MAX_TIME_DELTA_EPOCHS. The test datasets are generated either side of it, so that matching
+# them together is split into two recovery windows.
+EPOCH_BOUNDARY = MAX_TIME_DELTA_EPOCHS[-1][0]
+
+# Files written by `recover_messages` that must be the same however the messages were matched. The match metrics aren't
+# compared, because they include timings.
+OUTPUT_FILE_NAMES = ["logs/exact-match-log.csv", "logs/excel-mangled-log.csv", "logs/duplicates-log.csv",
+                     "logs/clipped-log.csv", "logs/timestamp-log.csv", "skipped.csv", "output.csv"]
+
+
+def interrupt_match_strategy(strategy_name):
+    """
+    :return: Patch that makes matching raise a RuntimeError when it reaches the given strategy, after the strategies
+             before it have completed and been checkpointed.
+    """
+    apply_match_strategy = preprocess_recovered_hormuud_messages.apply_match_strategy
+
+    def apply_match_strategy_until_interrupted(match_strategy, *args, **kwargs):
+        if match_strategy.name == strategy_name:
+            raise RuntimeError(f"Interrupted at '{strategy_name}'")
+        return apply_match_strategy(match_strategy, *args, **kwargs)
+
+    return mock.patch.object(preprocess_recovered_hormuud_messages, "apply_match_strategy",
+                             apply_match_strategy_until_interrupted)
+
+
+class TestRecoverMessages(unittest.TestCase):
+    """
+    Checks that matching in parallel, in several recovery windows, or resumed from checkpoints makes exactly the same
+    matches and exports exactly the same files as matching serially in a single window with `match_messages`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+
+        # Generate a dataset on each side of the epoch boundary, with the delays between Rapid Pro and the recovery CSV
+        # that were possible before it, and combine them into one recovery CSV.
+        max_time_delta = MAX_TIME_DELTA_EPOCHS[-2][2]
+        cls.rapid_pro_messages = []
+        cls.recovery_csv_path = os.path.join(cls.temp_dir, "recovery.csv")
+        windows = []
+        with open(cls.recovery_csv_path, "w") as combined_csv:
+            for i, start_date in enumerate([EPOCH_BOUNDARY - timedelta(days=31), EPOCH_BOUNDARY]):
+                csv_path = os.path.join(cls.temp_dir, f"recovery-{i}.csv")
+                rapid_pro_messages, window = generate_dataset(
+                    MESSAGE_COUNT, URN_COUNT, max_time_delta, loss_rate=0.05, mangle_rate=0.02, clip_rate=0.02,
+                    resend_rate=0.02, duplicate_rate=0.05, other_shortcode_rate=0.2, csv_path=csv_path, seed=i,
+                    start_date=start_date
+                )
+                for msg in rapid_pro_messages:
+                    msg.id += len(cls.rapid_pro_messages)
+                cls.rapid_pro_messages.extend(rapid_pro_messages)
+                windows.append(window)
+
+                with open(csv_path) as f:
+                    lines = f.readlines()
+                combined_csv.writelines(lines if i == 0 else lines[1:])
+
+        cls.recovery_windows = plan_recovery_windows(windows[0][0], windows[1][1])
+        assert len(cls.recovery_windows) == 2, cls.recovery_windows
+        assert cls.recovery_windows[0][1] == EPOCH_BOUNDARY, cls.recovery_windows
+
+        # Match each window on its own, serially, to get the outputs expected from matching both windows together.
+        cls.expected_window_outputs = [
+            cls.read_outputs(cls.recover_messages([window])) for window in cls.recovery_windows
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    @classmethod
+    def recover_messages(cls, recovery_windows, workers=1, checkpoint_dir_path=None, resume=False):
+        """
+        Runs `recover_messages` on the messages in the given windows, as preprocess_recovered_hormuud_messages.py does.
+
+        :return: Directory the logs and outputs were written to.
+        :rtype: str
+        """
+        output_dir = tempfile.mkdtemp(dir=cls.temp_dir)
+        os.makedirs(os.path.join(output_dir, "logs"))
+
+        start_date, end_date = recovery_windows[0][0], recovery_windows[-1][1]
+        rapid_pro_messages = [msg for msg in cls.rapid_pro_messages if start_date <= msg.created_on < end_date]
+        recovered_message_store = get_incoming_hormuud_messages_from_recovery_csv(
+            cls.recovery_csv_path, received_after_inclusive=start_date, received_before_exclusive=end_date
+        )
+
+        succeeded = recover_messages(
+            rapid_pro_messages, recovered_message_store, recovery_windows, os.path.join(output_dir, "logs"),
+            os.path.join(output_dir, "skipped.csv"), os.path.join(output_dir, "output.csv"), workers,
+            checkpoint_dir_path, resume
+        )
+        assert succeeded, f"recover_messages failed for windows {recovery_windows}"
+        return output_dir
+
+    @staticmethod
+    def read_outputs(output_dir):
+        """
+        :return: Dictionary of output file name -> the file's CSV rows, including its header.
+        :rtype: dict of str -> list of list of str
+        """
+        outputs = dict()
+        for file_name in OUTPUT_FILE_NAMES:
+            with open(os.path.join(output_dir, file_name), newline="") as f:
+                outputs[file_name] = list(csv.reader(f))
+        return outputs
+
+    def recover_messages_with_resume(self, recovery_windows, workers):
+        """
+        Runs `recover_messages` until it's interrupted at the 'Duplicates' strategy, then resumes it from its
+        checkpoints.
+
+        :return: Directory the logs and outputs of the resumed run were written to.
+        :rtype: str
+        """
+        checkpoint_dir_path = tempfile.mkdtemp(dir=self.temp_dir)
+        with interrupt_match_strategy("Duplicates"):
+            with self.assertRaises(RuntimeError):
+                self.recover_messages(recovery_windows, workers, checkpoint_dir_path)
+        self.assertNotEqual(os.listdir(checkpoint_dir_path), [])
+
+        return self.recover_messages(recovery_windows, workers, checkpoint_dir_path, resume=True)
+
+    def assert_outputs_equal(self, output_dir, expected_outputs):
+        outputs = self.read_outputs(output_dir)
+        for file_name in OUTPUT_FILE_NAMES:
+            self.assertEqual(outputs[file_name], expected_outputs[file_name], file_name)
+
+    def test_single_window(self):
+        window = self.recovery_windows[1]
+        expected_outputs = self.expected_window_outputs[1]
+        self.assertGreater(len(expected_outputs["skipped.csv"]), 1)
+        self.assertGreater(len(expected_outputs["output.csv"]), 1)
+
+        for workers in [1, 3]:
+            with self.subTest(workers=workers):
+                self.assert_outputs_equal(self.recover_messages([window], workers), expected_outputs)
+
+            with self.subTest(workers=workers, resume=True):
+                self.assert_outputs_equal(self.recover_messages_with_resume([window], workers), expected_outputs)
+
+    def test_multiple_windows(self):
+        # The outputs of both windows together are the outputs of each window, in date order, under one header.
+        expected_outputs = {
+            file_name: self.expected_window_outputs[0][file_name] + self.expected_window_outputs[1][file_name][1:]
+            for file_name in OUTPUT_FILE_NAMES
+        }
+
+        for workers in [1, 4]:
+            with self.subTest(workers=workers):
+                self.assert_outputs_equal(self.recover_messages(self.recovery_windows, workers), expected_outputs)
+
+            with self.subTest(workers=workers, resume=True):
+                self.assert_outputs_equal(
+                    self.recover_messages_with_resume(self.recovery_windows, workers), expected_outputs
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()